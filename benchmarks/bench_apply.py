@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Compare the apply latency of the native MSR engine with the intel-undervolt subprocess path.
+
+Both paths run against stand-ins so the benchmark needs neither root nor an Intel CPU: the MSR engine writes to a
+regular file through FakeMsrDevice, and the subprocess path rewrites an undervolt file and runs a no-op
+intel-undervolt executable, the same work Config.applyChanges used to do per apply.
+
+Usage: python3 benchmarks/bench_apply.py [-n ROUNDS]
+"""
+import argparse
+import os
+import stat
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from linux_undervolt import msr
+from linux_undervolt.undervolt_conf import UndervoltConf
+
+UNDERVOLT_CONF = """# Undervolting
+undervolt 0 'CPU' 0
+undervolt 1 'GPU' 0
+undervolt 2 'CPU Cache' 0
+undervolt 3 'System Agent' 0
+undervolt 4 'Analog I/O' 0
+
+interval 5000
+"""
+
+SETTINGS = {'cpu': -80, 'gpu': -50, 'cpu_cache': -80, 'sys_agent': 0, 'analog_io': 0}
+
+
+def timed(function, rounds: int) -> list:
+
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name: str, timings: list) -> None:
+
+    timings = sorted(timings)
+    print(f"{name:<12} median {statistics.median(timings) * 1e6:10.1f} us   "
+          f"p95 {timings[int(len(timings) * 0.95) - 1] * 1e6:10.1f} us")
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+
+        # Subprocess path: rewrite the undervolt file and run the intel-undervolt binary
+        conf_path = os.path.join(temp_dir, "intel-undervolt.conf")
+        with open(conf_path, 'w') as conf:
+            conf.write(UNDERVOLT_CONF)
+
+        binary = os.path.join(temp_dir, "intel-undervolt")
+        with open(binary, 'w') as fake:
+            fake.write("#!/bin/sh\nexit 0\n")
+        os.chmod(binary, os.stat(binary).st_mode | stat.S_IEXEC)
+
+        def subprocessApply():
+            with open(conf_path) as stream:
+                text = UndervoltConf(stream.read()).render(SETTINGS)
+            with open(conf_path, 'w') as stream:
+                stream.write(text)
+            subprocess.run([binary, "apply"], check=True)
+
+        # MSR path: fake device file with the mailbox emulated, descriptors kept open between applies
+        engine = msr.MsrEngine(os.path.join(temp_dir, "msr{cpu}"), temp_dir, msr.FakeMsrDevice)
+
+        def msrApply():
+            engine.apply(SETTINGS)
+
+        report("subprocess", timed(subprocessApply, args.rounds))
+        report("msr", timed(msrApply, args.rounds))
+        engine.close()
+
+
+if __name__ == "__main__":
+    main()
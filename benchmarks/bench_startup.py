@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Measure the cold start import latency of the CLI and the GUI.
+
+Every target is imported in a fresh interpreter with `-X importtime`, and the cumulative import time of the target
+module is reported together with the wall clock time of the whole interpreter run. The GUI targets are skipped when
+the GTK bindings are not installed.
+
+Usage: python3 benchmarks/bench_startup.py [-n ROUNDS] [--json]
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TARGETS = {
+    "cli": "linux_undervolt.cli",
+    "gui": "linux_undervolt.MainWindow",
+    "gui-advanced": "linux_undervolt.AdvancedWindow",
+}
+
+_IMPORT_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S+)\s*$')
+
+
+def importTime(module: str):
+    """
+    Import a module in a fresh interpreter. Returns (cumulative import time in s, wall time in s, loaded gi), or None
+    if the import failed.
+    """
+
+    start = time.perf_counter()
+    run = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}, sys; print('gi' in sys.modules)"],
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
+    )
+    wall = time.perf_counter() - start
+
+    if run.returncode:
+        return None
+
+    cumulative = 0
+    for line in run.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match and match.group(3) == module:
+            cumulative = int(match.group(2))
+
+    return cumulative / 1e6, wall, run.stdout.strip() == "True"
+
+
+def main() -> int:
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--rounds", type=int, default=10)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    results = {}
+    for name, module in TARGETS.items():
+        runs = [importTime(module) for _ in range(args.rounds)]
+        if None in runs:
+            results[name] = None
+            continue
+
+        results[name] = {
+            "import_s": statistics.median(run[0] for run in runs),
+            "wall_s": statistics.median(run[1] for run in runs),
+            "loads_gtk": runs[0][2]
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, result in results.items():
+            if result is None:
+                print(f"{name:<14} skipped (import failed, GTK bindings missing?)")
+                continue
+            print(f"{name:<14} import {result['import_s'] * 1e3:8.2f} ms   wall {result['wall_s'] * 1e3:8.2f} ms"
+                  f"   gtk {'yes' if result['loads_gtk'] else 'no'}")
+
+    # The CLI must never pull in GTK
+    cli = results.get("cli")
+    return 1 if cli is None or cli["loads_gtk"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
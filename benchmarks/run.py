@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Benchmark and regression suite.
+
+Runs every benchmark in an isolated HOME against the stand-in `intel-undervolt` and `pkexec` executables in
+benchmarks/fakebin, so no root access, polkit agent or Intel CPU is needed. The median time of every benchmark is
+compared to benchmarks/baseline.json; a benchmark slower than its baseline by more than the tolerance is reported as
+a regression and makes the suite exit with status 1.
+
+Usage:
+    python3 benchmarks/run.py                     run and compare against the baseline
+    python3 benchmarks/run.py --update-baseline   run and store the results as the new baseline
+    python3 benchmarks/run.py -k apply            only run benchmarks whose name contains "apply"
+
+Baselines are machine specific, regenerate them when moving the suite to another machine.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+FAKE_BIN = os.path.join(BENCH_DIR, "fakebin")
+BASELINE_FILE = os.path.join(BENCH_DIR, "baseline.json")
+
+UNDERVOLT_CONF = """# Enable the undervolt
+enable yes
+
+# CPU Undervolting
+# Usage: undervolt ${index} ${display_name} ${undervolt_value}
+undervolt 0 'CPU' 0
+undervolt 1 'GPU' 0
+undervolt 2 'CPU Cache' 0
+undervolt 3 'System Agent' 0
+undervolt 4 'Analog I/O' 0
+
+# Power Limits Alteration
+# power package 35/5 25/50
+
+# Daemon Update Interval
+interval 5000
+"""
+
+MEASURE_FRAME = (
+    "\x1b[H\x1b[2J"
+    "package-0:      {power:6.3f} W\n"
+    "core:           {core:6.3f} W\n"
+    "uncore:          0.153 W\n"
+    "dram:            0.951 W\n"
+    "\n"
+    "Package 0:      {temp:5.2f}°C\n"
+    "Core 0:         {temp:5.2f}°C\n"
+    "Core 1:         {temp:5.2f}°C\n"
+    "\n"
+    "Core 0:       {freq:7.2f} MHz\n"
+    "Core 1:       {freq:7.2f} MHz\n"
+)
+
+_benchmarks = {}
+
+def benchmark(rounds=50):
+    """
+    Register a benchmark. The decorated function receives the environment and returns a callable that is timed.
+    """
+
+    def register(function):
+        _benchmarks[function.__name__] = (function, rounds)
+        return function
+    return register
+
+
+###############
+# Environment #
+###############
+
+class Environment:
+    """
+    Isolated HOME, undervolt file and runtime directory with the stand-in executables first on PATH.
+    """
+
+    def __init__(self, temp_dir: str):
+        self.temp_dir = temp_dir
+        self.home = os.path.join(temp_dir, "home")
+        self.undervolt_file = os.path.join(temp_dir, "intel-undervolt.conf")
+        self.log = os.path.join(temp_dir, "intel-undervolt.log")
+
+        os.makedirs(self.home)
+        with open(self.undervolt_file, 'w') as conf:
+            conf.write(UNDERVOLT_CONF)
+
+        os.environ["HOME"] = self.home
+        os.environ["XDG_RUNTIME_DIR"] = temp_dir
+        os.environ["PATH"] = f"{FAKE_BIN}{os.pathsep}{os.environ.get('PATH', '')}"
+        os.environ["FAKE_UNDERVOLT_LOG"] = self.log
+        os.environ.pop("LINUX_UNDERVOLT_HELPER_ROOT", None)
+
+        sys.path.insert(0, ROOT)
+
+        from linux_undervolt import config
+        self.config_module = config
+
+        conf = config.Config.create_config()
+        conf.changeSettings('undervolt_path', self.undervolt_file)
+        conf.flush()
+
+    def config(self):
+        return self.config_module.Config()
+
+    def close(self) -> None:
+        from linux_undervolt import helper
+        for client in helper._clients.values():
+            client.request("shutdown")
+            client.close()
+
+
+##############
+# Benchmarks #
+##############
+
+@benchmark(rounds=500)
+def render_profile(env):
+    from linux_undervolt.undervolt_conf import UndervoltConf
+
+    settings = {'cpu': -80, 'gpu': -50, 'cpu_cache': -80, 'sys_agent': -10, 'analog_io': 0}
+
+    def run():
+        UndervoltConf(UNDERVOLT_CONF).render(settings)
+    return run
+
+
+@benchmark(rounds=50)
+def apply_end_to_end(env):
+    conf = env.config()
+
+    # The first apply starts the helper (through the fake pkexec when not running as root)
+    conf.applyChanges()
+    offsets = iter(range(10 ** 6))
+
+    def run():
+        conf.changeProfileSettings({'cpu': -(next(offsets) % 100), 'gpu': 0, 'cpu_cache': 0,
+                                    'sys_agent': 0, 'analog_io': 0})
+        if conf.applyChanges().returncode:
+            raise RuntimeError("apply failed")
+    return run
+
+
+@benchmark(rounds=20)
+def config_load_many_profiles(env):
+    conf = env.config()
+    for index in range(4, 500):
+        conf.changeProfileSettings({'cpu': -(index % 100), 'gpu': 0, 'cpu_cache': 0, 'sys_agent': 0, 'analog_io': 0},
+                                   str(index))
+    conf.flush()
+
+    def run():
+        env.config()
+    return run
+
+
+@benchmark(rounds=20)
+def config_save_many_profiles(env):
+    conf = env.config()
+
+    def run():
+        conf.changeSettings('profile', '0')
+        conf.flush()
+    return run
+
+
+@benchmark(rounds=20)
+def measure_parse_throughput(env):
+    from linux_undervolt.measure import MeasureParser, SampleStore
+
+    text = ''.join(
+        MEASURE_FRAME.format(power=5 + i % 10, core=3 + i % 5, temp=40 + i % 20, freq=800 + i * 3 % 3000)
+        for i in range(1000)
+    )
+
+    def run():
+        store = SampleStore()
+        store.extend(MeasureParser().feed(text))
+        if len(store) < 999:
+            raise RuntimeError("frames lost while parsing")
+    return run
+
+
+##########
+# Runner #
+##########
+
+def measureBenchmark(env, function, rounds: int) -> float:
+
+    run = function(env)
+    run()   # Warm up
+
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+
+    return statistics.median(timings)
+
+
+def main() -> int:
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", dest="filter", default='', help="only run benchmarks containing this string")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="allowed slowdown factor relative to the baseline (default 1.5)")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.isfile(BASELINE_FILE):
+        with open(BASELINE_FILE) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = {}
+    regressions = []
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        env = Environment(temp_dir)
+        try:
+            for name, (function, rounds) in _benchmarks.items():
+                if args.filter not in name:
+                    continue
+
+                median = measureBenchmark(env, function, rounds)
+                results[name] = median
+
+                reference = baseline.get(name)
+                if reference is None:
+                    verdict = "no baseline"
+                elif median > reference * args.tolerance:
+                    verdict = f"REGRESSION ({median / reference:.2f}x baseline)"
+                    regressions.append(name)
+                else:
+                    verdict = f"ok ({median / reference:.2f}x baseline)"
+
+                print(f"{name:<28} {median * 1e3:10.3f} ms   {verdict}")
+        finally:
+            env.close()
+
+    if args.update_baseline:
+        baseline.update(results)
+        with open(BASELINE_FILE, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        print(f"Baseline written to {BASELINE_FILE}")
+        return 0
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,22 +9,31 @@ import logging
 
 from .MainWindow import MainWindow
 from .TerminalOutput import TerminalOutput
+from .PowerOutput import PowerOutput
+from .ReadbackOutput import ReadbackOutput
+from .CoreOutput import CoreOutput
+from .rapl import RaplSampler
+from .measure import MeasureParser, SampleStore
 from . import config
+from . import tracing
 from .constants import ADVANCED_WINDOW
 
 
 class AdvancedWindow(MainWindow):
     
+    @tracing.traced("gui.AdvancedWindow")
     def __init__(self):
         self.logger = logging.getLogger(self.__class__.__name__)
         
         self.config = config.Config()
         self.builder = Gtk.Builder()
         
-        self.builder.add_from_file(ADVANCED_WINDOW)        
+        with tracing.span("gui.glade", file=ADVANCED_WINDOW):
+            self.builder.add_from_file(ADVANCED_WINDOW)        
         
-        self.__initialSetup__()
-        self.builder.connect_signals(self)
+        with tracing.span("gui.setup"):
+            self.__initialSetup__()
+            self.builder.connect_signals(self)
         
         self.topLevelWindow = self.builder.get_object("Main")
         self.destroy_signal = self.topLevelWindow.connect("delete-event", Gtk.main_quit)
@@ -33,6 +42,9 @@ class AdvancedWindow(MainWindow):
         
     def __initialSetup__(self) -> None:
         super().__initialSetup__()
+
+        # Live measurement data shared by the tabs of the window
+        self.samples = SampleStore()
         
         self._addTerminalOutput_()
     
@@ -40,23 +52,39 @@ class AdvancedWindow(MainWindow):
     def _addTerminalOutput_(self):
         # 1st Tab
         box1 = self.builder.get_object("live-power-tab")
-        term1 = TerminalOutput(box1)
-        box1.add(term1)
-        
-        # Run with delay so that the password prompt only shows up after the main GUI, and is focused
-        GObject.timeout_add(1000, lambda: self.__termCommand__(term1, "pkexec intel-undervolt measure"))
+        sampler = RaplSampler()
+
+        if sampler.available:
+            box1.add(PowerOutput(box1, sampler, store=self.samples))
+        else:
+            # The energy counters are not readable by this user, fall back to the privileged measure command
+            parser = MeasureParser()
+            term1 = TerminalOutput(box1, on_lines=lambda lines: self.samples.extend(parser.feedLines(lines)))
+            box1.add(term1)
+
+            # Run with delay so that the password prompt only shows up after the main GUI, and is focused
+            GObject.timeout_add(1000, lambda: self.__termCommand__(term1, "pkexec intel-undervolt measure"))
         # term1.runCommand("pkexec intel-undervolt measure")
         self.logger.debug("Finished 1st tab setup")
         
         # 2nd Tab
         box2 = self.builder.get_object("current-undervolt-tab")
-        term2 = TerminalOutput(box2)
-        term2.output.get_buffer().set_text(
-            "Unable to add this until I understand PolKit or I'll be spammed with sudo requests."
-            " If someone wants to work on this and help me out or pull request this functionality, that'd be great.")
-        box2.add(term2)
+        box2.add(ReadbackOutput(box2, self))
         self.logger.debug("Finished 2nd tab setup")
+
+        # 3rd Tab
+        box3 = self.builder.get_object("core-monitor-tab")
+        box3.add(CoreOutput(box3, self))
+        self.logger.debug("Finished 3rd tab setup")
     
+    def __applyDone__(self, job, run, error) -> None:
+        super().__applyDone__(job, run, error)
+
+        # Show what the apply actually put in effect
+        for child in self.builder.get_object("current-undervolt-tab").get_children():
+            if isinstance(child, ReadbackOutput):
+                child.refresh()
+
     def __termCommand__(self, term: TerminalOutput, command: str):
         term.runCommand(command)
         return False
@@ -0,0 +1,102 @@
+import gi
+gi.require_version("Gtk", "3.0")
+
+from gi.repository import Gtk, GObject
+
+import logging
+import time
+
+from .coremon import CoreMonitor
+
+
+class CoreOutput(Gtk.ScrolledWindow):
+    """
+    Live per-core frequency, temperature and throttle counts, with the throttle events of the session listed against
+    the profile that was active when they happened. Readings are only taken while the widget is shown.
+    """
+
+    # Number of throttle events listed
+    EVENTS = 20
+
+    def __init__(self, parent, window, *args, interval=1.0, sysfs_root='/'):
+        super().__init__(*args)
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self.__parent = parent
+        self.window = window
+        self.monitor = CoreMonitor(sysfs_root, profile=lambda: self.window.config.getSettings('profile'))
+        self.__labels = {}
+
+        self.grid = Gtk.Grid()
+        self.grid.set_column_spacing(20)
+        self.grid.set_row_spacing(5)
+        self.grid.set_margin_start(10)
+        self.grid.set_margin_top(10)
+
+        for column, title in enumerate(("", "Type", "Frequency", "Temperature", "Throttled")):
+            self.grid.attach(Gtk.Label(label=f"<b>{title}</b>", use_markup=True, xalign=1), column, 0, 1, 1)
+
+        rows = [(f"cpu{cpu.cpu}", cpu.type or "") for cpu in self.monitor.cpus]
+        rows += [(f"package {package}", "") for package in sorted({cpu.package for cpu in self.monitor.cpus})]
+
+        for row, (name, core_type) in enumerate(rows, 1):
+            self.grid.attach(Gtk.Label(label=name, xalign=0), 0, row, 1, 1)
+            self.grid.attach(Gtk.Label(label=core_type, xalign=1), 1, row, 1, 1)
+
+            labels = []
+            for column in (2, 3, 4):
+                value = Gtk.Label(label="-", xalign=1)
+                value.get_style_context().add_class("monospace")
+                self.grid.attach(value, column, row, 1, 1)
+                labels.append(value)
+            self.__labels[name] = labels
+
+        self.events = Gtk.Label(label="No throttling", xalign=0, yalign=0)
+        self.grid.attach(self.events, 0, len(rows) + 1, 5, 1)
+        self.__events = []
+
+        self.set_vexpand(True)
+        self.set_hexpand(True)
+        self.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        self.add(self.grid)
+
+        self.__source = GObject.timeout_add(int(interval * 1000), self.update)
+        self.connect("destroy", self.__onDestroy)
+
+        self.logger.info("Finished setup for Core Output")
+
+    def update(self) -> bool:
+
+        if not self.get_mapped():
+            return True
+
+        sample = self.monitor.read()
+
+        def show(labels, freq, temp, throttle):
+            labels[0].set_text(f"{freq:6.0f} MHz" if freq is not None else "-")
+            labels[1].set_text(f"{temp:5.1f} °C" if temp is not None else "-")
+            labels[2].set_text(str(throttle) if throttle is not None else "-")
+
+        for cpu in sample['cpus']:
+            show(self.__labels[f"cpu{cpu['cpu']}"], cpu['freq'], cpu['temp'], cpu['throttle'])
+        for package, values in sample['packages'].items():
+            show(self.__labels[f"package {package}"], None, values['temp'], values['throttle'])
+
+        if sample['events']:
+            names = self.window.config.getProfileNames()
+            for event in sample['events']:
+                where = f"core {event['core']}" if event['kind'] == 'core' else f"package {event['package']}"
+                self.__events.append(
+                    f"{time.strftime('%H:%M:%S', time.localtime(sample['time']))}  {where} throttled "
+                    f"{event['count']} time(s) with profile {names.get(event['profile'], event['profile'])}"
+                )
+
+            del self.__events[:-self.EVENTS]
+            self.events.set_text('\n'.join(reversed(self.__events)))
+
+        return True
+
+    def __onDestroy(self, _) -> None:
+        GObject.source_remove(self.__source)
+        self.monitor.close()
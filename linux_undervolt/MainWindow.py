@@ -2,16 +2,19 @@ import gi
 gi.require_version("Gtk", "3.0")
 gi.require_version('Notify', '0.7')
 from gi.repository import Gtk as gtk
+from gi.repository import GLib
 from gi.repository import Notify
 
 from datetime import date
-from time import sleep
 import logging
 
 
 from . import config
 from . import backend
+from . import tracing
+from . import undervolt_conf
 from .constants import MAIN_WINDOW
+from .worker import BackgroundWorker
 
 class MainWindow:
 
@@ -23,6 +26,18 @@ class MainWindow:
         'analog_io': 'anIO_scale'
     }
 
+    # RAPL sub-domain shown next to the package power for a slider during a live preview
+    PREVIEW_DOMAINS = {
+        'cpu': 'core',
+        'cpu_cache': 'core',
+        'gpu': 'uncore'
+    }
+
+    # Runs helper operations off the GTK main loop. Shared by the simple and advanced windows, so an apply that is
+    # running when switching modes still completes.
+    worker = None
+
+    @tracing.traced("gui.MainWindow")
     def __init__(self, first_time=False):
         
         self.logger = logging.getLogger(self.__class__.__name__)
@@ -32,11 +47,13 @@ class MainWindow:
         self.config = config.Config()
         self.builder = gtk.Builder()
         
-        self.builder.add_from_file(MAIN_WINDOW)
+        with tracing.span("gui.glade", file=MAIN_WINDOW):
+            self.builder.add_from_file(MAIN_WINDOW)
         
         # Initial setup
-        self.__initialSetup__()
-        self.builder.connect_signals(self)
+        with tracing.span("gui.setup"):
+            self.__initialSetup__()
+            self.builder.connect_signals(self)
 
         # Show Main window
         self.topLevelWindow = self.builder.get_object("Main")
@@ -78,19 +95,23 @@ class MainWindow:
         and applies them to the various widgets.
         """
 
+        self.__profileList__()
         self.__scaleChange__()
         self.__getPowerProfiles__()
         self.__powerSwitch__()
         self.__startupMenuItem__()
         
         Notify.init("Linux Undervolt Tool")
-        
-        # Set correct profile button active
-        active_profile = self.config.getSettings('profile')
-        button_id = f"profile_{active_profile}_button"
-        
-        radio_button = self.builder.get_object(button_id)
-        radio_button.set_active(True)
+
+        if MainWindow.worker is None:
+            MainWindow.worker = BackgroundWorker(GLib.idle_add)
+
+        # Live preview of the sliders, see togglePreview
+        self.preview = None
+        self.preview_labels = {}
+        self.preview_plane = None
+        self.preview_source = None
+        self.builder.get_object("Main").connect("delete-event", self.__previewQuit__)
 
     def __scaleChange__(self) -> None:
         """
@@ -99,13 +120,12 @@ class MainWindow:
 
         current_settings = self.config.getProfileSettings()
 
-        for key, value in current_settings.items():
+        for key, object_id in MainWindow.SCALE_MAP.items():
 
-            object_id = MainWindow.SCALE_MAP[key]
             scale = self.builder.get_object(object_id)
             
             # Values are stored as strings thus need to be converted to int
-            value = int(value)
+            value = int(current_settings.get(key, 0))
             scale.set_value(value)
             
         self.logger.info(f"Set scales to Profile {self.config.getActiveProfile()} settings")
@@ -113,6 +133,29 @@ class MainWindow:
         save_button = self.builder.get_object("save_button")
         save_button.set_label("Save")
 
+    def __profileList__(self) -> None:
+        """
+        Fill the profile selector and the AC/battery dropdowns with the stored profiles.
+        """
+
+        names = self.config.getProfileNames()
+
+        for object_id in ("profile_combo", "ac_profile", "bat_profile"):
+            combo = self.builder.get_object(object_id)
+            selected = combo.get_active_id()
+
+            combo.remove_all()
+            for profile, name in names.items():
+                combo.append(profile, name)
+
+            if selected is not None:
+                combo.set_active_id(selected)
+
+        self.builder.get_object("profile_combo").set_active_id(self.config.getSettings('profile'))
+
+        # The last profile can not be deleted
+        self.builder.get_object("profile_delete_button").set_sensitive(len(names) > 1)
+
     def __getPowerProfiles__(self) -> None:
         """
         Change power profile dropdowns to settings value.
@@ -124,19 +167,17 @@ class MainWindow:
         ac_profile = settings['ac_profile']
 
         if bat_profile:
-            bat_profile = int(bat_profile)
             bat_profile_dropdown = self.builder.get_object("bat_profile")
             bat_profile_check = self.builder.get_object("bat_profile_bool")
 
-            bat_profile_dropdown.set_active(bat_profile)
+            bat_profile_dropdown.set_active_id(bat_profile)
             bat_profile_check.set_active(True)
 
         if ac_profile:
-            ac_profile = int(ac_profile)
             ac_profile_dropdown = self.builder.get_object("ac_profile")
             ac_profile_check = self.builder.get_object("ac_profile_bool")
 
-            ac_profile_dropdown.set_active(ac_profile)
+            ac_profile_dropdown.set_active_id(ac_profile)
             ac_profile_check.set_active(True)
 
     def __powerSwitch__(self) -> None:
@@ -163,12 +204,119 @@ class MainWindow:
 
     def onSliderChange(self, widget) -> None:
         """
-        Changes the save button to be italicised when changes are made to the undervolt values.
+        Changes the save button to be italicised when changes are made to the undervolt values. During a live preview
+        the new values are also applied once the sliders stop moving.
         """
 
         label = widget.get_child()
         label.set_markup("<i>Save*</i>")
 
+        if self.preview is not None and self.preview.active:
+            values = self.__scaleValues__()
+
+            # The power readings are shown next to the slider that moved last
+            changed = [plane for plane, value in values.items() if self.preview.target.get(plane) != value]
+            if changed:
+                self.preview_plane = changed[0]
+
+            self.preview.change(values)
+
+    def __scaleValues__(self) -> dict:
+
+        return {
+            key: int(self.builder.get_object(object_id).get_value()) for key, object_id in MainWindow.SCALE_MAP.items()
+        }
+
+    ################
+    # Live Preview #
+    ################
+
+    def togglePreview(self, widget) -> None:
+        """
+        Turn the live preview on or off. While it is on, slider changes are applied without saving them and the power
+        draw is shown next to the slider that moved last. Turning it off reverts to the offsets in effect before.
+        """
+
+        from .preview import LivePreview
+
+        if widget.get_active():
+            self.preview = LivePreview(self.config, self.worker, GLib.timeout_add, GLib.source_remove,
+                                       on_applied=self.__previewApplied__)
+            self.preview.start()
+
+            for key, object_id in MainWindow.SCALE_MAP.items():
+                label = gtk.Label(label="", xalign=1)
+                label.get_style_context().add_class("monospace")
+                self.builder.get_object(object_id).get_parent().pack_start(label, False, True, 0)
+                label.show()
+                self.preview_labels[key] = label
+
+            if self.preview.rapl.available:
+                self.preview_source = GLib.timeout_add_seconds(1, self.__previewPower__)
+            else:
+                self.preview_labels['cpu'].set_text("Power readings need read access to the RAPL energy counters")
+
+            self.logger.info("Live preview on")
+        else:
+            self.__stopPreview__()
+            self.logger.info("Live preview off, reverting")
+
+    def __stopPreview__(self, on_reverted=None) -> None:
+
+        if self.preview is None:
+            return
+
+        self.preview.stop(revert=True, on_reverted=on_reverted)
+        self.preview.close()
+        self.preview = None
+
+        if self.preview_source is not None:
+            GLib.source_remove(self.preview_source)
+            self.preview_source = None
+
+        for label in self.preview_labels.values():
+            label.destroy()
+        self.preview_labels = {}
+
+    def __previewQuit__(self, *_) -> bool:
+
+        if self.preview is None or not self.preview.active:
+            return False
+
+        # The worker thread ends with the program, so the program quits once the revert is done. The window is gone
+        # right away, and stopping the delete-event keeps it from quitting before.
+        self.topLevelWindow.hide()
+        self.__stopPreview__(on_reverted=gtk.main_quit)
+        return True
+
+    def __previewPower__(self) -> bool:
+
+        if self.preview is None:
+            return False
+
+        watts = self.preview.power()
+        label = self.preview_labels.get(self.preview_plane)
+        if label is None or not watts:
+            return True
+
+        package = sum(value for key, value in watts.items() if key.startswith('package') and '/' not in key)
+        text = f"{package:.1f} W package"
+
+        domain = MainWindow.PREVIEW_DOMAINS.get(self.preview_plane)
+        domain_watts = [value for key, value in watts.items() if key.endswith(f"/{domain}")]
+        if domain_watts:
+            text += f", {sum(domain_watts):.1f} W {domain}"
+
+        label.set_text(text)
+        return True
+
+    def __previewApplied__(self, settings, ok) -> None:
+
+        if not ok and self.destroy_signal is not None:
+            label = self.preview_labels.get(self.preview_plane or 'cpu')
+            if label is not None:
+                label.set_text("Applying the preview failed")
+
 
     ####################
     # Config Functions #
@@ -179,7 +327,7 @@ class MainWindow:
         startup_value = 1 if widget.get_active() else 0
 
         self.config.changeSettings('startup', str(startup_value))
-        backend.startupChange(startup_value)
+        self.worker.submit("startup", lambda job: backend.startupChange(startup_value))
     
     def toggleAdvanced(self, widget) -> None:
         from .AdvancedWindow import AdvancedWindow
@@ -193,6 +341,9 @@ class MainWindow:
             window = MainWindow()
             
         
+        # The new window starts without the live preview
+        self.__stopPreview__()
+
         self.topLevelWindow.disconnect(self.destroy_signal)
         self.topLevelWindow.destroy()
         
@@ -212,8 +363,9 @@ class MainWindow:
 
         state_str = str(state).lower()
         
-        if not state:
-            run = backend.removeUdevRule()
+        # The watcher service also runs the governor and the application switching, keep it installed for them
+        if not state and not backend.watcherInUse(self.config):
+            run = backend.removePowerWatcher()
 
             # If the run fails, do not change the UI. TODO: Add error message stating that the run failed.
             if run:
@@ -224,20 +376,199 @@ class MainWindow:
 
     def changeProfile(self, widget) -> None:
         """
-        Change the undervolt profile based on which radiobutton is selected. Also redraws the scales based on the new
-        profile's settings.
+        Change the undervolt profile to the one selected in the profile dropdown. Also redraws the scales based on the
+        new profile's settings.
         """
-        
-        group_list = widget.get_group()
 
-        for option in group_list:
-            if option.get_active():
-                new_profile = option.get_label()
-                self.config.changeSettings('profile', new_profile)
-                break
+        new_profile = widget.get_active_id()
+
+        # The dropdown is emptied and refilled when profiles are added or removed
+        if new_profile is None or new_profile == self.config.getSettings('profile'):
+            return
+
+        self.config.changeSettings('profile', new_profile)
+        self.__scaleChange__()
+
+    def __askProfileName__(self, title: str, name="") -> str:
+        """
+        Ask for a profile name. Returns an empty string when cancelled.
+        """
+
+        dialog = gtk.Dialog(title=title, transient_for=self.topLevelWindow, flags=0)
+        dialog.add_buttons(
+            gtk.STOCK_CANCEL, gtk.ResponseType.CANCEL,
+            gtk.STOCK_OK, gtk.ResponseType.OK
+        )
+        dialog.set_default_response(gtk.ResponseType.OK)
+
+        entry = gtk.Entry()
+        entry.set_text(name)
+        entry.set_activates_default(True)
+        dialog.get_content_area().add(entry)
+        entry.show()
+
+        response = dialog.run()
+        name = entry.get_text().strip()
+        dialog.destroy()
+
+        return name if response == gtk.ResponseType.OK else ""
+
+    def __profileError__(self, text: str) -> None:
 
+        dialog = gtk.MessageDialog(
+            message_type=gtk.MessageType.ERROR,
+            buttons=gtk.ButtonsType.OK,
+            text=text
+        )
+        dialog.run()
+        dialog.destroy()
+
+    def newProfile(self, _) -> None:
+        """
+        Create a profile starting from the settings of the active profile and make it active.
+        """
+
+        name = self.__askProfileName__("New profile")
+        if not name:
+            return
+
+        try:
+            profile = self.config.createProfile(name, self.config.getProfileSettings())
+        except ValueError as err:
+            self.__profileError__(str(err))
+            return
+
+        self.config.changeSettings('profile', profile)
+        self.__profileList__()
         self.__scaleChange__()
 
+    def renameProfile(self, _) -> None:
+
+        name = self.__askProfileName__("Rename profile", self.config.getProfileName())
+        if not name:
+            return
+
+        try:
+            self.config.renameProfile(self.config.getSettings('profile'), name)
+        except ValueError as err:
+            self.__profileError__(str(err))
+            return
+
+        self.__profileList__()
+
+    def deleteProfile(self, _) -> None:
+
+        dialog = gtk.MessageDialog(
+            message_type=gtk.MessageType.QUESTION,
+            buttons=gtk.ButtonsType.YES_NO,
+            text=f"Delete profile {self.config.getProfileName()}?"
+        )
+        response = dialog.run()
+        dialog.destroy()
+
+        if response != gtk.ResponseType.YES:
+            return
+
+        self.config.deleteProfile(self.config.getSettings('profile'))
+        self.__profileList__()
+        self.__scaleChange__()
+
+    def editLimits(self, _) -> None:
+        """
+        Edit the power limits, thermal offset and HWP hint of the active profile. The limits are saved to the profile
+        and written to the undervolt file on the next apply.
+        """
+
+        settings = self.config.getProfileSettings()
+
+        dialog = gtk.Dialog(title=f"Limits of {self.config.getProfileName()}", transient_for=self.topLevelWindow,
+                            flags=0)
+        dialog.add_buttons(
+            gtk.STOCK_CANCEL, gtk.ResponseType.CANCEL,
+            gtk.STOCK_OK, gtk.ResponseType.OK
+        )
+
+        grid = gtk.Grid(column_spacing=6, row_spacing=6, margin=6)
+        dialog.get_content_area().add(grid)
+
+        def spin(key, limits, digits=0, step=1):
+            button = gtk.SpinButton.new_with_range(limits[0], limits[1], step)
+            button.set_digits(digits)
+            button.set_value(float(settings.get(key) or 0))
+            return button
+
+        def combo(options, active):
+            box = gtk.ComboBoxText()
+            for option in options:
+                box.append(option, option)
+            box.set_active_id(active)
+            return box
+
+        power_check = gtk.CheckButton(label="Power limits", active=bool(settings.get('pl1')))
+        tjoffset_check = gtk.CheckButton(label="Thermal offset (°C)", active=bool(settings.get('tjoffset')))
+        hwphint_check = gtk.CheckButton(label="HWP hint", active=bool(settings.get('hwphint')))
+
+        # A time window of 0 leaves the window of the limit unchanged
+        window_range = (0, undervolt_conf.WINDOW_RANGE[1])
+        powers = {
+            key: spin(key, undervolt_conf.POWER_RANGE) for key in ('pl1', 'pl2')
+        }
+        windows = {
+            key: spin(f"{key}_window", window_range, 3, 0.001) for key in ('pl1', 'pl2')
+        }
+        tjoffset = spin('tjoffset', undervolt_conf.TJOFFSET_RANGE)
+
+        hint = (settings.get('hwphint') or "switch load:single:0.90 performance balance_performance").split()
+        mode = combo(undervolt_conf.HWP_MODES, hint[0])
+        algorithm = gtk.Entry(text=hint[1])
+        load_hint = combo(undervolt_conf.HWP_HINTS, hint[2])
+        normal_hint = combo(undervolt_conf.HWP_HINTS, hint[3])
+
+        grid.attach(power_check, 0, 0, 3, 1)
+        for row, (key, label) in enumerate((('pl1', "Long term (PL1) W / s"), ('pl2', "Short term (PL2) W / s")), 1):
+            grid.attach(gtk.Label(label=label, xalign=0), 0, row, 1, 1)
+            grid.attach(powers[key], 1, row, 1, 1)
+            grid.attach(windows[key], 2, row, 1, 1)
+
+        grid.attach(tjoffset_check, 0, 3, 1, 1)
+        grid.attach(tjoffset, 1, 3, 1, 1)
+
+        grid.attach(hwphint_check, 0, 4, 1, 1)
+        grid.attach(mode, 1, 4, 1, 1)
+        grid.attach(algorithm, 2, 4, 1, 1)
+        grid.attach(gtk.Label(label="Load / normal hint", xalign=0), 0, 5, 1, 1)
+        grid.attach(load_hint, 1, 5, 1, 1)
+        grid.attach(normal_hint, 2, 5, 1, 1)
+
+        grid.show_all()
+
+        while dialog.run() == gtk.ResponseType.OK:
+            new_settings = {key: value for key, value in settings.items() if key not in undervolt_conf.LIMITS}
+
+            if power_check.get_active():
+                for key in ('pl1', 'pl2'):
+                    new_settings[key] = f"{powers[key].get_value():g}"
+                    if windows[key].get_value():
+                        new_settings[f"{key}_window"] = f"{windows[key].get_value():g}"
+            if tjoffset_check.get_active():
+                new_settings['tjoffset'] = str(tjoffset.get_value_as_int())
+            if hwphint_check.get_active():
+                new_settings['hwphint'] = ' '.join((
+                    mode.get_active_id(), algorithm.get_text().strip(),
+                    load_hint.get_active_id(), normal_hint.get_active_id()
+                ))
+
+            try:
+                undervolt_conf.parseLimits(new_settings)
+            except ValueError as err:
+                self.__profileError__(str(err))
+                continue
+
+            self.config.changeProfileSettings(new_settings)
+            break
+
+        dialog.destroy()
+
     def setPowerProfile(self, _) -> None:
         """
         docstring
@@ -251,8 +582,6 @@ class MainWindow:
         ac_power_bool = self.builder.get_object("ac_profile_bool").get_active()
         bat_power_bool = self.builder.get_object("bat_profile_bool").get_active()
 
-        backend_dict = {}
-
         # Battery power profile is required to set profiles
         if ac_power_bool and not bat_power_bool:
 
@@ -265,20 +594,26 @@ class MainWindow:
 
         if ac_power_bool:
             ac_power_profile = self.builder.get_object("ac_profile")
-            ac_profile = ac_power_profile.get_active()
-            options['ac_profile'] = str(ac_profile)
-            backend_dict['ac'] = str(ac_profile)
+            options['ac_profile'] = ac_power_profile.get_active_id() or ""
         
         if bat_power_bool:
             bat_power_profile = self.builder.get_object("bat_profile")
-            bat_profile = bat_power_profile.get_active()
-            options['battery_profile'] = str(bat_profile)
-            backend_dict['bat'] = str(bat_profile)
+            options['battery_profile'] = bat_power_profile.get_active_id() or ""
 
         self.config.changeSettings(options)
-        code = backend.createUdevRule(backend_dict).returncode
-        
-        if not code:
+
+        def install(job):
+            # The watcher service reads the profiles from the config file
+            job.progress(0.3, "Saving")
+            self.config.flush()
+            job.progress(0.6, "Installing the service")
+            return backend.createPowerWatcher(self.config)
+
+        self.worker.submit("power_watcher", install, self.__powerProfileDone__)
+
+    def __powerProfileDone__(self, job, run, error) -> None:
+
+        if error is None and not run.returncode:
             Notify.Notification.new(
                 summary="Profile switching active",
                 body="Switching profiles on the power supply change is now active."
@@ -349,13 +684,11 @@ class MainWindow:
         Save scale values to the profile in the config
         """
 
-        # Get the values from the scales
-        current_settings = self.config.getProfileSettings()
+        # Get the values from the scales, the limits of the profile are kept
+        new_settings = self.config.getProfileSettings()
 
-        new_settings = {}
-        for key in current_settings:
+        for key, object_id in MainWindow.SCALE_MAP.items():
 
-            object_id = MainWindow.SCALE_MAP[key]
             scale = self.builder.get_object(object_id)
 
             new_value = scale.get_value()
@@ -370,16 +703,56 @@ class MainWindow:
 
     def applyProfile(self, _) -> None:
         """
-        Apply the undervolt from the current profile values.
+        Apply the undervolt from the current profile values. The apply runs in the background; clicking the button
+        again while it runs queues another apply of the values at that time, which runs once the first one is done.
+        Further clicks replace the queued apply, so only the latest one runs.
         """
-        
-        code = self.config.applyChanges().returncode
-        sleep(0.3)
 
-        if not code:
+        queued = self.worker.busy("apply")
+
+        def apply(job):
+            job.progress(0.3, "Saving")
+            self.config.flush()
+            if job.cancelled:
+                return None
+
+            job.progress(0.6, "Applying")
+            return self.config.applyChanges()
+
+        self.worker.submit("apply", apply, self.__applyDone__, self.__applyProgress__)
+        self.__applyProgress__(None, 0.0, "Queued" if queued else "Waiting")
+
+    def __applyProgress__(self, job, fraction, text) -> None:
+        """
+        Show the progress of an apply on the apply button. Without text the button is reset.
+        """
+
+        # The window may have been replaced (simple/advanced mode switch) while applying
+        if self.destroy_signal is None:
+            return
+
+        button = self.builder.get_object("apply_button")
+        if text is None:
+            button.set_label("Apply")
+            button.set_tooltip_text(None)
+        else:
+            button.set_label(f"{text}…")
+            button.set_tooltip_text("Another apply is queued" if self.worker.waiting("apply") else None)
+
+    def __applyDone__(self, job, run, error) -> None:
+
+        # A queued apply takes over the button
+        if not self.worker.busy("apply"):
+            self.__applyProgress__(job, None, None)
+
+        if error is None and not run.returncode:
+            # The saved profile is in effect now, a live preview reverts to it
+            if self.preview is not None:
+                self.preview.rebase(self.config.getProfileSettings())
+
             Notify.Notification.new(
                 summary="Profile Applied",
-                body=f"Profile {self.config.getSettings('profile')}'s settings were applied."
+                body=f"Profile {self.config.getProfileName()}'s settings were applied."
             ).show()
         else:
             dialog = gtk.MessageDialog(
@@ -0,0 +1,67 @@
+import gi
+gi.require_version("Gtk", "3.0")
+
+from gi.repository import Gtk, GObject
+
+import logging
+
+from .rapl import RaplSampler
+from .measure import SampleStore, metricName
+
+class PowerOutput(Gtk.ScrolledWindow):
+    """
+    Live power readout of the RAPL domains, sampled in-process. Samples are also added to the given store.
+    """
+
+    def __init__(self, parent, sampler: RaplSampler, *args, store: SampleStore = None):
+        super().__init__(*args)
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self.__parent = parent
+        self.sampler = sampler
+        self.store = store
+        self.__labels = {}
+
+        self.grid = Gtk.Grid()
+        self.grid.set_column_spacing(20)
+        self.grid.set_row_spacing(5)
+        self.grid.set_margin_start(10)
+        self.grid.set_margin_top(10)
+
+        for row, domain in enumerate(self.sampler.domains):
+            name = Gtk.Label(label=domain.key, xalign=0)
+            value = Gtk.Label(label="-", xalign=1)
+            value.get_style_context().add_class("monospace")
+
+            self.grid.attach(name, 0, row, 1, 1)
+            self.grid.attach(value, 1, row, 1, 1)
+            self.__labels[domain.key] = value
+
+        self.set_vexpand(True)
+        self.set_hexpand(True)
+        self.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        self.add(self.grid)
+
+        # Prime the counters so the first update already has a previous reading
+        self.sampler.sample()
+        self.__source = GObject.timeout_add(int(self.sampler.interval * 1000), self.update)
+        self.connect("destroy", self.__onDestroy)
+
+        self.logger.info("Finished setup for Power Output")
+
+    def update(self) -> bool:
+
+        sample = self.sampler.sample()
+
+        for key, watts in sample.items():
+            self.__labels[key].set_text(f"{watts:8.3f} W")
+
+        if self.store is not None and sample:
+            self.store.append({metricName('power', key): watts for key, watts in sample.items()})
+
+        return True
+
+    def __onDestroy(self, _) -> None:
+        GObject.source_remove(self.__source)
+        self.sampler.close()
@@ -0,0 +1,117 @@
+import gi
+gi.require_version("Gtk", "3.0")
+
+from gi.repository import Gtk, GObject
+
+import logging
+import time
+
+from . import readback
+from .constants import PLANES
+from .undervolt_conf import LIMITS
+
+
+class ReadbackOutput(Gtk.ScrolledWindow):
+    """
+    Shows the offsets and limits in effect next to the values saved in the active profile. The applied state is read
+    through the readback cache on the background worker, and only while the widget is shown, so the helper is not
+    started (and no password asked) until the tab is opened.
+    """
+
+    def __init__(self, parent, window, *args, interval=5):
+        super().__init__(*args)
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self.__parent = parent
+        self.window = window
+        self.__labels = {}
+
+        self.grid = Gtk.Grid()
+        self.grid.set_column_spacing(20)
+        self.grid.set_row_spacing(5)
+        self.grid.set_margin_start(10)
+        self.grid.set_margin_top(10)
+
+        for column, title in enumerate(("", "Applied", "Saved")):
+            self.grid.attach(Gtk.Label(label=f"<b>{title}</b>", use_markup=True, xalign=1), column, 0, 1, 1)
+
+        # The HWP hint can not be read back
+        keys = PLANES + tuple(key for key in LIMITS if key != 'hwphint')
+        for row, key in enumerate(keys, 1):
+            self.grid.attach(Gtk.Label(label=key, xalign=0), 0, row, 1, 1)
+
+            labels = []
+            for column in (1, 2):
+                value = Gtk.Label(label="-", xalign=1)
+                value.get_style_context().add_class("monospace")
+                self.grid.attach(value, column, row, 1, 1)
+                labels.append(value)
+            self.__labels[key] = labels
+
+        row = len(self.__labels) + 1
+        self.status = Gtk.Label(label="Not read yet", xalign=0)
+        self.grid.attach(self.status, 0, row, 2, 1)
+
+        refresh = Gtk.Button(label="Refresh")
+        refresh.connect("clicked", lambda _: self.refresh(force=True))
+        self.grid.attach(refresh, 2, row, 1, 1)
+
+        self.set_vexpand(True)
+        self.set_hexpand(True)
+        self.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        self.add(self.grid)
+
+        # Answered from the cache, the helper is only asked after the TTL, a resume or a microcode reload
+        self.__source = GObject.timeout_add_seconds(interval, self.update)
+        self.connect("map", lambda _: self.refresh())
+        self.connect("destroy", self.__onDestroy)
+
+        self.logger.info("Finished setup for Readback Output")
+
+    def update(self) -> bool:
+
+        if self.get_mapped():
+            self.refresh()
+        return True
+
+    def refresh(self, force=False) -> None:
+
+        config = self.window.config
+        cache = readback.getCache(config)
+
+        def read(job):
+            return cache.get(force=force), config.getProfileSettings()
+
+        self.window.worker.submit("readback", read, self.__show)
+
+    def __show(self, job, result, error) -> None:
+
+        # The window may have been replaced (simple/advanced mode switch) while reading
+        if self.window.destroy_signal is None:
+            return
+
+        if error is not None or result[0] is None:
+            self.status.set_text("Reading the applied values failed")
+            return
+
+        state, settings = result
+        applied = dict(state['offsets'], **state['limits'])
+        differences = readback.difference(state, settings)
+
+        for key, (applied_label, saved_label) in self.__labels.items():
+            value = applied.get(key)
+            applied_label.set_text("-" if value is None else f"{value:g}")
+            saved_label.set_text(str(settings.get(key) or "-"))
+
+            if key in differences:
+                applied_label.set_markup(f"<b>{applied_label.get_text()}</b>")
+
+        read_at = time.strftime('%H:%M:%S', time.localtime(state['time']))
+        self.status.set_text(
+            f"Read {read_at} ({state['source']}): "
+            + (f"{len(differences)} value(s) differ from the profile" if differences else "matches the profile")
+        )
+
+    def __onDestroy(self, _) -> None:
+        GObject.source_remove(self.__source)
@@ -1,64 +1,136 @@
 from typing import Optional, List
+from collections import deque
 
 import gi
 gi.require_version("Gtk", "3.0")
 
-from gi.repository import Gtk, GObject, Gdk
+from gi.repository import Gtk, GLib
 
 import logging
 import os
+import signal
 import subprocess
-import fcntl
 
 class TerminalOutput(Gtk.ScrolledWindow):
-    
-    def __init__(self, parent, *args,):
+
+    def __init__(self, parent, *args, scrollback=1000, on_lines=None):
         super().__init__(*args)
-        
+
         self.logger = logging.getLogger(self.__class__.__name__)
-        
+
         self.__parent = parent
         self.__lastCommand = None
-        
+        self.__outputWatch = None
+        self.__partial = b''
+
+        # Called with every batch of new lines, e.g. to feed a MeasureParser
+        self.on_lines = on_lines
+
+        # Ring buffer of the lines currently shown, the text buffer is trimmed to the same size
+        self.scrollback = scrollback
+        self.lines = deque(maxlen=scrollback)
+
         self.output = Gtk.TextView()
-        
+
         # TextView attributes
         self.output.set_monospace(True)
         self.output.set_editable(False)
         self.output.set_cursor_visible(False)
         self.output.set_wrap_mode(Gtk.WrapMode.WORD)
         # self.output.modify_bg(Gtk.StateType.NORMAL, Gdk.color_parse("black"))
-        
+
         # Scroll attributes
         self.set_vexpand(True)
         self.set_hexpand(True)
         self.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
-        
-        
+
+
         self.add_with_viewport(self.output)
+        self.connect("destroy", self.__onDestroy)
         self.logger.info("Finished setup for Terminal Output")
         # self.output.get_buffer().set_text("Testing")
-        
+
     def runCommand(self, command: str, args: Optional[List[str]]=None):
         self.logger.info(f"Running command: {command} {args}")
         if args is None:
             args = []
-        
+
         self.__lastCommand = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
-        GObject.timeout_add(1000, lambda: self.update_terminal(self.__lastCommand.stdout))
+
+        fd = self.__lastCommand.stdout.fileno()
+        os.set_blocking(fd, False)
+
+        self.__outputWatch = GLib.io_add_watch(
+            fd, GLib.PRIORITY_DEFAULT, GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self.__onOutput
+        )
+
+        # The child watch stays active after the widget is destroyed so the process is always reaped
+        GLib.child_watch_add(GLib.PRIORITY_DEFAULT, self.__lastCommand.pid, self.__onExit, self.__lastCommand)
         self.logger.info(f"Terminal with command '{command}' added")
-        
-    
-    def non_block_read(self, output) -> str:
-        fd = output.fileno()
-        fl = fcntl.fcntl(fd, fcntl.F_GETFL)
-        fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
-        try:
-            return output.read().decode("utf-8").strip()
-        except:
-            return ""
-        
-    def update_terminal(self, stdout):
-        self.output.get_buffer().set_text(self.non_block_read(stdout))
-        return self.__lastCommand.poll() is None
-        
\ No newline at end of file
+
+    def appendLines(self, lines: List[str]) -> None:
+        """
+        Append complete lines to the end of the output, dropping the oldest ones beyond the scrollback limit.
+        """
+
+        if not lines:
+            return
+
+        self.lines.extend(lines)
+
+        if self.on_lines is not None:
+            self.on_lines(lines)
+
+        text_buffer = self.output.get_buffer()
+        text_buffer.insert(text_buffer.get_end_iter(), ''.join(f"{line}\n" for line in lines))
+
+        excess = text_buffer.get_line_count() - 1 - self.scrollback
+        if excess > 0:
+            text_buffer.delete(text_buffer.get_start_iter(), text_buffer.get_iter_at_line(excess))
+
+        self.output.scroll_to_mark(text_buffer.get_insert(), 0, False, 0, 0)
+        text_buffer.place_cursor(text_buffer.get_end_iter())
+
+    def __onOutput(self, fd, condition) -> bool:
+
+        if condition & GLib.IO_IN:
+            try:
+                data = os.read(fd, 65536)
+            except BlockingIOError:
+                return True
+
+            if data:
+                data = self.__partial + data
+                *complete, self.__partial = data.split(b'\n')
+                self.appendLines([line.decode("utf-8", "replace") for line in complete])
+                return True
+
+        # End of output, flush what is left of an unterminated line
+        if self.__partial:
+            self.appendLines([self.__partial.decode("utf-8", "replace")])
+            self.__partial = b''
+
+        self.__outputWatch = None
+        return False
+
+    def __onExit(self, pid, status, process) -> None:
+        # GLib passes the raw wait status, e.g. 256 for exit code 1
+        returncode = os.waitstatus_to_exitcode(status)
+        self.logger.info(f"Command with pid {pid} exited with status {returncode}")
+        process.returncode = returncode
+        GLib.spawn_close_pid(pid)
+
+    def __onDestroy(self, _) -> None:
+
+        if self.__outputWatch is not None:
+            GLib.source_remove(self.__outputWatch)
+            self.__outputWatch = None
+
+        if self.__lastCommand is not None:
+            if self.__lastCommand.returncode is None:
+                try:
+                    os.kill(self.__lastCommand.pid, signal.SIGTERM)
+                except (ProcessLookupError, PermissionError):
+                    # Commands run through pkexec can not be signalled, they exit on the closed pipe instead
+                    pass
+            self.__lastCommand.stdout.close()
@@ -1,27 +1,41 @@
 #!/usr/bin/env python3
-import gi
-gi.require_version("Gtk", "3.0")
-from gi.repository import Gtk
+import sys
 
-from .MainWindow import MainWindow
-from .AdvancedWindow import AdvancedWindow
-from .config import Config, configExists
-from .backend import createBackup
+def gui() -> None:
+    from . import tracing
 
-def main() -> None:
-    window = None
-    if not configExists():
-        window = MainWindow(True)
-    else:
-        advanced = Config().getBool("advanced")
-        window = AdvancedWindow() if advanced else MainWindow()
-        
-    try:
-        window.topLevelWindow.show_all()
-    except RuntimeError:
-        pass
+    with tracing.span("gui.startup"):
+        # GTK is only imported when the GUI is actually started, the CLI does not need it
+        with tracing.span("gui.import"):
+            import gi
+            gi.require_version("Gtk", "3.0")
+            from gi.repository import Gtk
+
+            from .MainWindow import MainWindow
+            from .AdvancedWindow import AdvancedWindow
+            from .config import Config, configExists
+
+        window = None
+        if not configExists():
+            window = MainWindow(True)
+        else:
+            advanced = Config().getBool("advanced")
+            window = AdvancedWindow() if advanced else MainWindow()
+
+        try:
+            window.topLevelWindow.show_all()
+        except RuntimeError:
+            pass
     
     Gtk.main()
 
+def main() -> None:
+    # Any argument selects the headless command line interface
+    if len(sys.argv) > 1:
+        from .cli import main as cli
+        sys.exit(cli())
+
+    gui()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Per-application profile switching.
+
+The APPLICATIONS section of the config file maps process names to profiles:
+
+    [APPLICATIONS]
+    make = 3
+    blender = 3
+    steam = 2
+
+While a mapped process is running its profile is applied (the first entry wins when several are running), and when
+the last of them exits the profile that was active before is restored. In the power watcher service the profiles are
+requested from the arbiter (see arbiter.py), where a running application takes precedence over the governor and the
+power source switch.
+
+Processes are found by scanning /proc incrementally: the names of the processes are cached by (pid, inode of the
+/proc/<pid> directory), so a scan only lists /proc and reads the comm file of processes that started since the previous
+scan. The inode changes when a pid is reused, so a reused pid is never mistaken for the process cached before.
+"""
+import collections
+import logging
+import os
+import threading
+
+from typing import Dict, Optional
+
+# Process names (comm) are truncated by the kernel to 15 characters
+COMM_LENGTH = 15
+
+
+def processName(name: str) -> str:
+    return name.strip().lower()[:COMM_LENGTH]
+
+
+class ProcessScanner:
+    """
+    Keeps a count of the running processes by name, updated incrementally on every scan().
+    """
+
+    def __init__(self, proc_root='/'):
+        self.proc_dir = os.path.join(proc_root, "proc")
+        self._processes = {}
+        self.counts = collections.Counter()
+
+    def _readName(self, pid: str) -> Optional[str]:
+
+        try:
+            with open(os.path.join(self.proc_dir, pid, "comm"), 'rb') as comm_file:
+                return processName(comm_file.read().decode(errors='replace'))
+        except OSError:
+            # The process exited between listing /proc and reading its name
+            return None
+
+    def scan(self) -> collections.Counter:
+        """
+        Update and return the process counts by name.
+        """
+
+        running = {}
+        with os.scandir(self.proc_dir) as entries:
+            for entry in entries:
+                if entry.name.isdigit():
+                    running[(entry.name, entry.inode())] = None
+
+        for key in self._processes.keys() - running.keys():
+            name = self._processes.pop(key)
+            self.counts[name] -= 1
+            if not self.counts[name]:
+                del self.counts[name]
+
+        for key in running.keys() - self._processes.keys():
+            name = self._readName(key[0])
+            if name is not None:
+                self._processes[key] = name
+                self.counts[name] += 1
+
+        return self.counts
+
+
+class AppWatcher:
+    """
+    Switches profiles while mapped applications run.
+
+    Arguments:
+    mapping   - {process name: profile}, in order of priority
+    apply     - Callback receiving the profile of the running applications, or None when the last of them exited and
+                the profile that was active before has to be restored
+    proc_root - Root of the proc tree
+    """
+
+    def __init__(self, mapping: Dict[str, str], apply, proc_root='/'):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.apply = apply
+        self.scanner = ProcessScanner(proc_root)
+        self.setMapping(mapping)
+
+        self.profile = None
+        self._stop = threading.Event()
+
+    def setMapping(self, mapping: Dict[str, str]) -> None:
+        self.mapping = {processName(name): str(profile) for name, profile in mapping.items()}
+
+    def target(self, counts) -> Optional[str]:
+        """
+        Return the profile of the first running mapped application, or None when none is running.
+        """
+
+        for name, profile in self.mapping.items():
+            if counts.get(name):
+                return profile
+        return None
+
+    def check(self) -> bool:
+        """
+        Scan the processes and switch profiles if needed. Returns whether apply was called.
+        """
+
+        if not self.mapping and self.profile is None:
+            return False
+
+        target = self.target(self.scanner.scan())
+        if target == self.profile:
+            return False
+
+        if target is None:
+            self.logger.info("No mapped application running, restoring the previous profile")
+        else:
+            self.logger.info(f"Mapped application running, switching to profile {target}")
+
+        self.profile = target
+        self.apply(target)
+        return True
+
+    def run(self, interval=2.0, reload=None) -> None:
+        """
+        Check every `interval` seconds until stop() is called. `reload` is called before every check and may return a
+        new mapping.
+        """
+
+        while True:
+            if reload is not None:
+                mapping = reload()
+                if mapping is not None:
+                    self.setMapping(mapping)
+
+            self.check()
+            if self._stop.wait(interval):
+                break
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def configReloader(config_file: str):
+    """
+    Return a function that returns the mapping from the config file when the file changed and None otherwise.
+    """
+
+    from .config import Config
+
+    modified = None
+
+    def reload() -> Optional[Dict[str, str]]:
+        nonlocal modified
+
+        try:
+            mtime = os.stat(config_file).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime == modified:
+            return None
+
+        modified = mtime
+        return Config(config_file).getApplications()
+    return reload
+
+
+def main(interval=2.0) -> None:
+    """
+    Run the application watcher for the user's config. Started by the power watcher service, the watcher idles while
+    no applications are mapped.
+    """
+
+    from .arbiter import getArbiter
+    from .constants import CONFIG_FILE
+
+    watcher = AppWatcher({}, lambda profile: getArbiter().request('app', profile))
+    watcher.run(interval, configReloader(CONFIG_FILE))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,112 @@
+"""
+Arbitration between the profile switchers of the power watcher service.
+
+The power source switch (powerwatch.py), the governor (governor.py) and the per-application switching (appwatch.py)
+run as threads of the same service. Instead of each making its own profile active, they request a profile from the
+arbiter, which makes the request of the source with the highest precedence the active profile:
+
+    app         a mapped application is running
+    governor    the profile selected by the matching governor rule (or its default profile, if set)
+    power       the profile mapped to AC or battery power
+
+A source withdraws its request with None, e.g. when the last mapped application exits, and the next source in line
+takes over. Without any request the profile that was active before the first one is restored, or the profile the user
+selected (in the GUI or CLI) since the last switch. Requests are handled one at a time and a profile is only applied
+when the winning profile changes, so the switchers never overwrite each other.
+"""
+import logging
+import threading
+
+from typing import Callable, Dict, Optional
+
+# Sources in order of precedence
+SOURCES = ('app', 'governor', 'power')
+
+
+class ProfileArbiter:
+    """
+    Arguments:
+    apply   - Makes a profile id the active profile and applies it
+    active  - Returns the id of the active profile
+    resolve - Returns the id of a profile given its id or name, None if there is no such profile
+    """
+
+    def __init__(self, apply: Callable, active: Callable, resolve: Callable = str):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.apply = apply
+        self.active = active
+        self.resolve = resolve
+
+        self.requests: Dict[str, str] = {}
+        self.base = None
+        self.profile = None
+        self._lock = threading.Lock()
+
+    def winner(self) -> Optional[str]:
+        """
+        Return the profile that should be active: the request with the highest precedence, the base profile without
+        any request.
+        """
+
+        for source in SOURCES:
+            if source in self.requests:
+                return self.requests[source]
+        return self.base
+
+    def request(self, source: str, profile: Optional[str]) -> Optional[str]:
+        """
+        Set the request of a source, or withdraw it with None. Returns the profile applied, None when the active
+        profile stays the same.
+        """
+
+        if source not in SOURCES:
+            raise ValueError(f"Unknown source: {source}")
+
+        with self._lock:
+            # A profile selected by the user since the last switch is the one restored once every request is withdrawn
+            active = self.active()
+            if active != self.profile:
+                self.base = self.profile = active
+
+            if profile is None:
+                self.requests.pop(source, None)
+            else:
+                profile_id = self.resolve(profile)
+                if profile_id is None:
+                    self.logger.error(f"Unknown profile requested by {source}: {profile}")
+                    self.requests.pop(source, None)
+                else:
+                    self.requests[source] = profile_id
+
+            target = self.winner()
+            if target is None or target == self.profile:
+                return None
+
+            winner = next((name for name in SOURCES if self.requests.get(name) == target), "restore")
+            self.logger.info(f"Switching to profile {target} ({winner})")
+            self.apply(target)
+            self.profile = target
+            return target
+
+
+_arbiter = None
+_arbiter_lock = threading.Lock()
+
+def getArbiter() -> ProfileArbiter:
+    """
+    Return the arbiter shared by the switchers of the process, working on the user's config.
+    """
+
+    global _arbiter
+
+    from .config import Config
+    from .governor import applyProfile
+
+    with _arbiter_lock:
+        if _arbiter is None:
+            _arbiter = ProfileArbiter(
+                applyProfile,
+                lambda: Config().getSettings('profile'),
+                lambda profile: Config().findProfile(profile)
+            )
+        return _arbiter
@@ -0,0 +1,277 @@
+"""
+Automated search for stable undervolt offsets.
+
+For every plane the tuner looks for the most negative offset that passes the stress workload, either by binary search
+or by stepping down. Progress is written to disk (synced) before and after every test, so when the machine locks up
+or resets during a test the next run marks that offset as unstable and continues from the last offset known to be
+stable.
+"""
+import json
+import logging
+import os
+
+from typing import Dict, Iterable, Optional
+
+from .config import atomicWrite
+from .constants import CONFIG_DIR, PLANES
+
+STATE_FILE = os.path.join(CONFIG_DIR, "autotune.json")
+
+# Progress of simulated runs, kept apart from the progress of tuning the hardware
+SIMULATED_STATE_FILE = os.path.join(CONFIG_DIR, "autotune-simulated.json")
+
+
+############
+# Backends #
+############
+
+class HardwareBackend:
+    """
+    Applies offsets through the privileged helper and checks them with the built-in stress workload. Candidates are
+    applied through the MSR engine without being written to the undervolt file, so an unstable offset is not applied
+    again on the next boot. Applying through intel-undervolt would write every candidate to the file before it is
+    tested, so tuning is refused when the MSR engine is unavailable.
+    """
+
+    def __init__(self, workload, undervolt_file="/etc/intel-undervolt.conf", engine="msr"):
+        self.workload = workload
+        self.undervolt_file = undervolt_file
+        self.engine = engine
+
+    def prepare(self) -> None:
+        from . import helper
+
+        response = helper.getClient(self.undervolt_file).request("read", engine=self.engine)
+        if response.get('source') != 'msr':
+            raise RuntimeError(
+                f"The MSR engine is unavailable, offsets can not be tried without writing them to {self.undervolt_file}"
+            )
+
+        # The reference results have to be computed at the (stable) settings in effect before tuning
+        self.workload.reference()
+
+    def apply(self, settings: Dict[str, int]) -> None:
+        from . import helper
+
+        response = helper.getClient(self.undervolt_file).request(
+            "apply", settings=settings, engine=self.engine, persist=False, fallback=False
+        )
+        if not response['ok']:
+            raise RuntimeError(f"Applying {settings} failed: {response.get('error', response.get('output'))}")
+
+    def stress(self) -> bool:
+        return self.workload.run().stable
+
+
+class SimulatedBackend:
+    """
+    Backend for testing the tuner without hardware. A plane is unstable below its configured threshold (mV); planes
+    without a threshold are always stable. With crash=True an unstable offset raises SimulatedCrash from apply,
+    imitating a machine that locks up before the stress test reports anything.
+    """
+
+    def __init__(self, thresholds: Dict[str, int], crash=False):
+        self.thresholds = thresholds
+        self.crash = crash
+        self.settings = {}
+        self.tests = 0
+
+    def prepare(self) -> None:
+        pass
+
+    def _stable(self) -> bool:
+        return all(self.settings.get(plane, 0) >= threshold for plane, threshold in self.thresholds.items())
+
+    def apply(self, settings: Dict[str, int]) -> None:
+        self.settings = dict(settings)
+        if self.crash and not self._stable():
+            raise SimulatedCrash(settings)
+
+    def stress(self) -> bool:
+        self.tests += 1
+        return self._stable()
+
+
+class SimulatedCrash(Exception):
+    """
+    Raised by SimulatedBackend to imitate a hard reset.
+    """
+
+
+#########
+# Tuner #
+#########
+
+class AutoTuner:
+    """
+    Arguments:
+    backend    - Object with prepare(), apply(settings) and stress() -> bool
+    planes     - Planes to tune, in order
+    state_file - Where the progress is stored
+    start      - Offsets known to be stable, used as the starting point (defaults to 0 for every plane)
+    step       - Resolution of the search in mV
+    limit      - Most negative offset that is tried
+    mode       - "binary" or "step"
+    """
+
+    def __init__(self, backend, planes: Iterable[str] = PLANES, state_file=STATE_FILE, start=None, step=5,
+                 limit=-150, mode="binary"):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.backend = backend
+        self.planes = list(planes)
+        self.state_file = state_file
+        self.step = step
+        self.limit = limit
+        self.mode = mode
+
+        if mode not in ("binary", "step"):
+            raise ValueError(f"Unknown search mode: {mode}")
+
+        self.state = self._load() or self._newState(start or {})
+
+    #########
+    # State #
+    #########
+
+    def _newState(self, start: dict) -> dict:
+        return {
+            "settings": {plane: int(start.get(plane, 0)) for plane in PLANES},
+            "planes": {plane: {"stable": int(start.get(plane, 0)), "unstable": None, "done": False}
+                       for plane in self.planes},
+            "testing": None
+        }
+
+    def _load(self) -> Optional[dict]:
+
+        try:
+            with open(self.state_file) as state_file:
+                state = json.load(state_file)
+        except FileNotFoundError:
+            return None
+
+        # A test that never finished means the machine went down while running it
+        testing = state.get("testing")
+        if testing is not None:
+            plane = state["planes"][testing["plane"]]
+            self.logger.warning(f"Resuming after a crash while testing {testing['plane']} at {testing['offset']} mV")
+            plane["unstable"] = testing["offset"]
+            state["testing"] = None
+
+        for plane in self.planes:
+            state["planes"].setdefault(plane, {"stable": state["settings"][plane], "unstable": None, "done": False})
+
+        return state
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.state_file) or '.', exist_ok=True)
+        atomicWrite(self.state_file, json.dumps(self.state, indent=2))
+
+    def reset(self) -> None:
+        try:
+            os.remove(self.state_file)
+        except FileNotFoundError:
+            pass
+
+    ##########
+    # Search #
+    ##########
+
+    def _candidate(self, plane: str) -> Optional[int]:
+        """
+        Return the next offset to test for a plane, or None when the search for the plane is finished.
+        """
+
+        progress = self.state["planes"][plane]
+        stable = progress["stable"]
+        unstable = progress["unstable"]
+
+        if unstable is not None and stable - unstable <= self.step:
+            return None
+        if stable <= self.limit:
+            return None
+
+        if self.mode == "step":
+            return max(stable - self.step, self.limit)
+
+        # Binary search on the step grid between the stable offset and the first known failure. Without a known
+        # failure the search space reaches one step past the limit so the limit itself gets tested.
+        floor = unstable if unstable is not None else self.limit - self.step
+        steps = max(1, (stable - floor) // self.step // 2)
+        return max(stable - steps * self.step, self.limit)
+
+    def testOffset(self, plane: str, offset: int) -> bool:
+
+        settings = dict(self.state["settings"], **{plane: offset})
+
+        # Persist what is about to be tested before touching the hardware
+        self.state["testing"] = {"plane": plane, "offset": offset}
+        self.save()
+
+        try:
+            self.backend.apply(settings)
+            stable = self.backend.stress()
+        except (RuntimeError, KeyboardInterrupt):
+            # The helper refused the offset or the user stopped the test, which says nothing about its stability.
+            # Anything else keeps the marker and counts as a crash.
+            self.state["testing"] = None
+            self.save()
+            raise
+
+        progress = self.state["planes"][plane]
+        if stable:
+            progress["stable"] = offset
+            self.state["settings"][plane] = offset
+        else:
+            progress["unstable"] = offset
+
+        self.state["testing"] = None
+        self.save()
+
+        self.logger.info(f"{plane} at {offset} mV: {'stable' if stable else 'unstable'}")
+        return stable
+
+    def tunePlane(self, plane: str) -> int:
+
+        while True:
+            candidate = self._candidate(plane)
+            if candidate is None:
+                break
+            self.testOffset(plane, candidate)
+
+        self.state["planes"][plane]["done"] = True
+        self.save()
+        return self.state["planes"][plane]["stable"]
+
+    def applyStable(self) -> None:
+        """
+        Apply the offsets known to be stable, e.g. after the search was interrupted.
+        """
+
+        try:
+            self.backend.apply(self.state["settings"])
+        except Exception as err:
+            self.logger.error(f"Applying the stable offsets {self.state['settings']} failed: {err}")
+
+    def run(self, margin=0) -> Dict[str, int]:
+        """
+        Tune every plane and return the resulting offsets, backed off by `margin` mV for safety. The result is
+        applied before returning.
+        """
+
+        self.backend.prepare()
+
+        try:
+            for plane in self.planes:
+                if not self.state["planes"][plane]["done"]:
+                    self.tunePlane(plane)
+        except BaseException:
+            # Never leave an untested or unstable offset applied
+            self.applyStable()
+            raise
+
+        result = {
+            plane: min(0, value + margin) if plane in self.planes else value
+            for plane, value in self.state["settings"].items()
+        }
+        self.backend.apply(result)
+        return result
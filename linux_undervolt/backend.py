@@ -1,99 +1,119 @@
+import io
 import os
 import subprocess
-import tempfile
+import sys
 import zipfile
 
 from configparser import ConfigParser
 
+from . import helper, tracing
 from .config import CONFIG_DIR
-from .constants import HOME, FILE_DIR
+from .constants import FILE_DIR, HOME
 
-def createUdevRule(options: dict) -> None:
-    """
-    Creates a toggle for the power profiles that is automatically called when the power source is changed between battery
-    and AC power.
-    """
+# Files of the udev based profile switching used by older versions. Removed when the power watcher is installed.
+UDEV_RULE = "/etc/udev/rules.d/100.linux-undervolt.rules"
+POWERSAVE_SERVICE = "/etc/systemd/system/linux-undervolt.powersave.service"
+POWERSAVE_ENV = "/etc/systemd/system/linux-undervolt.powersave.env"
 
-    bat_profile = options.get('bat', False)
-    ac_profile = options.get('ac', False)
+WATCHER_UNIT = "linux-undervolt.powerwatch.service"
+WATCHER_SERVICE = f"/etc/systemd/system/{WATCHER_UNIT}"
+WATCHER_ENV = "/etc/systemd/system/linux-undervolt.powerwatch.env"
 
-    # The files are first going to be created in a temporary directory, then moved to the correct location, and then
-    # deleted from the filesystem.
-    with tempfile.TemporaryDirectory() as tmp_dir:
+def powerWatcherFiles(home: str, exporter_path=None) -> dict:
+    """
+    Return the contents of the systemd service running the power watcher and its environment file, keyed by their
+    install location. The watcher reads the AC/battery profiles from the user's config on every change, so the
+    service does not need to be reinstalled when the mapping changes.
 
-        # First create the systemd service responsible for the switch of profiles
-        filedir = os.path.join(tmp_dir, "temp.service")
-        with open(filedir, 'w') as service_file:
-    
-            config = ConfigParser()
-            
-            # The default optionxform function converts keys to lowercase when writing. This skips that step.
-            config.optionxform = str
+    The path of the metrics exporter is the exception: the service writes it as root, so it is only taken from the
+    environment file and not from the user's config.
 
-            config["Unit"] = {
-                "Description": "Toggle Power Profiles on Power change"
-            }
-            config['Service'] = {
-                "Type": "oneshot",
-                "RemainAfterExit": "yes",
-                "EnvironmentFile": "/etc/systemd/system/linux-undervolt.powersave.env"
-            }
+    The service runs the interpreter and the copy of the package that installed it, so it also works for installs
+    outside of the system Python (e.g. pip --user or a virtualenv).
+    """
 
-            if bat_profile:
-                config['Service']['ExecStart'] = f"/usr/bin/python3 /opt/linux-undervolt/config.py -set-profile {bat_profile}"
-            if ac_profile:
-                config['Service']['ExecStop'] = f"/usr/bin/python3 /opt/linux-undervolt/config.py -set-profile {ac_profile}"
+    from .exporter import EXPORTER_PATH_VARIABLE
 
+    config = ConfigParser()
 
-            config['Install'] = {"WantedBy": "multi-user.target"}
-            
-            config.write(service_file, space_around_delimiters=False)
+    # The default optionxform function converts keys to lowercase when writing. This skips that step.
+    config.optionxform = str
 
-        # Add environment variables since the service will be run as root
-        env_dir = os.path.join(tmp_dir, "temp.env")
+    config["Unit"] = {
+        "Description": "Switch undervolt profiles on power source change"
+    }
+    config['Service'] = {
+        "Type": "simple",
+        "EnvironmentFile": WATCHER_ENV,
+        "ExecStart": f'"{sys.executable}" -m linux_undervolt.powerwatch',
+        "Restart": "on-failure"
+    }
+    config['Install'] = {"WantedBy": "multi-user.target"}
 
-        with open(env_dir, 'w') as env_file:
-            env_file.write(f'HOME={HOME}\n')
+    service_file = io.StringIO()
+    config.write(service_file, space_around_delimiters=False)
 
-        # Next create the Udev rule to trigger the service on power source change
-        temp_rule = os.path.join(tmp_dir, "linux-undervolt.temp")
-        with open(temp_rule, 'w') as udev_rule:
+    # Add environment variables since the service will be run as root
+    env_file = f'HOME={home}\nPYTHONPATH="{os.path.dirname(FILE_DIR)}"\n'
+    if exporter_path:
+        env_file += f'{EXPORTER_PATH_VARIABLE}={exporter_path}\n'
 
-            bat = f'ACTION=="change", SUBSYSTEM=="power_supply", ENV{{POWER_SUPPLY_ONLINE}}=="0", RUN+="/usr/bin/systemctl start linux-undervolt.powersave"'
-            ac = f'ACTION=="change", SUBSYSTEM=="power_supply", ENV{{POWER_SUPPLY_ONLINE}}=="1", RUN+="/usr/bin/systemctl stop linux-undervolt.powersave"'
+    return {
+        WATCHER_SERVICE: service_file.getvalue(),
+        WATCHER_ENV: env_file
+    }
 
-            if bat_profile:
-                udev_rule.write(bat)
-            if ac_profile:
-                udev_rule.write("\n")
-                udev_rule.write(ac)
+def watcherOptions(config) -> dict:
+    """
+    Return the parameters of the install_watcher helper operation for a config.
+    """
 
-        # Run the shell script to move and copy the files to their appropriate places
-        script_file = os.path.join(FILE_DIR, 'powersave.sh')
+    return {"home": HOME, "exporter_path": config.getSettings().get('exporter_path') or None}
 
-        command_1 = f'chmod +x {script_file}'   # Make the shell script executable
-        command_2 = f'{script_file} {tmp_dir}'  # Execute shell script
+@tracing.traced("backend.createPowerWatcher")
+def createPowerWatcher(config) -> subprocess.CompletedProcess:
+    """
+    Install and start the service that automatically switches the power profiles when the power source is changed
+    between battery and AC power.
+    """
 
-        command_run = subprocess.run(f"pkexec sh -c '{command_1}; {command_2}'", shell=True)
-    
-    return command_run
+    response = helper.getClient().request("install_watcher", **watcherOptions(config))
 
-def removeUdevRule() -> int:
+    return subprocess.CompletedProcess(("install_watcher",), response['returncode'], stdout=response.get('output'))
 
-    udev_rule = "/etc/udev/rules.d/100.linux-undervolt.rules"
-    systemd_service_dir = "/etc/systemd/system/"
+@tracing.traced("backend.removePowerWatcher")
+def removePowerWatcher() -> int:
 
-    if os.path.isfile(udev_rule):
-        systemd_service = os.path.join(systemd_service_dir, 'linux-undervolt.powersave.service')
-        systemd_env = os.path.join(systemd_service_dir, 'linux-undervolt.powersave.env')
+    client = helper.getClient()
 
-        command = f"pkexec rm -f {udev_rule} {systemd_service} {systemd_env}"
-        run = subprocess.run(command, shell=True, stdout=subprocess.DEVNULL)
-        return run.returncode
+    if any(os.path.isfile(client.systemPath(path)) for path in (WATCHER_SERVICE, UDEV_RULE)):
+        return client.request("remove_watcher")['returncode']
 
     else:
         return 0
 
+def addWatcherStep(transaction: helper.Transaction, config) -> None:
+    """
+    Add installing the power watcher to a transaction when the config needs it, and removing it otherwise.
+    """
+
+    if config.getBool('battery_switch') or watcherInUse(config):
+        transaction.installWatcher(**watcherOptions(config))
+    else:
+        transaction.removeWatcher()
+
+def watcherInUse(config) -> bool:
+    """
+    Return True when the profile governor, per-application switching, the telemetry recorder, the applied state
+    verification or the metrics exporter run in the power watcher service, so the service has to stay installed even
+    without AC/battery switching.
+    """
+
+    from . import exporter, governor, readback, telemetry
+
+    return (governor.isEnabled(config) or bool(config.getApplications()) or telemetry.isEnabled(config)
+            or readback.isEnabled(config) or exporter.isEnabled(config))
+
 def createBackup() -> None:
 
     undervolt_file = '/etc/intel-undervolt.conf'
@@ -102,16 +122,11 @@ def createBackup() -> None:
     with zipfile.ZipFile(zip_file, 'w') as backup_archive:
         backup_archive.write(undervolt_file, 'intel-undervolt.conf')
 
-def startupChange(value: int) -> None:
+@tracing.traced("backend.startupChange")
+def startupChange(value: int) -> int:
     """
     Set the startup behaviour for the undervolt. If on, the undervolt is applied on boot.
     Should only be called after the undervolt settings have been tested by the user.
     """
-    key = {
-        0: "stop",
-        1: "start"
-    }
 
-    command = f"pkexec systemctl {key[value]} intel-undervolt"
-    run = subprocess.run(command, shell=True, stdout=subprocess.DEVNULL)
-    return run.returncode
+    return helper.getClient().request("startup", value=value)['returncode']
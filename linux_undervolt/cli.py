@@ -0,0 +1,1010 @@
+"""
+Headless command line interface.
+
+Nothing in this module (or the modules it imports) loads GTK, so it is safe and fast to call from services and
+scripts. Every command accepts --json for machine readable output.
+"""
+import argparse
+import configparser
+import itertools
+import json
+import os
+import sys
+import time
+
+from . import config
+from .constants import PLANES
+from .undervolt_conf import LIMITS, parseLimits
+
+
+def _output(args, data, text: str) -> None:
+
+    if args.json:
+        print(json.dumps(data, indent=2))
+    else:
+        print(text)
+
+
+def _formatProfile(settings: dict) -> str:
+
+    values = [f"{plane}={settings.get(plane, 0)}" for plane in PLANES]
+    values += [f"{key}={settings[key]!r}" if key == 'hwphint' else f"{key}={settings[key]}"
+               for key in LIMITS if settings.get(key)]
+    return '  '.join(values)
+
+
+def _loadConfig() -> config.Config:
+
+    if not config.configExists():
+        sys.exit("No configuration found. Run the GUI once to create it.")
+    return config.Config()
+
+
+def _profileArgument(conf: config.Config, profile) -> str:
+    """
+    Return the id of the profile given by id or name, or of the active profile if None.
+    """
+
+    if profile is None:
+        return str(conf.getActiveProfile())
+
+    profile_id = conf.findProfile(profile)
+    if profile_id is None:
+        sys.exit(f"Unknown profile: {profile}")
+    return profile_id
+
+
+############
+# Commands #
+############
+
+def listProfiles(args) -> int:
+
+    conf = _loadConfig()
+    active = str(conf.getActiveProfile())
+    names = conf.getProfileNames()
+
+    if args.json:
+        profiles = {profile: dict(conf.getProfileSettings(profile), name=name) for profile, name in names.items()}
+        _output(args, {"active": active, "profiles": profiles}, '')
+        return 0
+
+    width = max(map(len, names.values()), default=0)
+    lines = []
+    for profile, name in names.items():
+        # Settings are only loaded with --verbose, listing stays fast with many profiles
+        settings = f"  {_formatProfile(conf.getProfileSettings(profile))}" if args.verbose else ''
+        lines.append(f"{'*' if profile == active else ' '} {profile:>3}  {name:<{width}}{settings}".rstrip())
+
+    print('\n'.join(lines))
+    return 0
+
+
+def showProfile(args) -> int:
+
+    conf = _loadConfig()
+    profile = _profileArgument(conf, args.profile)
+    settings = conf.getProfileSettings(profile)
+
+    lines = [f"{plane}: {settings.get(plane, 0)}" for plane in PLANES]
+    lines += [f"{key}: {settings[key]}" for key in LIMITS if settings.get(key)]
+
+    _output(args, {"profile": profile, "settings": settings}, '\n'.join(lines))
+    return 0
+
+
+def editProfile(args) -> int:
+
+    from .helper import OFFSET_RANGE
+
+    conf = _loadConfig()
+    profile = _profileArgument(conf, args.profile)
+    settings = conf.getProfileSettings(profile)
+
+    for assignment in args.values:
+        key, _, value = assignment.partition('=')
+
+        if key in LIMITS:
+            # An empty value removes the limit from the profile
+            if value.strip():
+                settings[key] = value.strip()
+            else:
+                settings.pop(key, None)
+            continue
+
+        if key not in PLANES:
+            sys.exit(f"Unknown setting: {key}. Valid settings: {', '.join(PLANES + LIMITS)}")
+        try:
+            offset = int(value)
+        except ValueError:
+            sys.exit(f"Invalid offset for {key}: {value!r}")
+
+        # The helper refuses anything else, so it is not stored in the profile either
+        if not OFFSET_RANGE[0] <= offset <= OFFSET_RANGE[1]:
+            sys.exit(f"Offset for {key} out of range ({OFFSET_RANGE[0]} to {OFFSET_RANGE[1]} mV): {offset}")
+        settings[key] = str(offset)
+
+    try:
+        parseLimits(settings)
+    except ValueError as err:
+        sys.exit(str(err))
+
+    conf.changeProfileSettings(settings, profile)
+    conf.flush()
+
+    _output(args, {"profile": profile, "settings": settings}, f"{profile}: {_formatProfile(settings)}")
+    return 0
+
+
+def manageProfile(args) -> int:
+
+    conf = _loadConfig()
+
+    try:
+        if args.action == "new":
+            source = _profileArgument(conf, args.copy) if args.copy is not None else None
+            settings = conf.getProfileSettings(source) if source is not None else None
+            profile = conf.createProfile(args.name, settings)
+            message = f"Created profile {profile} ({args.name})"
+
+        elif args.action == "rename":
+            profile = _profileArgument(conf, args.profile)
+            conf.renameProfile(profile, args.name)
+            message = f"Renamed profile {profile} to {args.name}"
+
+        else:
+            profile = _profileArgument(conf, args.profile)
+            conf.deleteProfile(profile)
+            message = f"Deleted profile {profile}"
+
+    except ValueError as err:
+        sys.exit(str(err))
+
+    conf.flush()
+    _output(args, {"profile": profile, "profiles": conf.getProfileNames()}, message)
+    return 0
+
+
+def _formatSteps(result: dict) -> str:
+
+    lines = []
+    for step in result.get('steps', []):
+        if step.get('skipped'):
+            status = "skipped"
+        elif step['ok']:
+            status = f"ok ({step['seconds']:.2f} s)"
+        else:
+            status = f"failed: {step.get('error') or (step.get('output') or '').strip() or step['returncode']}"
+        lines.append(f"{step['op']}: {status}")
+
+    if not result.get('steps') and not result['ok']:
+        lines.append(f"Failed: {result.get('error', result.get('output'))}")
+    return '\n'.join(lines)
+
+
+def applyProfile(args) -> int:
+
+    conf = _loadConfig()
+
+    if args.profile is not None:
+        profile = _profileArgument(conf, args.profile)
+        conf.changeSettings('profile', profile)
+        conf.flush()
+
+    if args.startup is not None or args.switching is not None:
+        return _applyTransaction(args, conf)
+
+    start = time.perf_counter()
+    run = conf.applyChanges()
+    elapsed = time.perf_counter() - start
+
+    profile = str(conf.getActiveProfile())
+    name = conf.getProfileName(profile)
+    message = f"Profile {name} applied" if not run.returncode else f"Applying profile {name} failed"
+    _output(args, {"profile": profile, "returncode": run.returncode, "seconds": elapsed}, message)
+    return 1 if run.returncode else 0
+
+
+def _applyTransaction(args, conf: config.Config) -> int:
+    """
+    Apply the profile together with the startup and power switching changes, in one helper transaction.
+    """
+
+    from . import backend, helper, readback
+
+    transaction = helper.Transaction().add("apply", **conf.applyRequest())
+
+    if args.startup is not None:
+        value = 1 if args.startup == "on" else 0
+        conf.changeSettings('startup', str(value))
+        transaction.startup(value)
+
+    if args.switching is not None:
+        conf.changeSettings('battery_switch', str(args.switching == "on").lower())
+        backend.addWatcherStep(transaction, conf)
+
+    # The watcher service reads the config file
+    conf.flush()
+
+    start = time.perf_counter()
+    result = transaction.run(once=True)
+    readback.invalidateAll()
+
+    _output(args, dict(result, seconds=time.perf_counter() - start), _formatSteps(result))
+    return 1 if result['returncode'] else 0
+
+
+def batchCommand(args) -> int:
+
+    from . import helper, readback
+
+    try:
+        if args.file == '-':
+            steps = json.load(sys.stdin)
+        else:
+            with open(args.file) as steps_file:
+                steps = json.load(steps_file)
+    except (OSError, ValueError) as err:
+        sys.exit(f"Unable to read the steps: {err}")
+
+    transaction = helper.Transaction()
+    transaction.steps = steps
+    result = transaction.run(once=True)
+    readback.invalidateAll()
+
+    _output(args, result, _formatSteps(result))
+    return 1 if result['returncode'] else 0
+
+
+def exportConfig(args) -> int:
+
+    conf = _loadConfig()
+    conf.exportConfig(args.file)
+
+    _output(args, {"exported": args.file}, f"Configuration exported to {args.file}")
+    return 0
+
+
+def importConfig(args) -> int:
+
+    if not os.path.isfile(args.file):
+        sys.exit(f"No such file: {args.file}")
+
+    try:
+        imported = config.Config(args.file)
+    except configparser.Error as err:
+        sys.exit(f"Invalid configuration file {args.file}: {err}")
+    except KeyError:
+        sys.exit(f"{args.file} is not a linux-undervolt configuration (it has no SETTINGS section)")
+    imported.saveChanges()
+    imported.flush()
+
+    _output(args, {"imported": args.file}, f"Configuration imported from {args.file}")
+    return 0
+
+
+def _historyVersion(store, version: int) -> int:
+
+    try:
+        return store.entry(version)['version']
+    except KeyError:
+        sys.exit(f"Unknown version: {version}")
+
+
+def historyCommand(args) -> int:
+
+    from . import history
+
+    store = history.getStore()
+
+    if args.action == "list":
+        if args.kind:
+            entries = [entry for entry in store.entries() if entry['kind'] == args.kind]
+            entries = entries if args.all else entries[-args.count:]
+        else:
+            entries = store.entries() if args.all else store.entries(args.count)
+
+        lines = []
+        for entry in entries:
+            manifest = store.manifest(entry['hash'])
+            profile = manifest['settings'].get('SETTINGS', {}).get('profile')
+            name = next((name for profile_id, name, _ in manifest['profiles'] if profile_id == profile), profile)
+            entry['profile'] = profile
+            lines.append(f"{entry['version']:>5}  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['time']))}  "
+                         f"{entry['kind']:<8} {name:<20} {entry['hash'][:12]}")
+
+        _output(args, entries, '\n'.join(lines) or "No history recorded")
+        return 0
+
+    if args.action == "show":
+        version = _historyVersion(store, args.version)
+        snapshot = store.snapshot(version)
+        active = snapshot['settings'].get('SETTINGS', {}).get('profile')
+
+        lines = [f"Version {version}"]
+        for profile_id, profile in snapshot['profiles'].items():
+            marker = '*' if profile_id == active else ' '
+            lines.append(f"{marker} {profile_id:>3}  {profile['name']:<20} {_formatProfile(profile['settings'])}")
+
+        _output(args, dict(snapshot, version=version), '\n'.join(lines))
+        return 0
+
+    if args.action == "diff":
+        old = _historyVersion(store, args.old)
+        new = _historyVersion(store, args.new)
+
+        profile = None
+        if args.profile is not None:
+            profile = _profileArgument(_loadConfig(), args.profile)
+
+        differences = store.diff(old, new, profile)
+
+        lines = [f"Version {old} -> {new}"]
+        for key, (old_value, new_value) in differences['settings'].items():
+            lines.append(f"  {key}: {old_value} -> {new_value}")
+        for profile_id, change in differences['profiles'].items():
+            state = " (added)" if change.get('added') else " (removed)" if change.get('removed') else ''
+            lines.append(f"  profile {profile_id}{state}")
+            if 'name' in change:
+                lines.append(f"    name: {change['name'][0]} -> {change['name'][1]}")
+            for key, (old_value, new_value) in change.get('settings', {}).items():
+                lines.append(f"    {key}: {old_value} -> {new_value}")
+
+        _output(args, differences, '\n'.join(lines) if len(lines) > 1 else f"Versions {old} and {new} are the same")
+        return 0
+
+    # restore
+    version = _historyVersion(store, args.version)
+    restored, run = store.restore(version, apply=not args.no_apply)
+
+    name = restored.getProfileName()
+    if run is None:
+        message = f"Restored version {version}, active profile {name}"
+    elif not run.returncode:
+        message = f"Restored version {version} and applied profile {name}"
+    else:
+        message = f"Restored version {version}, applying profile {name} failed"
+
+    returncode = run.returncode if run is not None else 0
+    _output(args, {"version": version, "profile": str(restored.getActiveProfile()), "returncode": returncode}, message)
+    return 1 if returncode else 0
+
+
+def status(args) -> int:
+
+    from . import undervolt_conf, helper
+
+    conf = _loadConfig()
+    settings = conf.getSettings()
+    profile = settings['profile']
+
+    try:
+        path = helper.getClient(conf.undervolt_file).systemPath(conf.undervolt_file)
+        written = undervolt_conf.load(path).undervolt()
+    except OSError:
+        written = {}
+
+    data = {
+        "profile": profile,
+        "settings": conf.getProfileSettings(profile),
+        "undervolt_file": written,
+        "engine": settings.get('engine', 'intel-undervolt'),
+        "power_switching": conf.getBool('battery_switch'),
+        "battery_profile": settings['battery_profile'],
+        "ac_profile": settings['ac_profile'],
+        "startup": conf.getBool('startup')
+    }
+
+    text = '\n'.join([
+        f"Active profile:  {profile} ({_formatProfile(data['settings'])})",
+        f"Undervolt file:  {_formatProfile(written) if written else 'unreadable'}",
+        f"Engine:          {data['engine']}",
+        f"Power switching: {'on' if data['power_switching'] else 'off'}"
+        f" (battery: {data['battery_profile'] or '-'}, AC: {data['ac_profile'] or '-'})",
+        f"Start on boot:   {'on' if data['startup'] else 'off'}",
+    ])
+
+    _output(args, data, text)
+    return 0
+
+
+def measure(args) -> int:
+
+    from .rapl import RaplSampler
+
+    sampler = RaplSampler(interval=args.interval)
+    if not sampler.available:
+        sys.exit("The RAPL energy counters are not readable. Run as root or use `intel-undervolt measure`.")
+
+    sampler.sample()
+    try:
+        for _ in range(args.count) if args.count else itertools.count():
+            time.sleep(sampler.interval)
+            watts = sampler.sample()
+
+            if args.json:
+                print(json.dumps({"time": time.time(), "watts": watts}), flush=True)
+            else:
+                print('  '.join(f"{key}: {value:7.3f} W" for key, value in watts.items()), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sampler.close()
+
+    return 0
+
+
+def autotune(args) -> int:
+
+    from . import autotune as tuning
+    from .stress import StressWorkload
+
+    conf = _loadConfig()
+    profile = _profileArgument(conf, args.profile)
+
+    planes = args.planes.split(',') if args.planes else list(PLANES)
+    for plane in planes:
+        if plane not in PLANES:
+            sys.exit(f"Unknown plane: {plane}. Valid planes: {', '.join(PLANES)}")
+
+    if args.simulate is not None:
+        thresholds = {}
+        for assignment in args.simulate:
+            plane, _, value = assignment.partition('=')
+            thresholds[plane] = int(value)
+        backend = tuning.SimulatedBackend(thresholds)
+        state_file = tuning.SIMULATED_STATE_FILE
+    else:
+        backend = tuning.HardwareBackend(StressWorkload(args.duration), conf.undervolt_file)
+        state_file = tuning.STATE_FILE
+
+    if args.reset:
+        tuning.AutoTuner(backend, planes, state_file).reset()
+
+    # Progress of an interrupted run is picked up from the state file, otherwise the search starts at 0 mV
+    tuner = tuning.AutoTuner(backend, planes, state_file, step=args.step, limit=args.limit, mode=args.mode)
+
+    try:
+        result = tuner.run(margin=args.margin)
+    except RuntimeError as err:
+        sys.exit(f"Tuning failed: {err}")
+    except KeyboardInterrupt:
+        sys.exit("Tuning interrupted, the stable offsets were applied again. Run autotune again to continue.")
+
+    # A simulated run says nothing about the hardware, its result is only shown
+    if args.simulate is not None:
+        tuner.reset()
+        offsets = {plane: result[plane] for plane in planes}
+        _output(args, {"profile": profile, "simulated": offsets},
+                f"Simulated: {', '.join(f'{plane} {value} mV' for plane, value in offsets.items())}")
+        return 0
+
+    settings = conf.getProfileSettings(profile)
+    settings.update({plane: str(result[plane]) for plane in planes})
+    conf.changeProfileSettings(settings, profile)
+    conf.flush()
+    tuner.reset()
+
+    _output(args, {"profile": profile, "settings": settings}, f"{profile}: {_formatProfile(settings)}")
+    return 0
+
+
+def _updateWatcher(conf: config.Config) -> int:
+    """
+    Install or remove the power watcher service, which also runs the governor and the application switching.
+    """
+
+    from . import backend
+
+    if conf.getBool('battery_switch') or backend.watcherInUse(conf):
+        return backend.createPowerWatcher(conf).returncode
+    return backend.removePowerWatcher()
+
+
+def governorCommand(args) -> int:
+
+    from . import governor
+
+    conf = _loadConfig()
+
+    if args.action == "replay":
+        switches = governor.replay(governor.Governor.fromConfig(conf), governor.readTrace(args.trace))
+        _output(args, [{"time": when, "profile": profile} for when, profile in switches],
+                '\n'.join(f"{when:10.1f} s  -> " + (f"profile {profile}" if profile is not None else "no rule matches")
+                          for when, profile in switches) or "No switches")
+        return 0
+
+    if args.action == "run":
+        from .arbiter import getArbiter
+
+        sampler = governor.SensorSampler()
+        trace = open(args.record, 'a') if args.record else None
+        interval = args.interval or float(conf.getGovernorSettings().get('interval', governor.DEFAULTS['interval']))
+        try:
+            # Without a matching rule the profile active before is restored
+            instance = governor.Governor.fromConfig(conf, lambda profile: getArbiter().request('governor', profile))
+            instance.profile = None
+            governor.run(instance, sampler, interval, trace)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sampler.close()
+            if trace is not None:
+                trace.close()
+        return 0
+
+    # Validate the rules before the service picks them up
+    governor.parseRules(conf.getGovernorSettings().get('rules', ''))
+
+    enabled = args.action == "enable"
+    conf.changeGovernorSettings({'enabled': str(enabled).lower()})
+    conf.flush()
+
+    returncode = _updateWatcher(conf)
+
+    _output(args, {"enabled": enabled, "returncode": returncode},
+            f"Governor {'enabled' if enabled else 'disabled'}" if not returncode else "Updating the service failed")
+    return 1 if returncode else 0
+
+
+def applications(args) -> int:
+
+    conf = _loadConfig()
+
+    if args.action == "add":
+        profile = _profileArgument(conf, args.profile)
+        conf.changeApplication(args.name, profile)
+    elif args.action == "remove":
+        if args.name.lower() not in conf.getApplications():
+            sys.exit(f"No profile mapped to {args.name}")
+        conf.changeApplication(args.name)
+
+    mapping = conf.getApplications()
+
+    if args.action != "list":
+        conf.flush()
+
+        # The running service picks up changes to the mapping by itself, it only has to be installed when the first
+        # application is added and removed (if unused) when the last one is
+        first = args.action == "add" and len(mapping) == 1
+        if (first or not mapping) and _updateWatcher(conf):
+            sys.exit("Updating the service failed")
+
+    text = '\n'.join(f"{name}: {profile}" for name, profile in mapping.items())
+    _output(args, mapping, text or "No applications mapped")
+    return 0
+
+
+def telemetryCommand(args) -> int:
+
+    from . import telemetry
+
+    if args.action in ("enable", "disable"):
+        conf = _loadConfig()
+        enabled = args.action == "enable"
+        conf.changeSettings('telemetry', str(enabled).lower())
+        if args.interval:
+            conf.changeSettings('telemetry_interval', str(args.interval))
+        conf.flush()
+
+        returncode = _updateWatcher(conf)
+        _output(args, {"enabled": enabled, "returncode": returncode},
+                f"Telemetry {'enabled' if enabled else 'disabled'}" if not returncode else "Updating the service failed")
+        return 1 if returncode else 0
+
+    reader = telemetry.TelemetryReader()
+    try:
+        if args.action == "metrics":
+            metrics = reader.metrics()
+            _output(args, metrics, '\n'.join(metrics) or "No telemetry recorded")
+            return 0
+
+        end = time.time()
+        start = end - args.since
+        buckets = reader.aggregate(args.metric, start, end, args.step)
+    finally:
+        reader.close()
+
+    lines = [
+        f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(bucket['time']))}  min {bucket['min']:8.2f}  "
+        f"mean {bucket['mean']:8.2f}  max {bucket['max']:8.2f}  ({bucket['count']} samples)"
+        for bucket in buckets
+    ]
+    _output(args, buckets, '\n'.join(lines) or "No samples in range")
+    return 0
+
+
+def monitorCommand(args) -> int:
+
+    from . import coremon
+
+    conf = _loadConfig()
+    names = conf.getProfileNames()
+
+    def activeProfile():
+        return config.Config().getSettings('profile')
+
+    monitor = coremon.CoreMonitor(profile=activeProfile)
+    if not monitor.cpus:
+        sys.exit("No cpu topology found in sysfs")
+
+    def value(number, unit):
+        return f"{number:7.0f} {unit}" if number is not None else f"{'-':>7} {unit}"
+
+    throttle_events = []
+    ticks = itertools.count() if args.count is None else range(args.count)
+    try:
+        for tick in ticks:
+            if tick:
+                time.sleep(args.interval)
+
+            sample = monitor.read()
+            throttle_events.extend(sample['events'])
+
+            if args.json:
+                print(json.dumps(sample), flush=True)
+                continue
+
+            profile = sample['profile']
+            lines = [f"{time.strftime('%H:%M:%S')}  profile {names.get(profile, profile)}"]
+            for cpu in sample['cpus']:
+                lines.append(
+                    f"  cpu{cpu['cpu']:<3} {cpu['type'] or '':1} core {cpu['core']:<3} {value(cpu['freq'], 'MHz')} "
+                    f"{value(cpu['temp'], '°C')}  throttled {cpu['throttle'] if cpu['throttle'] is not None else '-'}"
+                )
+            for package, values in sample['packages'].items():
+                lines.append(f"  package {package}{'':10}{value(values['temp'], '°C'):>20}  "
+                             f"throttled {values['throttle'] if values['throttle'] is not None else '-'}")
+
+            # Every throttle event seen so far, with the profile that was active when it happened
+            for event in throttle_events[-10:]:
+                where = f"core {event['core']}" if event['kind'] == 'core' else f"package {event['package']}"
+                lines.append(f"  throttle: {where} +{event['count']} "
+                             f"with profile {names.get(event['profile'], event['profile'])}")
+
+            if sys.stdout.isatty():
+                print("\033[H\033[J", end='')
+            print('\n'.join(lines), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        monitor.close()
+
+    return 0
+
+
+def verifyCommand(args) -> int:
+
+    from . import readback
+
+    conf = _loadConfig()
+
+    if args.action in ("enable", "disable"):
+        enabled = args.action == "enable"
+        conf.changeSettings('verify', str(enabled).lower())
+        conf.flush()
+
+        returncode = _updateWatcher(conf)
+        _output(args, {"enabled": enabled, "returncode": returncode},
+                f"Verification {'enabled' if enabled else 'disabled'}" if not returncode
+                else "Updating the service failed")
+        return 1 if returncode else 0
+
+    state = readback.getCache(conf).get(force=True)
+    if state is None:
+        sys.exit("Reading the applied state failed")
+
+    settings = conf.getProfileSettings()
+    differences = readback.difference(state, settings)
+
+    applied = dict(state['offsets'], **state['limits'])
+    lines = [f"Profile {conf.getProfileName()} ({state['source']})"]
+    for key, value in applied.items():
+        saved = settings.get(key, '-')
+        marker = "  differs" if key in differences else ''
+        lines.append(f"  {key:<10} applied {value:>8g}  saved {saved:>8}{marker}")
+
+    _output(args, {"profile": str(conf.getActiveProfile()), "applied": applied, "differences": differences},
+            '\n'.join(lines))
+    return 1 if differences else 0
+
+
+def exporterCommand(args) -> int:
+
+    from . import exporter
+
+    conf = _loadConfig()
+
+    if args.action in ("enable", "disable"):
+        enabled = args.action == "enable"
+        conf.changeSettings('exporter', str(enabled).lower())
+        if args.interval:
+            conf.changeSettings('exporter_interval', str(args.interval))
+        if args.output:
+            conf.changeSettings('exporter_path', args.output)
+        conf.flush()
+
+        returncode = _updateWatcher(conf)
+        _output(args, {"enabled": enabled, "returncode": returncode},
+                f"Exporter {'enabled' if enabled else 'disabled'}" if not returncode else "Updating the service failed")
+        return 1 if returncode else 0
+
+    options = exporter.settings(conf)
+    instance = exporter.Exporter(args.output or options['path'])
+    try:
+        if args.once:
+            print(instance.collect(), end='')
+        else:
+            exporter.export(instance, args.interval or options['interval'])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        instance.close()
+
+    return 0
+
+
+def efficiencyCommand(args) -> int:
+
+    from . import efficiency
+
+    conf = _loadConfig()
+    runs = efficiency.loadRuns()
+
+    if args.last:
+        if not runs:
+            sys.exit("No efficiency results stored")
+        run = runs[-1]
+    else:
+        from .rapl import RaplSampler
+        from .stress import StressWorkload
+
+        sampler = RaplSampler()
+        if not sampler.available:
+            sys.exit("The RAPL energy counters are not readable. Run as root.")
+
+        profiles = [_profileArgument(conf, profile) for profile in args.profiles] if args.profiles else None
+
+        def progress(profile, repetition, repetitions):
+            if not args.json:
+                print(f"Profile {profile}: repetition {repetition}/{repetitions}", file=sys.stderr)
+
+        benchmark = efficiency.EfficiencyBenchmark(conf, StressWorkload(processes=args.processes), sampler,
+                                                   args.rounds, args.repetitions)
+        try:
+            run = benchmark.run(profiles, progress)
+        finally:
+            sampler.close()
+
+        efficiency.saveRun(run)
+
+    lines = [f"{'profile':<10}{'ops/s':>12}{'±':>10}{'J/op':>12}{'W':>10}{'±':>8}   change vs previous run"]
+    for profile, result in run['profiles'].items():
+        previous = efficiency.previousResult(runs, run, profile)
+        change = efficiency.compare(result, previous)
+        result['change'] = change
+
+        if change:
+            changed = ' (offsets changed)' if previous['settings'] != result['settings'] else ''
+            text = f"ops/s {change['ops_per_second']:+.1f}%  J/op {change['joules_per_op']:+.1f}%{changed}"
+        else:
+            text = "-"
+
+        lines.append(
+            f"{profile:<10}{result['ops_per_second']:12.2f}{result['ops_per_second_variance'] ** 0.5:10.2f}"
+            f"{result['joules_per_op']:12.3f}{result['watts']:10.2f}{result['watts_variance'] ** 0.5:8.2f}   {text}"
+        )
+
+    _output(args, run, '\n'.join(lines))
+    return 0
+
+
+def buildParser() -> argparse.ArgumentParser:
+
+    parser = argparse.ArgumentParser(prog="linux-undervolt", description="Manage linux-undervolt profiles")
+    parser.add_argument("--json", action="store_true", help="machine readable output")
+    parser.add_argument("--trace", action="store_true",
+                        help="record timing spans to trace.json and timing.log in the config directory")
+
+    # Kept for services installed by older versions
+    parser.add_argument("-set-profile", dest="set_profile", help=argparse.SUPPRESS)
+
+    # --json is accepted both before and after the command name
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--json", action="store_true", default=argparse.SUPPRESS, help="machine readable output")
+
+    commands = parser.add_subparsers(dest="command")
+
+    command = commands.add_parser("list", parents=[common], help="list the profiles")
+    command.add_argument("-v", "--verbose", action="store_true", help="show the offsets of every profile")
+    command.set_defaults(function=listProfiles)
+
+    command = commands.add_parser("profile", parents=[common], help="create, rename or delete profiles")
+    actions = command.add_subparsers(dest="action", required=True)
+    action = actions.add_parser("new", parents=[common], help="create a profile")
+    action.add_argument("name")
+    action.add_argument("--copy", metavar="PROFILE", help="start with the offsets of another profile")
+    action = actions.add_parser("rename", parents=[common], help="rename a profile")
+    action.add_argument("profile")
+    action.add_argument("name")
+    action = actions.add_parser("delete", parents=[common], help="delete a profile")
+    action.add_argument("profile")
+    command.set_defaults(function=manageProfile)
+
+    command = commands.add_parser("show", parents=[common], help="show the settings of a profile")
+    command.add_argument("profile", nargs='?')
+    command.set_defaults(function=showProfile)
+
+    command = commands.add_parser(
+        "set", parents=[common],
+        help="edit the offsets and limits of a profile, e.g. set cpu=-50 gpu=-30 pl1=35 pl2=45 tjoffset=-20",
+        epilog="limits: pl1/pl2 (W) with pl1_window/pl2_window (s), tjoffset (°C) and hwphint "
+               "('MODE ALGORITHM LOAD_HINT NORMAL_HINT'); an empty value removes a limit"
+    )
+    command.add_argument("-p", "--profile", help="profile to edit (defaults to the active profile)")
+    command.add_argument("values", nargs='+', metavar="SETTING=VALUE")
+    command.set_defaults(function=editProfile)
+
+    command = commands.add_parser("apply", parents=[common], help="apply a profile, making it the active profile")
+    command.add_argument("profile", nargs='?')
+    command.add_argument("--startup", choices=("on", "off"),
+                         help="also apply the undervolt on boot or stop doing so, in the same privileged step")
+    command.add_argument("--switching", choices=("on", "off"),
+                         help="also turn AC/battery profile switching on or off, in the same privileged step")
+    command.set_defaults(function=applyProfile)
+
+    command = commands.add_parser(
+        "batch", parents=[common], help="run several privileged operations in one transaction",
+        epilog='steps: a JSON list such as [{"op": "apply", "settings": {"cpu": -50}}, {"op": "startup", "value": 1}]; '
+               'operations: apply, read, startup, install_watcher, remove_watcher'
+    )
+    command.add_argument("file", help="JSON file with the steps, - for stdin")
+    command.set_defaults(function=batchCommand)
+
+    command = commands.add_parser("export", parents=[common], help="export the configuration")
+    command.add_argument("file")
+    command.set_defaults(function=exportConfig)
+
+    command = commands.add_parser("import", parents=[common], help="import a configuration")
+    command.add_argument("file")
+    command.set_defaults(function=importConfig)
+
+    command = commands.add_parser("history", parents=[common],
+                                  help="list, compare and restore the saved and applied versions of the configuration")
+    actions = command.add_subparsers(dest="action", required=True)
+    action = actions.add_parser("list", parents=[common], help="list the latest versions")
+    action.add_argument("-n", "--count", type=int, default=20, help="number of versions (default 20)")
+    action.add_argument("-a", "--all", action="store_true", help="list every version")
+    action.add_argument("--kind", choices=("save", "apply", "restore"), help="only list versions of this kind")
+    action = actions.add_parser("show", parents=[common], help="show the profiles of a version")
+    action.add_argument("version", type=int, help="version number, negative numbers count back from the latest")
+    action = actions.add_parser("diff", parents=[common], help="show what changed between two versions")
+    action.add_argument("old", type=int)
+    action.add_argument("new", type=int, nargs='?', default=-1, help="default: the latest version")
+    action.add_argument("-p", "--profile", help="only compare this profile")
+    action = actions.add_parser("restore", parents=[common],
+                                help="make a version the current configuration and apply its active profile")
+    action.add_argument("version", type=int)
+    action.add_argument("--no-apply", action="store_true", help="restore without applying")
+    command.set_defaults(function=historyCommand)
+
+    command = commands.add_parser("status", parents=[common], help="show the active profile and settings")
+    command.set_defaults(function=status)
+
+    command = commands.add_parser("measure", parents=[common], help="show live power consumption")
+    command.add_argument("-i", "--interval", type=float, default=1.0, help="seconds between samples")
+    command.add_argument("-n", "--count", type=int, default=0, help="number of samples (0 to run until stopped)")
+    command.set_defaults(function=measure)
+
+    command = commands.add_parser("autotune", parents=[common],
+                                  help="search for stable offsets with a stress test and store them in a profile")
+    command.add_argument("-p", "--profile", help="profile to store the result in (defaults to the active profile)")
+    command.add_argument("--planes", help=f"comma separated planes to tune (default: {','.join(PLANES)})")
+    command.add_argument("--mode", choices=("binary", "step"), default="binary")
+    command.add_argument("--step", type=int, default=5, help="search resolution in mV")
+    command.add_argument("--limit", type=int, default=-150, help="most negative offset to try")
+    command.add_argument("--margin", type=int, default=5, help="mV added back to the result for safety")
+    command.add_argument("--duration", type=float, default=60, help="seconds of stress per tested offset")
+    command.add_argument("--reset", action="store_true", help="discard the progress of a previous run")
+    command.add_argument("--simulate", nargs='+', metavar="PLANE=THRESHOLD",
+                         help="only show the result of a simulated backend that fails below the given offsets")
+    command.set_defaults(function=autotune)
+
+    command = commands.add_parser("governor", parents=[common],
+                                  help="switch profiles on cpu load, temperature and power (rules in the config file)")
+    actions = command.add_subparsers(dest="action", required=True)
+    action = actions.add_parser("run", parents=[common], help="run the governor in the foreground")
+    action.add_argument("-i", "--interval", type=float, help="seconds between samples")
+    action.add_argument("--record", metavar="TRACE", help="append the samples to a trace file")
+    action = actions.add_parser("replay", parents=[common], help="show the switches the rules make for a trace")
+    action.add_argument("trace")
+    actions.add_parser("enable", parents=[common], help="run the governor as a service")
+    actions.add_parser("disable", parents=[common], help="stop the governor service")
+    command.set_defaults(function=governorCommand)
+
+    command = commands.add_parser("apps", parents=[common],
+                                  help="switch to a profile while an application is running")
+    actions = command.add_subparsers(dest="action", required=True)
+    actions.add_parser("list", parents=[common], help="show the application to profile mapping")
+    action = actions.add_parser("add", parents=[common], help="map a process name to a profile")
+    action.add_argument("name", help="process name, as shown by ps -o comm")
+    action.add_argument("profile")
+    action = actions.add_parser("remove", parents=[common], help="remove the mapping of a process name")
+    action.add_argument("name")
+    command.set_defaults(function=applications)
+
+    command = commands.add_parser("telemetry", parents=[common], help="record and query power/temperature history")
+    actions = command.add_subparsers(dest="action", required=True)
+    action = actions.add_parser("enable", parents=[common], help="record telemetry in the background")
+    action.add_argument("-i", "--interval", type=float, help="seconds between samples (default 1)")
+    action = actions.add_parser("disable", parents=[common], help="stop recording telemetry")
+    action.set_defaults(interval=None)
+    actions.add_parser("metrics", parents=[common], help="list the recorded metrics")
+    action = actions.add_parser("query", parents=[common], help="show a metric downsampled over a time range")
+    action.add_argument("metric", help="e.g. power.package-0, temp.package, freq.average or profile")
+    action.add_argument("--since", type=float, default=86400, help="seconds of history to show (default 1 day)")
+    action.add_argument("--step", type=float, default=3600, help="seconds per aggregated row (default 1 hour)")
+    command.set_defaults(function=telemetryCommand)
+
+    command = commands.add_parser("monitor", parents=[common],
+                                  help="show per-core frequency, temperature and throttling against the profile")
+    command.add_argument("-i", "--interval", type=float, default=1.0, help="seconds between readings (default 1)")
+    command.add_argument("-n", "--count", type=int, help="stop after this many readings")
+    command.set_defaults(function=monitorCommand)
+
+    command = commands.add_parser("verify", parents=[common],
+                                  help="compare the applied offsets and limits with the active profile")
+    actions = command.add_subparsers(dest="action", required=True)
+    actions.add_parser("check", parents=[common], help="read the applied state, exits with 1 when it differs")
+    actions.add_parser("enable", parents=[common],
+                       help="apply the profile again when a resume or microcode reload reset it")
+    actions.add_parser("disable", parents=[common], help="stop checking in the background")
+    command.set_defaults(function=verifyCommand)
+
+    command = commands.add_parser("exporter", parents=[common],
+                                  help="write the undervolt and power state for the node_exporter textfile collector")
+    actions = command.add_subparsers(dest="action", required=True)
+    for name, help_text in (("enable", "write the metrics file from the power watcher service"),
+                            ("run", "write the metrics file in the foreground")):
+        action = actions.add_parser(name, parents=[common], help=help_text)
+        action.add_argument("-i", "--interval", type=float, help="seconds between writes (default 15)")
+        action.add_argument("-o", "--output", help="metrics file, e.g. in the collector's --collector.textfile.directory")
+    actions.choices["run"].add_argument("--once", action="store_true", help="print the metrics once and exit")
+    action = actions.add_parser("disable", parents=[common], help="stop writing the metrics file")
+    action.set_defaults(interval=None, output=None)
+    command.set_defaults(function=exporterCommand, once=False)
+
+    command = commands.add_parser("efficiency", parents=[common],
+                                  help="compare the performance per watt of the profiles")
+    command.add_argument("profiles", nargs='*', help="profiles to benchmark (default: all)")
+    command.add_argument("-r", "--rounds", type=int, default=4, help="work units per cpu in a repetition")
+    command.add_argument("-n", "--repetitions", type=int, default=3, help="repetitions per profile")
+    command.add_argument("--processes", type=int, help="worker processes (default: one per cpu)")
+    command.add_argument("--last", action="store_true", help="show the stored results of the last run")
+    command.set_defaults(function=efficiencyCommand)
+
+    return parser
+
+
+def main(argv=None) -> int:
+
+    parser = buildParser()
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        from . import tracing
+        tracing.enable()
+
+    if args.set_profile is not None:
+        args.profile = args.set_profile
+        return applyProfile(args)
+
+    if args.command is None:
+        parser.print_help()
+        return 1
+
+    return args.function(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
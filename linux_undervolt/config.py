@@ -1,25 +1,63 @@
 #!/usr/bin/env python3
 import os
+import io
+import atexit
 import configparser
 import subprocess
-import tempfile
 import pathlib
 import logging
+import tempfile
+import threading
+import time
+import weakref
+
+from . import history, tracing
+from .constants import CONFIG_DIR, CONFIG_FILE, PLANES
+from .profiles import ProfileStore
+
+# Delay (seconds) over which changes are merged before the config file is written
+SAVE_DELAY = 0.5
 
-from .constants import CONFIG_DIR, CONFIG_FILE
+# Sections of the config file that are not profiles
+RESERVED_SECTIONS = ('SETTINGS', 'GOVERNOR', 'APPLICATIONS')
+
+# Config instances with changes that have not been written yet
+_unsaved = weakref.WeakSet()
 
 class Config:
     
-    __slots__ = ("_parser", "undervolt_file", "logger")
+    __slots__ = ("_parser", "profiles", "undervolt_file", "logger", "_lock", "_dirty", "_timer", "__weakref__")
 
+    @tracing.traced("config.load")
     def __init__(self, configFile=CONFIG_FILE):
         """
         docstring
         """
+        # Pending changes of other instances have to be on disk before the file is read
+        flushAll()
+
         self.logger = logging.getLogger(self.__class__.__name__)
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._timer = None
         self._parser = configparser.ConfigParser()
         self._parser.read(configFile)
         self.undervolt_file = self._parser['SETTINGS']['undervolt_path']
+
+        # As root (the power watcher service works on the user's config) another undervolt file is only written when
+        # root owns the config that names it
+        if os.geteuid() == 0:
+            from .helper import UNDERVOLT_FILE
+
+            if self.undervolt_file != UNDERVOLT_FILE and not _ownedByRoot(configFile):
+                self.logger.warning(f"Ignoring undervolt_path {self.undervolt_file} of {configFile}, it is not "
+                                    f"owned by root")
+                self.undervolt_file = UNDERVOLT_FILE
+
+        self.profiles = ProfileStore()
+        self._migrateProfiles()
+
+        tracing.configure(self)
         
     @classmethod
     def create_config(cls) -> 'Config':
@@ -32,23 +70,44 @@ class Config:
             'battery_profile': "",
             'ac_profile': "",
             'startup': 0,
-            "advanced": 0
+            "advanced": 0,
+            "engine": "intel-undervolt"
         }
 
-        profile_options = ['cpu', 'gpu', 'cpu_cache', 'sys_agent', 'analog_io']
-        profiles = [{i: 0 for i in profile_options} for j in range(4)]
+        # Profiles are kept in the profile store, start with a single profile without any undervolt
+        store = ProfileStore()
+        store.replace([('0', "Default", {plane: 0 for plane in PLANES})])
 
-        # Create default undervolt values for each profile in config file
-        for index, profile in enumerate(profiles):
-            parser[str(index)] = profile
-            
         # Save file
         pathlib.Path(CONFIG_DIR).mkdir(parents=True, exist_ok=True)
-        with open(CONFIG_FILE, "w") as config_out:
-            parser.write(config_out)
-        
+        store.flush()
+        config_out = io.StringIO()
+        parser.write(config_out)
+        atomicWrite(CONFIG_FILE, config_out.getvalue())
+
         return cls()
 
+    def _migrateProfiles(self) -> None:
+        """
+        Move the profile sections ("0", "1", ...) of config files written by older versions, or of an imported config
+        file, into the profile store. The profiles of the file replace the stored profiles.
+        """
+
+        sections = [section for section in self._parser.sections() if section not in RESERVED_SECTIONS]
+        if not sections:
+            return
+
+        profiles = []
+        for section in sections:
+            settings = dict(self._parser[section])
+            name = settings.pop('name', f"Profile {section}")
+            profiles.append((section, name, settings))
+            self._parser.remove_section(section)
+
+        self.logger.info(f"Moving {len(profiles)} profiles to the profile store")
+        self.profiles.replace(profiles)
+        self.saveChanges()
+
     #################################
     # Settings and Profiles methods #
     #################################
@@ -63,8 +122,35 @@ class Config:
 
         return settings
 
-    def getBool(self, setting) -> bool:
-        return self._parser.getboolean('SETTINGS', setting)
+    def getBool(self, setting, default=False) -> bool:
+        return self._parser.getboolean('SETTINGS', setting, fallback=default)
+
+    def getProfiles(self) -> list:
+        """
+        Return the ids of all profiles.
+        """
+
+        return self.profiles.ids()
+
+    def getProfileNames(self) -> dict:
+        """
+        Return {id: name} of all profiles, in display order.
+        """
+
+        return self.profiles.names()
+
+    def getProfileName(self, profile=None) -> str:
+
+        if profile is None:
+            profile = self._parser['SETTINGS']['profile']
+        return self.profiles.name(profile)
+
+    def findProfile(self, profile):
+        """
+        Return the id of a profile given its id or name, None if there is no such profile.
+        """
+
+        return self.profiles.resolve(profile)
 
     def getActiveProfile(self) -> int:
         active_profile = self._parser['SETTINGS']['profile']
@@ -79,10 +165,51 @@ class Config:
         if profile_number is None:
             profile_number = self._parser['SETTINGS']['profile']
 
-        settings = self._parser[profile_number]
-        settings = dict(settings)
+        return self.profiles.get(profile_number)
 
-        return settings
+    def getGovernorSettings(self) -> dict:
+        """
+        Return the settings of the profile governor, empty if the config file has none. See governor.py.
+        """
+
+        if not self._parser.has_section('GOVERNOR'):
+            return {}
+        return dict(self._parser['GOVERNOR'])
+
+    def changeGovernorSettings(self, settings: dict) -> None:
+
+        with self._lock:
+            if not self._parser.has_section('GOVERNOR'):
+                self._parser.add_section('GOVERNOR')
+            for key, value in settings.items():
+                self._parser['GOVERNOR'][key] = str(value)
+
+        self.saveChanges()
+
+    def getApplications(self) -> dict:
+        """
+        Return the {process name: profile} mapping used for per-application switching. See appwatch.py.
+        """
+
+        if not self._parser.has_section('APPLICATIONS'):
+            return {}
+        return dict(self._parser['APPLICATIONS'])
+
+    def changeApplication(self, name: str, profile=None) -> None:
+        """
+        Map a process name to a profile, or remove its mapping when profile is None.
+        """
+
+        with self._lock:
+            if not self._parser.has_section('APPLICATIONS'):
+                self._parser.add_section('APPLICATIONS')
+
+            if profile is None:
+                self._parser.remove_option('APPLICATIONS', name)
+            else:
+                self._parser['APPLICATIONS'][name] = str(profile)
+
+        self.saveChanges()
 
     def changeSettings(self, setting: str or dict, new_value=None) -> None:
         """
@@ -93,15 +220,16 @@ class Config:
                                        or a string denoting a single setting
         new_value (str) - When a single setting is to be changed, provide the new value into this argument
         """
-        if isinstance(setting, str):
-            self._parser['SETTINGS'][setting] = new_value
+        with self._lock:
+            if isinstance(setting, str):
+                self._parser['SETTINGS'][setting] = new_value
 
-        elif isinstance(setting, dict):
-            for key, value in setting.items():
-                self._parser['SETTINGS'][key] = value
+            elif isinstance(setting, dict):
+                for key, value in setting.items():
+                    self._parser['SETTINGS'][key] = value
 
-        else:
-            raise TypeError
+            else:
+                raise TypeError
 
         self.saveChanges()
 
@@ -117,7 +245,55 @@ class Config:
         if profile is None:
             profile = self._parser['SETTINGS']['profile']
 
-        self._parser[profile] = settings
+        with self._lock:
+            self.profiles.update(profile, settings)
+
+        self.saveChanges()
+
+    def createProfile(self, name: str, settings=None) -> str:
+        """
+        Add a profile and return its id. Without settings the profile starts without any undervolt.
+        """
+
+        with self._lock:
+            profile = self.profiles.create(name, settings or {plane: 0 for plane in PLANES})
+
+        self.saveChanges()
+        return profile
+
+    def renameProfile(self, profile, name: str) -> None:
+
+        with self._lock:
+            self.profiles.rename(profile, name)
+
+        self.saveChanges()
+
+    def deleteProfile(self, profile) -> None:
+        """
+        Delete a profile and every reference to it. When the active profile is deleted the first remaining profile
+        becomes active. The last profile can not be deleted.
+        """
+
+        with self._lock:
+            profile_id = self.profiles.resolve(profile)
+            if profile_id is None:
+                raise KeyError(f"Unknown profile: {profile}")
+            if len(self.profiles) == 1:
+                raise ValueError("The last profile can not be deleted")
+
+            self.profiles.delete(profile_id)
+
+            settings = self._parser['SETTINGS']
+            if settings['profile'] == profile_id:
+                settings['profile'] = self.profiles.ids()[0]
+            for key in ('battery_profile', 'ac_profile'):
+                if settings.get(key) == profile_id:
+                    settings[key] = ""
+
+            if self._parser.has_section('APPLICATIONS'):
+                for name, mapped in list(self._parser['APPLICATIONS'].items()):
+                    if mapped == profile_id:
+                        self._parser.remove_option('APPLICATIONS', name)
 
         self.saveChanges()
 
@@ -125,80 +301,165 @@ class Config:
     # Save & Apply changes #
     ########################
 
+    def sections(self) -> dict:
+        """
+        Return the general sections of the config file (settings, governor, applications) as {section: values}.
+        """
+
+        return {section: dict(self._parser[section]) for section in self._parser.sections()}
+
     def exportConfig(self, output):
+        """
+        Write the settings and every profile to a single file. Profiles are written as sections named after their id,
+        the layout of older versions, which is moved back into the profile store on import.
+        """
+
+        parser = configparser.ConfigParser()
+        parser.read_dict(self._parser)
+        parser.read_dict(self.profiles.sections())
 
         with open(output, 'w') as export_file:
-            self._parser.write(export_file)
+            parser.write(export_file)
 
     def saveChanges(self) -> None:
         """
-        Save the profile settings to the config file.
+        Mark the config as changed. The config file is written after SAVE_DELAY seconds, so that several changes in
+        quick succession only cause a single write. Use flush() to write immediately.
         """
-        with open(CONFIG_FILE, 'w') as config_file:
-            self._parser.write(config_file)
 
-    def applyChanges(self) -> subprocess.CompletedProcess:
+        with self._lock:
+            self._dirty = True
+            _unsaved.add(self)
+
+            if self._timer is None:
+                self._timer = threading.Timer(SAVE_DELAY, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self, kind='save') -> None:
         """
-        Copy the active profile settings to the undervolt file and apply the undervolt to the system.
+        Write pending changes to the config file and record the new version in the history (see history.py) as the
+        given kind of change.
         """
 
-        index_map = {
-            '0': 'cpu',
-            '1': 'gpu',
-            '2': 'cpu_cache',
-            '3': 'sys_agent',
-            '4': 'analog_io'
-        }
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
 
-        profile_settings = self.getProfileSettings()
+            if not self._dirty:
+                return
 
-        # Create the undervolt file in a temporary directory and then move it to the correct location.
-        with tempfile.TemporaryDirectory() as temp_dir:
+            with tracing.span("config.save"):
+                # Recorded first, so a config that was written always has its version in the history
+                history.record(self, kind)
+                self.profiles.flush()
 
-            # Create a list of each line of the undervolt file. For the undervolt lines, overwrite the present values
-            # with the new profile values.
-            line_list = []
-            with open(self.undervolt_file) as stream:
-                for line in stream:
+                config_file = io.StringIO()
+                self._parser.write(config_file)
 
-                    if line[0] in ('#', '\n'):
-                        line_list.append(line)
-                    else:
+                atomicWrite(CONFIG_FILE, config_file.getvalue())
+                self._dirty = False
+                _unsaved.discard(self)
 
-                        arguments = line.split()
+    def applyRequest(self) -> dict:
+        """
+        Return the parameters of the helper request applying the active profile, e.g. to add it to a transaction.
+        """
 
-                        if arguments[0] == 'undervolt':
-                            index_val = arguments[1]
-                            current_option = index_map[index_val]
-                            setting = profile_settings[current_option]
-                            arguments[-1] = setting
+        return {
+            "settings": self.getProfileSettings(),
+            "engine": self._parser['SETTINGS'].get('engine', 'intel-undervolt')
+        }
 
-                        arguments = ' '.join(arguments)
-                        arguments = f'{arguments}\n'
+    def applyChanges(self) -> subprocess.CompletedProcess:
+        """
+        Copy the active profile settings to the undervolt file and apply the undervolt to the system. The privileged
+        part is handled by the long running helper, so only the first call of a session asks for a password.
+        """
 
-                        line_list.append(arguments)
+        with tracing.span("applyChanges", profile=self._parser['SETTINGS']['profile']):
+            # The helper client is only needed when applying, keep it out of the import path of the CLI
+            with tracing.span("applyChanges.import"):
+                from . import exporter, helper, readback
 
-            temp_undervolt_file_dir = os.path.join(temp_dir, 'temp-undervolt.conf')
+            with tracing.span("applyChanges.settings"):
+                request = self.applyRequest()
+                client = helper.getClient(self.undervolt_file)
 
-            # Write the lines to a new temp file
-            with open(temp_undervolt_file_dir, 'w') as tmp_undervolt:
-                total_string = ''.join(line_list)
-                tmp_undervolt.write(total_string)
+            start = time.perf_counter()
+            response = client.request("apply", **request)
+            exporter.recordApply(time.perf_counter() - start, response['ok'])
+            readback.invalidateAll()
 
-            undervolt_folder = os.path.split(self.undervolt_file)[0]
-            undervolt_file = os.path.join(undervolt_folder, 'intel-undervolt.conf')
+            if response['ok']:
+                with self._lock:
+                    history.record(self, 'apply')
 
-            command_1 = f"mv {temp_undervolt_file_dir} {undervolt_file}"
-            command_2 = "intel-undervolt apply"
+        if not response['ok']:
+            self.logger.error(f"Applying the undervolt failed: {response.get('error', response.get('output'))}")
 
-            # Move the undervolt file to the correct place and apply the undervolt. Requires root priviliges.
-            final_command = f"pkexec sh -c '{command_1} ; {command_2}'"
+        return subprocess.CompletedProcess(("apply",), response['returncode'], stdout=response.get('output'))
 
-            final_run = subprocess.run(final_command, shell=True)
 
-        return final_run
+def atomicWrite(path: str, content: str) -> None:
+    """
+    Replace a file without ever leaving it truncated: the content is written and synced to a temporary file in the
+    same directory, which is then renamed over the target. Every call gets its own temporary file, so the threads of
+    the watcher service, the GUI and the CLI can write the same file at the same time.
+    """
 
+    directory = os.path.dirname(path) or '.'
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+
+    try:
+        with open(fd, 'w') as temp_file:
+            temp_file.write(content)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+
+            # Keep the owner and mode when the file is rewritten, e.g. by root in the power watcher service
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                os.fchmod(temp_file.fileno(), 0o644)
+            else:
+                os.fchmod(temp_file.fileno(), stat.st_mode & 0o7777)
+                if os.geteuid() == 0:
+                    os.fchown(temp_file.fileno(), stat.st_uid, stat.st_gid)
+
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    # Make the rename itself durable
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def _ownedByRoot(path: str) -> bool:
+
+    try:
+        return os.stat(path).st_uid == 0
+    except OSError:
+        return False
+
+
+@atexit.register
+def flushAll() -> None:
+    """
+    Write the pending changes of every Config instance. Registered to run when the program exits.
+    """
 
+    for config in list(_unsaved):
+        config.flush()
 
 
 def configExists() -> bool:
@@ -220,23 +481,8 @@ def checkPrerequisites() -> bool:
 
 def cli():
     """
-    Command line interface to change some settings. Should not be called from GUI.
+    Command line interface to change some settings. Should not be called from GUI. See cli.py.
     """
 
-    import argparse
-
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-set-profile")
-
-    args = vars(parser.parse_args())
-    new_profile = args['set_profile']
-
-    if new_profile:
-        temp_config = Config()
-        temp_config.changeSettings('profile', new_profile)
-        temp_config.applyChanges()
-        
-
-
-if __name__ == "__main__":
-    cli()
+    from .cli import main
+    return main()
@@ -1,6 +1,7 @@
 import os
 
-HOME = os.environ['HOME']
+# expanduser falls back to the password database when HOME is not set (e.g. in services)
+HOME = os.path.expanduser('~')
 FILE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 CONFIG_DIR = os.path.join(HOME, ".config/linux-undervolt/")
@@ -9,3 +10,6 @@ CONFIG_FILE = os.path.join(CONFIG_DIR, "linux-undervolt.conf")
 GLADE_FOLDER = os.path.join(FILE_DIR, "glade_files/")
 MAIN_WINDOW = os.path.join(GLADE_FOLDER, "GUI.glade")
 ADVANCED_WINDOW = os.path.join(GLADE_FOLDER, "main_adv.glade")
+
+# Voltage planes in the order of their intel-undervolt/MSR index
+PLANES = ('cpu', 'gpu', 'cpu_cache', 'sys_agent', 'analog_io')
@@ -0,0 +1,257 @@
+"""
+Per-core frequency, temperature and throttle monitor.
+
+The cpu topology (package, core and, on hybrid cpus, the P-core/E-core type) is read from sysfs once. The files read
+on every tick are opened once as well:
+
+    /sys/devices/system/cpu/cpu*/cpufreq/scaling_cur_freq                      per cpu
+    /sys/class/hwmon/hwmon*/temp*_input (coretemp "Core N" and "Package id N")  per core and package
+    /sys/devices/system/cpu/cpu*/thermal_throttle/core_throttle_count           per core
+    /sys/devices/system/cpu/cpu*/thermal_throttle/package_throttle_count        per package
+
+and a tick is a single pass of pread calls over all of them, so the cost of a tick grows with the number of cpus
+but no file is opened or looked up while monitoring. Increases of the throttle counters are reported as events,
+together with the profile that was active at the time.
+"""
+import glob
+import logging
+import os
+import re
+import time
+
+from typing import Callable, Dict, List, Optional
+
+SYSFS_CPU = "sys/devices/system/cpu"
+HWMON_DIR = "sys/class/hwmon"
+
+# Lists of the cpus of each core type of hybrid cpus
+CORE_TYPES = {
+    'P': "sys/devices/cpu_core/cpus",
+    'E': "sys/devices/cpu_atom/cpus"
+}
+
+
+def parseCpuList(text: str) -> List[int]:
+    """
+    Parse a sysfs cpu list such as "0-3,8,10-11".
+    """
+
+    cpus = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def _readInt(path: str) -> Optional[int]:
+
+    try:
+        with open(path) as value_file:
+            return int(value_file.read())
+    except (OSError, ValueError):
+        return None
+
+
+class Cpu:
+    """
+    A logical cpu and its place in the topology.
+    """
+
+    __slots__ = ("cpu", "package", "core", "type")
+
+    def __init__(self, cpu: int, package: int, core: int, core_type: Optional[str]):
+        self.cpu = cpu
+        self.package = package
+        self.core = core
+        self.type = core_type
+
+
+def readTopology(sysfs_root='/') -> List[Cpu]:
+    """
+    Return the online cpus in order. The type is 'P' or 'E' on hybrid cpus and None otherwise.
+    """
+
+    types = {}
+    for core_type, path in CORE_TYPES.items():
+        try:
+            with open(os.path.join(sysfs_root, path)) as cpus_file:
+                types.update(dict.fromkeys(parseCpuList(cpus_file.read()), core_type))
+        except OSError:
+            continue
+
+    cpus = []
+    for path in glob.glob(os.path.join(sysfs_root, SYSFS_CPU, 'cpu[0-9]*')):
+        cpu = int(re.search(r'(\d+)$', path).group(1))
+
+        # Offline cpus have no topology directory
+        package = _readInt(os.path.join(path, 'topology', 'physical_package_id'))
+        core = _readInt(os.path.join(path, 'topology', 'core_id'))
+        if package is None or core is None:
+            continue
+
+        cpus.append(Cpu(cpu, package, core, types.get(cpu)))
+
+    return sorted(cpus, key=lambda cpu: cpu.cpu)
+
+
+def findCoreTemperatures(sysfs_root='/') -> Dict[tuple, str]:
+    """
+    Return the coretemp inputs keyed by (package, core) for the cores and (package, None) for the packages.
+    """
+
+    inputs = {}
+    for hwmon in sorted(glob.glob(os.path.join(sysfs_root, HWMON_DIR, 'hwmon*'))):
+        try:
+            with open(os.path.join(hwmon, 'name')) as name_file:
+                if name_file.read().strip() != 'coretemp':
+                    continue
+        except OSError:
+            continue
+
+        labels = {}
+        for path in glob.glob(os.path.join(hwmon, 'temp*_label')):
+            try:
+                with open(path) as label_file:
+                    labels[path.replace('_label', '_input')] = label_file.read().strip()
+            except OSError:
+                continue
+
+        # coretemp registers one hwmon device per package, named by its "Package id" input
+        package = next((int(label.split()[-1]) for label in labels.values() if label.startswith('Package id')), 0)
+
+        for path, label in labels.items():
+            if label.startswith('Package id'):
+                inputs[(package, None)] = path
+            elif label.startswith('Core'):
+                inputs[(package, int(label.split()[-1]))] = path
+
+    return inputs
+
+
+class CoreMonitor:
+    """
+    Reads the per-core values in one batch per tick.
+
+    Arguments:
+    sysfs_root - Root of the sysfs tree, e.g. a fixture tree for testing
+    profile    - Callable returning the active profile, stored with the throttle events
+    """
+
+    def __init__(self, sysfs_root='/', profile: Callable[[], Optional[str]] = None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.cpus = readTopology(sysfs_root)
+        self.profile = profile
+
+        # Every opened file is a (fd, kind, key) slot, read in order on every tick
+        self._slots = []
+        self._last = {}
+
+        temperatures = findCoreTemperatures(sysfs_root)
+        cores = set()
+        packages = set()
+
+        for cpu in self.cpus:
+            cpu_dir = os.path.join(sysfs_root, SYSFS_CPU, f"cpu{cpu.cpu}")
+            self._open(os.path.join(cpu_dir, 'cpufreq', 'scaling_cur_freq'), 'freq', cpu.cpu)
+
+            # Sibling threads share the core counters, they are only read through the first cpu of the core
+            core = (cpu.package, cpu.core)
+            if core not in cores:
+                cores.add(core)
+                if core in temperatures:
+                    self._open(temperatures[core], 'core_temp', core)
+                self._open(os.path.join(cpu_dir, 'thermal_throttle', 'core_throttle_count'), 'core_throttle', core)
+
+            if cpu.package not in packages:
+                packages.add(cpu.package)
+                if (cpu.package, None) in temperatures:
+                    self._open(temperatures[(cpu.package, None)], 'package_temp', cpu.package)
+                self._open(os.path.join(cpu_dir, 'thermal_throttle', 'package_throttle_count'),
+                           'package_throttle', cpu.package)
+
+        self.logger.debug(f"Monitoring {len(self.cpus)} cpus with {len(self._slots)} open files")
+
+    def _open(self, path: str, kind: str, key) -> None:
+
+        try:
+            self._slots.append((os.open(path, os.O_RDONLY), kind, key))
+        except OSError:
+            pass
+
+    @property
+    def hybrid(self) -> bool:
+        return any(cpu.type is not None for cpu in self.cpus)
+
+    def read(self) -> dict:
+        """
+        Read every value and return a sample:
+
+            {"time", "profile",
+             "cpus": [{"cpu", "type", "package", "core", "freq" (MHz), "temp" (°C), "throttle"}],
+             "packages": {package: {"temp", "throttle"}},
+             "events": [{"kind": "core" or "package", "package", "core", "count", "profile"}]}
+
+        Values that are unavailable are None. Events are the increases of the throttle counters since the previous
+        read.
+        """
+
+        values = {}
+        for fd, kind, key in self._slots:
+            try:
+                values[(kind, key)] = int(os.pread(fd, 32, 0))
+            except (OSError, ValueError):
+                continue
+
+        profile = self.profile() if self.profile is not None else None
+
+        cpus = []
+        for cpu in self.cpus:
+            core = (cpu.package, cpu.core)
+            freq = values.get(('freq', cpu.cpu))
+            temp = values.get(('core_temp', core))
+            cpus.append({
+                "cpu": cpu.cpu,
+                "type": cpu.type,
+                "package": cpu.package,
+                "core": cpu.core,
+                "freq": freq / 1000 if freq is not None else None,
+                "temp": temp / 1000 if temp is not None else None,
+                "throttle": values.get(('core_throttle', core))
+            })
+
+        packages = {}
+        for package in sorted({cpu.package for cpu in self.cpus}):
+            temp = values.get(('package_temp', package))
+            packages[package] = {
+                "temp": temp / 1000 if temp is not None else None,
+                "throttle": values.get(('package_throttle', package))
+            }
+
+        events = []
+        for (kind, key), count in values.items():
+            if not kind.endswith('_throttle'):
+                continue
+
+            last = self._last.get((kind, key))
+            self._last[(kind, key)] = count
+            if last is None or count <= last:
+                continue
+
+            kind = kind[:-len('_throttle')]
+            events.append({
+                "kind": kind,
+                "package": key[0] if kind == 'core' else key,
+                "core": key[1] if kind == 'core' else None,
+                "count": count - last,
+                "profile": profile
+            })
+
+        return {"time": time.time(), "profile": profile, "cpus": cpus, "packages": packages, "events": events}
+
+    def close(self) -> None:
+
+        for fd, _, _ in self._slots:
+            os.close(fd)
+        self._slots = []
@@ -0,0 +1,220 @@
+"""
+Profile efficiency benchmark.
+
+Applies every profile in turn, runs a fixed amount of the stress workload on all cores while integrating the RAPL
+package energy, and reports throughput (ops/s), energy per op (J/op) and average package power over several
+repetitions. Results are appended to CONFIG_DIR/efficiency.json so runs can be compared, e.g. before and after
+changing an offset.
+"""
+import json
+import logging
+import math
+import os
+import statistics
+import threading
+import time
+
+from typing import Dict, List, Optional
+
+from .config import atomicWrite
+from .constants import CONFIG_DIR
+
+RESULTS_FILE = os.path.join(CONFIG_DIR, "efficiency.json")
+
+# Number of runs kept in the results file
+KEEP_RUNS = 50
+
+
+class EnergyMeter:
+    """
+    Integrates the energy of the RAPL package domains while running. The counters are polled every `interval` seconds
+    so that a wraparound of the counter is never missed.
+    """
+
+    def __init__(self, sampler, interval=1.0):
+        self.domains = [domain for domain in sampler.domains if '/' not in domain.key]
+        self.interval = interval
+        self.joules = 0.0
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._last = {}
+
+    def _poll(self) -> None:
+
+        for domain in self.domains:
+            energy = domain.read()
+            last = self._last.get(domain.key)
+            if last is not None:
+                delta = energy - last
+                if delta < 0:
+                    delta += domain.max_range + 1
+                self.joules += delta / 1e6
+            self._last[domain.key] = energy
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._poll()
+
+    def __enter__(self) -> 'EnergyMeter':
+        self.joules = 0.0
+        self._last = {}
+        self._poll()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._poll()
+
+
+def summarize(repetitions: List[dict]) -> dict:
+    """
+    Turn the repetitions of a profile ({units, seconds, joules}) into the reported figures.
+    """
+
+    ops = [repetition['units'] / repetition['seconds'] for repetition in repetitions]
+    watts = [repetition['joules'] / repetition['seconds'] for repetition in repetitions]
+    joules_per_op = [repetition['joules'] / repetition['units'] for repetition in repetitions]
+
+    def variance(values):
+        return statistics.variance(values) if len(values) > 1 else 0.0
+
+    return {
+        "ops_per_second": statistics.fmean(ops),
+        "ops_per_second_variance": variance(ops),
+        "joules_per_op": statistics.fmean(joules_per_op),
+        "joules_per_op_variance": variance(joules_per_op),
+        "watts": statistics.fmean(watts),
+        "watts_variance": variance(watts)
+    }
+
+
+class EfficiencyBenchmark:
+    """
+    Arguments:
+    config      - Config holding the profiles
+    workload    - StressWorkload doing the work
+    sampler     - RaplSampler providing the energy counters
+    rounds      - Work units per worker in a repetition
+    repetitions - Repetitions per profile
+    settle      - Seconds to wait after applying a profile
+    """
+
+    def __init__(self, config, workload, sampler, rounds=4, repetitions=3, settle=2.0):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.config = config
+        self.workload = workload
+        self.meter = EnergyMeter(sampler)
+        self.rounds = rounds
+        self.repetitions = repetitions
+        self.settle = settle
+
+    def apply(self, settings: dict) -> None:
+        """
+        Apply a profile without making it the active profile. With the MSR engine the offsets are not persisted.
+        """
+
+        from . import helper
+
+        engine = self.config.getSettings().get('engine', 'intel-undervolt')
+        response = helper.getClient(self.config.undervolt_file).request(
+            "apply", settings=settings, engine=engine, persist=False
+        )
+        if not response['ok']:
+            raise RuntimeError(f"Applying {settings} failed: {response.get('error', response.get('output'))}")
+
+    def measure(self) -> dict:
+
+        with self.meter:
+            result = self.workload.runFixed(self.rounds)
+
+        if not result.stable:
+            raise RuntimeError(f"The workload failed: {'; '.join(result.errors)}")
+        return {"units": result.units, "seconds": result.seconds, "joules": self.meter.joules}
+
+    def run(self, profiles: Optional[List[str]] = None, progress=None) -> dict:
+        """
+        Benchmark the given profiles (all profiles by default) and return the run. The active profile is applied
+        again afterwards.
+        """
+
+        profiles = profiles or self.config.getProfiles()
+
+        # The reference results are computed at the active (known stable) profile
+        self.workload.reference()
+
+        results = {}
+        try:
+            for profile in profiles:
+                settings = self.config.getProfileSettings(profile)
+                self.apply(settings)
+                time.sleep(self.settle)
+
+                # Warm up caches and clocks, not measured
+                self.workload.runFixed(1)
+
+                repetitions = []
+                for index in range(self.repetitions):
+                    repetitions.append(self.measure())
+                    if progress is not None:
+                        progress(profile, index + 1, self.repetitions)
+
+                results[profile] = dict(summarize(repetitions), settings=settings, repetitions=repetitions)
+        finally:
+            self.config.applyChanges()
+
+        return {
+            "time": time.time(),
+            "workload": {"rounds": self.rounds, "processes": self.workload.processes},
+            "profiles": results
+        }
+
+
+def loadRuns(path=RESULTS_FILE) -> List[dict]:
+
+    try:
+        with open(path) as results_file:
+            return json.load(results_file)['runs']
+    except FileNotFoundError:
+        return []
+
+
+def saveRun(run: dict, path=RESULTS_FILE) -> None:
+
+    runs = loadRuns(path)
+    runs.append(run)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    atomicWrite(path, json.dumps({"runs": runs[-KEEP_RUNS:]}, indent=2))
+
+
+def previousResult(runs: List[dict], run: dict, profile: str) -> Optional[dict]:
+    """
+    Return the latest earlier result of a profile measured with the same workload, None if there is none.
+    """
+
+    for previous in reversed(runs):
+        if previous is run or previous['time'] >= run['time'] or previous['workload'] != run['workload']:
+            continue
+        if profile in previous['profiles']:
+            return previous['profiles'][profile]
+    return None
+
+
+def compare(current: dict, previous: Optional[dict]) -> Dict[str, float]:
+    """
+    Return the relative change (percent) of every figure between two results of a profile.
+    """
+
+    if previous is None:
+        return {}
+
+    return {
+        key: 100 * (current[key] - previous[key]) / previous[key] if previous[key] else math.nan
+        for key in ("ops_per_second", "joules_per_op", "watts")
+    }
@@ -0,0 +1,336 @@
+"""
+Prometheus/OpenMetrics textfile exporter.
+
+Writes the undervolt and power state to a .prom file every `exporter_interval` seconds (default 15), for the textfile
+collector of node_exporter. The file (CONFIG_DIR/linux-undervolt.prom, or the `exporter_path` setting) is written to a
+hidden temporary file in the same directory and renamed over the previous one, so the collector never reads a partial
+file and ignores the temporary one. The power watcher service runs as root and only takes the path from its environment
+file, which is written by the helper when the service is installed, never from the user's config. It holds:
+
+    linux_undervolt_active_profile                    active profile id, with its name as a label
+    linux_undervolt_offset_millivolts                 offset per plane of the active profile
+    linux_undervolt_rapl_power_watts                  average power per RAPL domain over the interval
+    linux_undervolt_package_temperature_celsius       per package
+    linux_undervolt_core_throttle_total               thermal throttle counter per core
+    linux_undervolt_package_throttle_total            thermal throttle counter per package
+    linux_undervolt_apply_total                       profile applies, of every process using this config directory
+    linux_undervolt_apply_failures_total
+    linux_undervolt_apply_duration_seconds            duration of the last apply
+    linux_undervolt_apply_seconds_total               total duration of all applies
+
+The apply counters are kept in CONFIG_DIR/apply-stats.json, updated by Config.applyChanges. Every sysfs file is opened
+once, and the config is only read again when the config file or a profile changed, so a tick costs a few preads and
+one small write. Nothing here imports GTK.
+"""
+import fcntl
+import json
+import logging
+import math
+import os
+import threading
+
+from typing import Dict, Optional
+
+from . import userfiles
+from .constants import CONFIG_DIR, CONFIG_FILE, PLANES
+
+EXPORT_FILE = os.path.join(CONFIG_DIR, "linux-undervolt.prom")
+APPLY_STATS_FILE = os.path.join(CONFIG_DIR, "apply-stats.json")
+
+# Environment variable of the power watcher service holding the `exporter_path` setting
+EXPORTER_PATH_VARIABLE = "LINUX_UNDERVOLT_EXPORTER_PATH"
+
+DEFAULT_INTERVAL = 15.0
+
+PREFIX = "linux_undervolt_"
+
+
+###############
+# Apply stats #
+###############
+
+def recordApply(seconds: float, ok: bool, stats_file=None) -> None:
+    """
+    Count a profile apply. The file is locked while it is updated, since the GUI, the CLI and the power watcher service
+    may apply at the same time.
+    """
+
+    stats_file = stats_file or APPLY_STATS_FILE
+
+    try:
+        userfiles.makedirs(os.path.dirname(stats_file))
+        fd = userfiles.openFile(stats_file, os.O_RDWR | os.O_CREAT)
+    except OSError:
+        return
+
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+        stats = _parseStats(os.pread(fd, 4096, 0))
+        stats['applies'] += 1
+        stats['failures'] += not ok
+        stats['seconds_total'] += seconds
+        stats['seconds_last'] = seconds
+
+        data = json.dumps(stats).encode()
+        os.pwrite(fd, data, 0)
+        os.ftruncate(fd, len(data))
+    except OSError:
+        # Counting never breaks the apply
+        pass
+    finally:
+        os.close(fd)
+
+
+def _parseStats(data: bytes) -> dict:
+
+    stats = {"applies": 0, "failures": 0, "seconds_total": 0.0, "seconds_last": None}
+    try:
+        stats.update(json.loads(data))
+    except ValueError:
+        pass
+    return stats
+
+
+def readApplyStats(stats_file=None) -> dict:
+    """
+    Return {"applies", "failures", "seconds_total", "seconds_last"}.
+    """
+
+    try:
+        with os.fdopen(userfiles.openFile(stats_file or APPLY_STATS_FILE, os.O_RDONLY), 'rb') as file:
+            fcntl.flock(file, fcntl.LOCK_SH)
+            return _parseStats(file.read())
+    except OSError:
+        return _parseStats(b'')
+
+
+##########
+# Format #
+##########
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _number(value: float) -> str:
+
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class MetricsText:
+    """
+    Builds the exposition text, one metric family (HELP and TYPE lines followed by its samples) at a time.
+    """
+
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name: str, metric_type: str, help_text: str, samples) -> None:
+        """
+        Add a family from (labels, value) pairs. Families without samples are left out.
+        """
+
+        samples = [(labels, value) for labels, value in samples if value is not None]
+        if not samples:
+            return
+
+        name = PREFIX + name
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+            self.lines.append(f"{name}{{{label_text}}} {_number(value)}" if label_text else f"{name} {_number(value)}")
+
+    def text(self) -> str:
+        return '\n'.join(self.lines) + '\n'
+
+
+############
+# Exporter #
+############
+
+class Exporter:
+    """
+    Collects the metrics and writes the export file.
+
+    Arguments:
+    path        - File written on every tick
+    sysfs_root  - Root of the sysfs tree, e.g. a fixture tree for testing
+    config_file - Config file the active profile is read from
+    stats_file  - Apply counters written by Config.applyChanges
+    """
+
+    def __init__(self, path=None, sysfs_root='/', config_file=None, stats_file=None):
+        from .coremon import CoreMonitor
+        from .rapl import RaplSampler
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = path or EXPORT_FILE
+        self.config_file = config_file or CONFIG_FILE
+        self.stats_file = stats_file
+
+        self.rapl = RaplSampler(sysfs_root)
+        self.monitor = CoreMonitor(sysfs_root)
+
+        self._profile_key = None
+        self._profile = None
+
+        # The first RAPL sample only stores the counters
+        if self.rapl.available:
+            self.rapl.sample()
+
+    def _changeKey(self) -> Optional[tuple]:
+
+        from .profiles import PROFILES_DIR
+
+        try:
+            return os.stat(self.config_file).st_mtime_ns, os.stat(PROFILES_DIR).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def profile(self) -> Optional[dict]:
+        """
+        Return {"id", "name", "settings"} of the active profile, re-reading the config only when it changed. Profiles
+        are replaced by renaming, which changes the modification time of the profile directory.
+        """
+
+        from .config import Config
+
+        key = self._changeKey()
+        if key is None:
+            return None
+
+        if key != self._profile_key:
+            self._profile_key = key
+            try:
+                config = Config(self.config_file)
+                self._profile = {
+                    "id": config.getActiveProfile(),
+                    "name": config.getProfileName(),
+                    "settings": config.getProfileSettings()
+                }
+            except (KeyError, ValueError) as err:
+                self.logger.warning(f"Reading the active profile failed: {err}")
+                self._profile = None
+        return self._profile
+
+    def collect(self) -> str:
+        """
+        Return the exposition text of the current state.
+        """
+
+        metrics = MetricsText()
+
+        profile = self.profile()
+        if profile is not None:
+            metrics.family("active_profile", "gauge", "Id of the active profile.",
+                           [({"name": profile['name']}, profile['id'])])
+
+            offsets = []
+            for plane in PLANES:
+                try:
+                    offsets.append(({"plane": plane}, float(profile['settings'].get(plane, 0))))
+                except ValueError:
+                    continue
+            metrics.family("offset_millivolts", "gauge", "Voltage offset per plane of the active profile.", offsets)
+
+        if self.rapl.available:
+            metrics.family("rapl_power_watts", "gauge", "Average power per RAPL domain since the previous export.",
+                           [({"domain": domain}, watts) for domain, watts in self.rapl.sample().items()])
+
+        sample = self.monitor.read()
+        packages = sample['packages'].items()
+        metrics.family("package_temperature_celsius", "gauge", "Cpu package temperature.",
+                       [({"package": package}, values['temp']) for package, values in packages])
+
+        cores = {(cpu['package'], cpu['core']): cpu['throttle'] for cpu in sample['cpus']}
+        metrics.family("core_throttle_total", "counter", "Thermal throttle events per core since boot.",
+                       [({"package": package, "core": core}, count) for (package, core), count in cores.items()])
+        metrics.family("package_throttle_total", "counter", "Thermal throttle events per package since boot.",
+                       [({"package": package}, values['throttle']) for package, values in packages])
+
+        stats = readApplyStats(self.stats_file)
+        metrics.family("apply_total", "counter", "Profile applies.", [({}, stats['applies'])])
+        metrics.family("apply_failures_total", "counter", "Profile applies that failed.", [({}, stats['failures'])])
+        metrics.family("apply_duration_seconds", "gauge", "Duration of the last profile apply.",
+                       [({}, stats['seconds_last'])])
+        metrics.family("apply_seconds_total", "counter", "Total duration of the profile applies.",
+                       [({}, stats['seconds_total'])])
+
+        return metrics.text()
+
+    def write(self) -> None:
+        """
+        Replace the export file. Unlike config.atomicWrite nothing is synced: the file is rewritten on the next tick and
+        losing it in a crash does not matter.
+        """
+
+        text = self.collect()
+
+        userfiles.makedirs(os.path.dirname(os.path.abspath(self.path)))
+        userfiles.replaceFile(self.path, text.encode())
+
+    def close(self) -> None:
+        self.rapl.close()
+        self.monitor.close()
+
+
+def export(exporter: Exporter, interval=DEFAULT_INTERVAL, stop: threading.Event = None) -> None:
+    """
+    Write the export file now and then every `interval` seconds until `stop` is set.
+    """
+
+    stop = stop or threading.Event()
+    while True:
+        try:
+            exporter.write()
+        except OSError as err:
+            exporter.logger.warning(f"Writing {exporter.path} failed: {err}")
+
+        if stop.wait(interval):
+            break
+
+
+def isEnabled(config) -> bool:
+    return config.getBool('exporter', False)
+
+
+def settings(config) -> Dict[str, object]:
+    """
+    Return the path and interval of the exporter of a config. As root (in the power watcher service) the path is the
+    one the service was installed with.
+    """
+
+    values = config.getSettings()
+    path = os.environ.get(EXPORTER_PATH_VARIABLE) if os.geteuid() == 0 else values.get('exporter_path')
+    return {
+        "path": path or EXPORT_FILE,
+        "interval": float(values.get('exporter_interval', DEFAULT_INTERVAL))
+    }
+
+
+def main() -> None:
+    """
+    Export the state of the user's config, if enabled. Started by the power watcher service.
+    """
+
+    from .config import Config
+
+    config = Config()
+    if not isEnabled(config):
+        return
+
+    options = settings(config)
+    exporter = Exporter(options['path'])
+    try:
+        export(exporter, options['interval'])
+    finally:
+        exporter.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+Load and temperature aware profile governor.
+
+Samples the cpu load from /proc/stat, the package temperature from hwmon and the package power from RAPL, and
+switches between profiles following the rules in the GOVERNOR section of the config file:
+
+    [GOVERNOR]
+    enabled = true
+    interval = 2
+    min_dwell = 30
+    hysteresis_load = 10
+    hysteresis_temp = 5
+    hysteresis_power = 3
+    rules =
+        temp > 90 -> 1
+        load > 60 and temp < 85 -> 3
+
+The first rule whose conditions all hold selects the profile. When none does the governor withdraws its request, so
+the AC/battery profile (or the profile selected by the user) is in effect again; with a `default_profile` setting that
+profile is selected instead. The conditions of the rule that is currently in effect are loosened by the hysteresis of
+each metric, and no switch happens until the current profile has been in effect for min_dwell seconds, so the governor
+does not flap between profiles.
+
+Every sample costs three pread calls on files that are kept open, which keeps the governor well below 1% cpu even at
+short intervals. Samples can be recorded to a JSON lines trace and replayed offline to test a rule set.
+"""
+import glob
+import json
+import logging
+import operator
+import os
+import re
+import threading
+import time
+
+from typing import Dict, Iterable, List, Optional
+
+from .rapl import RaplSampler
+
+METRICS = ('load', 'temp', 'power')
+
+DEFAULTS = {
+    'enabled': 'false',
+    'interval': '2',
+    'min_dwell': '30',
+    'default_profile': '',
+    'hysteresis_load': '10',
+    'hysteresis_temp': '5',
+    'hysteresis_power': '3',
+    'rules': ''
+}
+
+HWMON_DIR = "sys/class/hwmon"
+
+# hwmon drivers reporting the cpu package temperature
+HWMON_DRIVERS = ('coretemp', 'k10temp', 'zenpower')
+
+_OPERATORS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le}
+_CLAUSE = re.compile(r"^\s*(load|temp|power)\s*(>=|<=|>|<)\s*(-?\d+(?:\.\d+)?)\s*$")
+
+
+###########
+# Sensors #
+###########
+
+class LoadSensor:
+    """
+    Cpu utilisation (percent of all cpus) since the previous read, from the first line of /proc/stat.
+    """
+
+    def __init__(self, proc_root='/'):
+        self._fd = os.open(os.path.join(proc_root, "proc/stat"), os.O_RDONLY)
+        self._previous = None
+
+    def read(self) -> Optional[float]:
+
+        line = os.pread(self._fd, 256, 0).split(b'\n', 1)[0]
+        values = [int(value) for value in line.split()[1:9]]
+
+        # idle + iowait, everything up to and including steal is busy time
+        idle = values[3] + values[4]
+        total = sum(values)
+
+        previous, self._previous = self._previous, (idle, total)
+        if previous is None or total == previous[1]:
+            return None
+
+        return 100.0 * (1 - (idle - previous[0]) / (total - previous[1]))
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class TemperatureSensor:
+    """
+    Cpu package temperature (°C) from hwmon. Uses the "Package id" input when the driver labels its inputs and the
+    hottest input otherwise.
+    """
+
+    def __init__(self, sysfs_root='/'):
+        self._fds = self._open(sysfs_root)
+
+    @staticmethod
+    def _open(sysfs_root) -> List[int]:
+
+        for hwmon in sorted(glob.glob(os.path.join(sysfs_root, HWMON_DIR, 'hwmon*'))):
+            try:
+                with open(os.path.join(hwmon, 'name')) as name_file:
+                    if name_file.read().strip() not in HWMON_DRIVERS:
+                        continue
+            except OSError:
+                continue
+
+            inputs = sorted(glob.glob(os.path.join(hwmon, 'temp*_input')))
+            for path in inputs:
+                try:
+                    with open(path.replace('_input', '_label')) as label_file:
+                        if label_file.read().startswith(('Package', 'Tctl')):
+                            inputs = [path]
+                            break
+                except OSError:
+                    continue
+
+            return [os.open(path, os.O_RDONLY) for path in inputs]
+
+        return []
+
+    @property
+    def available(self) -> bool:
+        return bool(self._fds)
+
+    def read(self) -> Optional[float]:
+
+        values = []
+        for fd in self._fds:
+            try:
+                values.append(int(os.pread(fd, 32, 0)) / 1000)
+            except (OSError, ValueError):
+                continue
+        return max(values) if values else None
+
+    def close(self) -> None:
+        for fd in self._fds:
+            os.close(fd)
+        self._fds = []
+
+
+class SensorSampler:
+    """
+    Reads all sensors at once and returns a sample {metric: value}. Metrics that are unavailable are left out.
+    """
+
+    def __init__(self, sysfs_root='/', proc_root='/'):
+        self.load = LoadSensor(proc_root)
+        self.temperature = TemperatureSensor(sysfs_root)
+        self.rapl = RaplSampler(sysfs_root)
+
+        # The first load and power values need a previous reading
+        self.load.read()
+        if self.rapl.available:
+            self.rapl.sample()
+
+    def sample(self) -> Dict[str, float]:
+
+        sample = {'load': self.load.read(), 'temp': self.temperature.read()}
+        if self.rapl.available:
+            sample['power'] = self.rapl.sample().get('package-0')
+
+        return {metric: value for metric, value in sample.items() if value is not None}
+
+    def close(self) -> None:
+        self.load.close()
+        self.temperature.close()
+        self.rapl.close()
+
+
+#########
+# Rules #
+#########
+
+class Rule:
+    """
+    Selects `profile` while all clauses (metric, operator, threshold) hold.
+    """
+
+    __slots__ = ("clauses", "profile", "text")
+
+    def __init__(self, clauses: list, profile: str, text=''):
+        self.clauses = clauses
+        self.profile = profile
+        self.text = text
+
+    @classmethod
+    def parse(cls, text: str) -> 'Rule':
+        """
+        Parse a rule of the form "load > 60 and temp < 85 -> 3".
+        """
+
+        condition, arrow, profile = text.rpartition('->')
+        if not arrow or not profile.strip() or not condition.strip():
+            raise ValueError(f"Invalid governor rule {text!r}, expected '<conditions> -> <profile>'")
+
+        clauses = []
+        for clause in re.split(r"\band\b", condition):
+            match = _CLAUSE.match(clause)
+            if match is None:
+                raise ValueError(f"Invalid condition {clause.strip()!r} in governor rule {text!r}")
+            clauses.append((match.group(1), match.group(2), float(match.group(3))))
+
+        return cls(clauses, profile.strip(), text.strip())
+
+    def matches(self, sample: Dict[str, float], hysteresis: Dict[str, float] = None) -> bool:
+        """
+        Check the rule against a sample. With hysteresis, every threshold is moved by the hysteresis of its metric in
+        the direction that keeps the rule matching.
+        """
+
+        for metric, symbol, threshold in self.clauses:
+            value = sample.get(metric)
+            if value is None:
+                return False
+
+            if hysteresis:
+                margin = hysteresis.get(metric, 0)
+                threshold = threshold - margin if symbol[0] == '>' else threshold + margin
+
+            if not _OPERATORS[symbol](value, threshold):
+                return False
+        return True
+
+    def __repr__(self) -> str:
+        return f"Rule({self.text!r})"
+
+
+def parseRules(text: str) -> List[Rule]:
+    return [Rule.parse(line) for line in text.splitlines() if line.strip() and not line.strip().startswith('#')]
+
+
+############
+# Governor #
+############
+
+class Governor:
+    """
+    Decides which profile should be in effect for a stream of samples.
+
+    Arguments:
+    rules           - Rules in order of priority
+    default_profile - Profile used when no rule matches, None to select no profile
+    on_switch       - Callback receiving the new profile, None when no profile is selected any more
+    min_dwell       - Minimum time (seconds) a profile stays in effect
+    hysteresis      - {metric: margin} by which the conditions of the rule in effect are loosened
+    profile         - Profile in effect when the governor starts
+    """
+
+    def __init__(self, rules: Iterable[Rule], default_profile: Optional[str] = None, on_switch=None, min_dwell=30.0,
+                 hysteresis: Dict[str, float] = None, profile=None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.rules = list(rules)
+        self.default_profile = str(default_profile) if default_profile is not None else None
+        self.on_switch = on_switch
+        self.min_dwell = min_dwell
+        self.hysteresis = hysteresis or {}
+
+        self.profile = profile
+        self.rule = None
+        self.since = None
+
+    @classmethod
+    def fromConfig(cls, config, on_switch=None) -> 'Governor':
+
+        settings = dict(DEFAULTS, **config.getGovernorSettings())
+        hysteresis = {metric: float(settings[f'hysteresis_{metric}']) for metric in METRICS}
+
+        # Rules may name their profile, the governor works with ids
+        rules = parseRules(settings['rules'])
+        for rule in rules:
+            rule.profile = config.findProfile(rule.profile) or rule.profile
+        default = settings['default_profile'] or None
+        if default is not None:
+            default = config.findProfile(default) or default
+
+        return cls(rules, default, on_switch, float(settings['min_dwell']), hysteresis, config.getSettings('profile'))
+
+    def select(self, sample: Dict[str, float]):
+        """
+        Return (index of the matching rule or None, profile) for a sample.
+        """
+
+        for index, rule in enumerate(self.rules):
+            if rule.matches(sample, self.hysteresis if index == self.rule else None):
+                return index, rule.profile
+        return None, self.default_profile
+
+    def update(self, sample: Dict[str, float], now: float = None) -> bool:
+        """
+        Feed a sample. Returns whether the governor switched, to another profile or to none.
+        """
+
+        if now is None:
+            now = time.monotonic()
+        index, profile = self.select(sample)
+
+        if profile == self.profile:
+            self.rule = index
+            return False
+        if self.since is not None and now - self.since < self.min_dwell:
+            return False
+
+        if profile is None:
+            self.logger.info("No rule matches, withdrawing the profile")
+        else:
+            self.logger.info(f"Switching to profile {profile} "
+                             f"({self.rules[index].text if index is not None else 'default'})")
+        self.profile = profile
+        self.rule = index
+        self.since = now
+
+        if self.on_switch is not None:
+            self.on_switch(profile)
+        return True
+
+
+def replay(governor: Governor, samples: Iterable[dict]) -> List[tuple]:
+    """
+    Run a governor over recorded samples ({"time": seconds, metric: value, ...}) and return the switches as a list
+    of (time, profile). The profile is None where no rule matched any more.
+    """
+
+    switches = []
+    for sample in samples:
+        if governor.update(sample, sample['time']):
+            switches.append((sample['time'], governor.profile))
+    return switches
+
+
+def readTrace(path: str) -> Iterable[dict]:
+
+    with open(path) as trace:
+        for line in trace:
+            if line.strip():
+                yield json.loads(line)
+
+
+###########
+# Service #
+###########
+
+def applyProfile(profile: str) -> None:
+    """
+    Make a profile (given by id or name) the active profile and apply it.
+    """
+
+    from .config import Config
+
+    config = Config()
+
+    # Rules and application mappings may name the profile instead of giving its id
+    profile_id = config.findProfile(profile)
+    if profile_id is None:
+        logging.getLogger(__name__).error(f"Unknown profile: {profile}")
+        return
+    profile = profile_id
+
+    if profile != config.getSettings('profile'):
+        config.changeSettings('profile', profile)
+        config.flush()
+
+    config.applyChanges()
+
+
+def isEnabled(config) -> bool:
+    return config.getGovernorSettings().get('enabled', DEFAULTS['enabled']).lower() in ('1', 'yes', 'true', 'on')
+
+
+def run(governor: Governor, sampler: SensorSampler, interval=2.0, trace=None, stop: threading.Event = None) -> None:
+    """
+    Sample every `interval` seconds and feed the governor until `stop` is set. Samples are appended to the open file
+    `trace` when given.
+    """
+
+    stop = stop or threading.Event()
+    start = time.monotonic()
+
+    while not stop.wait(interval):
+        sample = sampler.sample()
+
+        if trace is not None:
+            trace.write(json.dumps(dict(sample, time=round(time.monotonic() - start, 3))) + '\n')
+            trace.flush()
+
+        governor.update(sample)
+
+
+def main(stop: threading.Event = None) -> None:
+    """
+    Run the governor configured in the user's config, if it is enabled. Started by the power watcher service, the
+    selected profiles are requested from the arbiter, where mapped applications take precedence.
+    """
+
+    from .arbiter import getArbiter
+    from .config import Config
+
+    config = Config()
+    if not isEnabled(config):
+        return
+
+    settings = dict(DEFAULTS, **config.getGovernorSettings())
+    sampler = SensorSampler()
+    try:
+        governor = Governor.fromConfig(config, lambda profile: getArbiter().request('governor', profile))
+
+        # Nothing is requested yet: the first matching rule is requested even when its profile is the active one, so
+        # it takes precedence over the power source switch from the start
+        governor.profile = None
+        run(governor, sampler, float(settings['interval']), stop=stop)
+    finally:
+        sampler.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
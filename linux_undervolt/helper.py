@@ -0,0 +1,888 @@
+#!/usr/bin/env python3
+"""
+Long running privileged helper.
+
+The helper is started once per session through pkexec (so polkit is only asked once) and then serves typed requests
+from the GUI and CLI over a Unix socket. Every request is a single line of JSON, e.g.
+
+    {"op": "apply", "settings": {"cpu": -50, "gpu": -30, ...}}
+
+and is answered with a single line of JSON containing at least "ok" and "returncode". Several operations can be sent
+as one "batch" request (see Transaction), which runs them as a single transaction with shared reloads and per-step
+results; `--batch` runs such a transaction once, reading the steps from stdin, without starting the resident helper.
+
+Running the helper with --root DIR starts it in stand-in mode: it runs unprivileged, every system path is redirected
+into DIR and external commands are only recorded in DIR/commands.log instead of being executed.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from . import tracing
+from .constants import FILE_DIR, PLANES
+
+SOCKET_NAME = "linux-undervolt.sock"
+UNDERVOLT_FILE = "/etc/intel-undervolt.conf"
+
+# Environment variable that makes the client spawn the helper in stand-in mode against the given directory
+ROOT_ENV = "LINUX_UNDERVOLT_HELPER_ROOT"
+
+# Limits for the voltage offsets accepted by the helper (mV)
+OFFSET_RANGE = (-500, 500)
+
+# Reloads needed after files in these directories changed
+DAEMON_RELOAD = ("systemctl", "daemon-reload")
+RELOADS = {
+    "/etc/systemd/system/": DAEMON_RELOAD,
+    "/etc/udev/rules.d/": ("udevadm", "control", "--reload"),
+}
+
+# Operations that can be steps of a batch
+BATCH_OPERATIONS = ("apply", "read", "startup", "install_watcher", "remove_watcher")
+
+
+class HelperError(Exception):
+    """
+    Raised when a request sent to the helper is malformed or not allowed.
+    """
+
+
+def socketPath(root=None) -> str:
+    """
+    Return the path of the helper socket. In stand-in mode the socket lives inside the stand-in directory, otherwise
+    it is placed in the user's runtime directory.
+    """
+
+    if root:
+        return os.path.join(root, SOCKET_NAME)
+
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return os.path.join(runtime_dir, SOCKET_NAME)
+
+
+#####################
+# Privileged side   #
+#####################
+
+class PrivilegedOperations:
+    """
+    The operations the helper is allowed to perform. Each public method takes the already decoded request
+    parameters and returns a result dictionary.
+    """
+
+    def __init__(self, root=None, undervolt_file=UNDERVOLT_FILE):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.root = root
+        self.undervolt_file = undervolt_file
+        self._lock = threading.Lock()
+        self._msr = None
+
+        # Durations (s) of the stages of the running operation, returned to the client for its timing spans
+        self._timings = {}
+
+        # Reloads owed after unit files or udev rules changed, run once at the end of a request (or earlier, when a
+        # later command depends on them)
+        self._pending_reloads = set()
+
+        self.operations = {
+            "ping": self.ping,
+            "apply": self.apply,
+            "read": self.read,
+            "startup": self.startup,
+            "install_watcher": self.installWatcher,
+            "remove_watcher": self.removeWatcher,
+            "batch": self.batch,
+        }
+
+    def handle(self, request: dict) -> dict:
+        """
+        Dispatch a single request to the matching operation.
+        """
+
+        with self._lock:
+            result = self._dispatch(request)
+
+            # A failing reload fails the request, unless the request had already failed
+            reload = self._reload()
+            if reload.returncode and result.get("ok"):
+                result.update(ok=False, returncode=reload.returncode, output=reload.stdout)
+
+        return result
+
+    def _dispatch(self, request: dict) -> dict:
+
+        op = request.get("op")
+        if op not in self.operations:
+            return {"ok": False, "returncode": 1, "error": f"Unknown operation: {op}"}
+
+        timings = self._timings = {}
+        try:
+            result = self.operations[op](request)
+        except HelperError as err:
+            return {"ok": False, "returncode": 1, "error": str(err)}
+        except OSError as err:
+            self.logger.exception(f"Operation {op} failed")
+            return {"ok": False, "returncode": 1, "error": str(err)}
+
+        result.setdefault("returncode", 0)
+        result["ok"] = result["returncode"] == 0
+        if timings:
+            result["timings"] = timings
+        return result
+
+    #############
+    # Utilities #
+    #############
+
+    def _path(self, path: str) -> str:
+        """
+        Translate a system path into the stand-in directory when running in stand-in mode.
+        """
+
+        if self.root:
+            return os.path.join(self.root, path.lstrip('/'))
+        return path
+
+    def _run(self, args: list) -> subprocess.CompletedProcess:
+        """
+        Run an external command. In stand-in mode the command is only recorded.
+        """
+
+        if self.root:
+            with open(os.path.join(self.root, "commands.log"), 'a') as log:
+                log.write(' '.join(args) + '\n')
+            return subprocess.CompletedProcess(args, 0, stdout='')
+
+        return subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+
+    def _writeFile(self, path: str, content: str, mode=0o644) -> bool:
+        """
+        Atomically replace a file. The temporary file is created next to the target so that the final rename never
+        crosses filesystems. A file that already has the given content is left alone. Returns whether the file was
+        written.
+        """
+
+        system_path = path
+        path = self._path(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        try:
+            with open(path) as current_file:
+                if current_file.read() == content:
+                    return False
+        except (OSError, UnicodeDecodeError):
+            pass
+
+        # A temporary file of its own, so concurrent writers never write into each other's
+        fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp",
+                                         dir=os.path.dirname(path))
+        try:
+            with open(fd, 'w') as temp_file:
+                temp_file.write(content)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+                os.fchmod(temp_file.fileno(), mode)
+
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        self._markReload(system_path)
+        return True
+
+    def _removeFile(self, path: str) -> bool:
+        """
+        Remove a file if it exists. Returns whether it existed.
+        """
+
+        try:
+            os.remove(self._path(path))
+        except FileNotFoundError:
+            return False
+
+        self._markReload(path)
+        return True
+
+    @contextlib.contextmanager
+    def _timed(self, stage: str):
+        """
+        Record the duration of a stage of the running operation.
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._timings[stage] = self._timings.get(stage, 0.0) + time.perf_counter() - start
+
+    def _markReload(self, path: str) -> None:
+
+        for directory, command in RELOADS.items():
+            if path.startswith(directory):
+                self._pending_reloads.add(command)
+
+    def _reload(self, command=None) -> subprocess.CompletedProcess:
+        """
+        Run the pending reloads, or only the given one if it is pending.
+        """
+
+        commands = sorted(self._pending_reloads) if command is None else [command]
+        output = []
+
+        for pending in commands:
+            if pending not in self._pending_reloads:
+                continue
+
+            self._pending_reloads.discard(pending)
+            run = self._run(list(pending))
+            output.append(run.stdout or '')
+            if run.returncode:
+                return subprocess.CompletedProcess(pending, run.returncode, stdout=''.join(output))
+
+        return subprocess.CompletedProcess(commands, 0, stdout=''.join(output))
+
+    @staticmethod
+    def _validateSettings(settings) -> dict:
+
+        from . import undervolt_conf
+
+        if not isinstance(settings, dict):
+            raise HelperError("settings must be a dictionary")
+
+        validated = {}
+        for plane in PLANES:
+            value = settings.get(plane, 0)
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise HelperError(f"Invalid offset for {plane}: {value!r}")
+
+            if not OFFSET_RANGE[0] <= value <= OFFSET_RANGE[1]:
+                raise HelperError(f"Offset for {plane} out of range: {value}")
+
+            validated[plane] = value
+
+        try:
+            validated.update(undervolt_conf.parseLimits(settings))
+        except ValueError as err:
+            raise HelperError(str(err))
+
+        return validated
+
+    ##############
+    # Operations #
+    ##############
+
+    def ping(self, _) -> dict:
+        return {"returncode": 0, "pid": os.getpid(), "standin": bool(self.root)}
+
+    def _msrEngine(self):
+        """
+        Return the MSR engine of this helper. The engine (and its open device files) is kept for the whole session.
+        """
+
+        from . import msr
+
+        if self._msr is None:
+            if self.root:
+                os.makedirs(self._path("/dev/cpu/0"), exist_ok=True)
+                self._msr = msr.MsrEngine(self._path(msr.MSR_PATH), self.root, msr.FakeMsrDevice)
+            else:
+                self._msr = msr.MsrEngine()
+
+        return self._msr
+
+    def _persist(self, settings: dict) -> bool:
+        """
+        Write the offsets to the undervolt file. The file is only touched when the rendered contents differ from
+        what is already there. Returns whether the file was written.
+        """
+
+        from . import undervolt_conf
+
+        with self._timed("render"):
+            conf = undervolt_conf.load(self._path(self.undervolt_file))
+            text = conf.render(settings)
+
+        if text == conf.text:
+            return False
+
+        with self._timed("write"):
+            self._writeFile(self.undervolt_file, text)
+        return True
+
+    def apply(self, request: dict) -> dict:
+        """
+        Write the given offsets to the undervolt file and apply them, either through intel-undervolt or directly
+        through the MSR engine. The undervolt file is kept up to date so the intel-undervolt service applies the same
+        values on boot, unless "persist" is false (e.g. for trying out offsets).
+
+        Power limits, tjoffset and hwphint are only applied by intel-undervolt, so settings holding any of them are
+        always written and applied through intel-undervolt, in the same step as the offsets. intel-undervolt reads
+        everything from the file, so without persist the previous contents are put back right after the apply.
+
+        When the MSR engine fails the settings are applied through intel-undervolt instead, unless "fallback" is false,
+        in which case the request fails.
+        """
+
+        from . import undervolt_conf
+        from .msr import MsrError
+
+        with self._timed("validate"):
+            settings = self._validateSettings(request.get("settings"))
+        persist = request.get("persist", True)
+        limits = any(key in settings for key in undervolt_conf.LIMITS)
+
+        if request.get("engine") == "msr" and not limits:
+            try:
+                with self._timed("msr"):
+                    applied = self._msrEngine().apply(settings)
+            except (MsrError, OSError) as err:
+                self._msr = None
+                if not request.get("fallback", True):
+                    raise HelperError(f"MSR engine failed: {err}")
+                self.logger.warning(f"MSR engine failed, falling back to intel-undervolt: {err}")
+            else:
+                written = self._persist(settings) if persist else False
+                return {"returncode": 0, "output": '', "applied": applied, "written": written}
+
+        previous = None if persist else undervolt_conf.load(self._path(self.undervolt_file)).text
+
+        # intel-undervolt reads the offsets from the file, so it always has to be written
+        written = self._persist(settings)
+        try:
+            with self._timed("intel-undervolt"):
+                run = self._run(["intel-undervolt", "apply"])
+        finally:
+            if written and previous is not None:
+                with self._timed("write"):
+                    self._writeFile(self.undervolt_file, previous)
+                written = False
+
+        return {"returncode": run.returncode, "output": run.stdout, "written": written}
+
+    def read(self, request: dict) -> dict:
+        """
+        Read the offsets and power limits in effect, through the MSR engine or `intel-undervolt read`.
+        """
+
+        from .msr import MsrError
+        from .readback import parseRead
+
+        if request.get("engine") == "msr":
+            try:
+                engine = self._msrEngine()
+                return {"offsets": engine.read(), "limits": engine.readLimits(), "source": "msr"}
+            except (MsrError, OSError) as err:
+                self.logger.warning(f"MSR engine failed, falling back to intel-undervolt: {err}")
+                self._msr = None
+
+        run = self._run(["intel-undervolt", "read"])
+        offsets, limits = parseRead(run.stdout)
+
+        return {
+            "returncode": run.returncode, "output": run.stdout,
+            "offsets": offsets, "limits": limits, "source": "intel-undervolt"
+        }
+
+    def startup(self, request: dict) -> dict:
+        """
+        Start or stop the intel-undervolt service.
+        """
+
+        key = {
+            0: "stop",
+            1: "start"
+        }
+
+        value = request.get("value")
+        if value not in key:
+            raise HelperError(f"Invalid startup value: {value!r}")
+
+        run = self._run(["systemctl", key[value], "intel-undervolt"])
+        return {"returncode": run.returncode, "output": run.stdout}
+
+    def _removeLegacyRule(self) -> None:
+        """
+        Remove the udev rule and oneshot service used for profile switching by older versions.
+        """
+
+        from .backend import UDEV_RULE, POWERSAVE_SERVICE, POWERSAVE_ENV
+
+        for path in (UDEV_RULE, POWERSAVE_SERVICE, POWERSAVE_ENV):
+            self._removeFile(path)
+
+    def installWatcher(self, request: dict) -> dict:
+        """
+        Install and (re)start the power watcher service used to switch profiles on power source change. systemd is
+        only reloaded when the unit files changed.
+        """
+
+        from .backend import powerWatcherFiles, WATCHER_UNIT
+
+        home = request.get('home', '')
+        if not isinstance(home, str) or not os.path.isabs(home) or '\n' in home:
+            raise HelperError(f"Invalid home directory: {home!r}")
+
+        # Written by the service as root, so only a .prom file given by an authorized user
+        exporter_path = request.get('exporter_path')
+        if exporter_path is not None and (not isinstance(exporter_path, str) or not os.path.isabs(exporter_path)
+                                          or '\n' in exporter_path or not exporter_path.endswith('.prom')):
+            raise HelperError(f"Invalid exporter path: {exporter_path!r}")
+
+        if not sys.executable or any(char in sys.executable + FILE_DIR for char in '"\\\n'):
+            raise HelperError(f"The service can not run {sys.executable!r} with the package in {FILE_DIR!r}")
+
+        for path, content in powerWatcherFiles(home, exporter_path).items():
+            self._writeFile(path, content)
+
+        self._removeLegacyRule()
+
+        # enable and restart have to see the new unit
+        reload = self._reload(DAEMON_RELOAD)
+        if reload.returncode:
+            return {"returncode": reload.returncode, "output": reload.stdout}
+
+        output = [reload.stdout]
+        commands = (
+            ["systemctl", "enable", WATCHER_UNIT],
+            ["systemctl", "restart", WATCHER_UNIT],
+        )
+        for command in commands:
+            run = self._run(command)
+            output.append(run.stdout or '')
+            if run.returncode:
+                return {"returncode": run.returncode, "output": ''.join(output)}
+
+        return {"returncode": 0, "output": ''.join(output)}
+
+    def removeWatcher(self, _) -> dict:
+        """
+        Stop the power watcher and remove the files installed by installWatcher (and by older versions).
+        """
+
+        from .backend import WATCHER_SERVICE, WATCHER_ENV, WATCHER_UNIT
+
+        if os.path.isfile(self._path(WATCHER_SERVICE)):
+            self._run(["systemctl", "disable", "--now", WATCHER_UNIT])
+
+        for path in (WATCHER_SERVICE, WATCHER_ENV):
+            self._removeFile(path)
+
+        self._removeLegacyRule()
+
+        return {"returncode": 0}
+
+    def batch(self, request: dict) -> dict:
+        """
+        Carry out several operations as one transaction, e.g.
+
+            {"op": "batch", "steps": [{"op": "apply", "settings": {...}}, {"op": "startup", "value": 1},
+                                      {"op": "install_watcher", "home": "/home/user"}]}
+
+        The steps run in order and the transaction stops at the first failing step; the steps after it are reported
+        as skipped. Reloads needed by several steps (systemctl daemon-reload, udevadm control --reload) run once, when
+        the unit files or rules actually changed. The result holds the result of every step under "steps".
+        """
+
+        steps = request.get("steps")
+        if not isinstance(steps, list) or not all(isinstance(step, dict) for step in steps):
+            raise HelperError("steps must be a list of requests")
+
+        for step in steps:
+            if step.get("op") not in BATCH_OPERATIONS:
+                raise HelperError(f"Operation not allowed in a batch: {step.get('op')!r}")
+
+        results = []
+        returncode = 0
+        for step in steps:
+            if returncode:
+                results.append({"op": step["op"], "ok": False, "returncode": None, "skipped": True})
+                continue
+
+            start = time.monotonic()
+            result = self._dispatch(step)
+            result.update(op=step["op"], seconds=time.monotonic() - start)
+            results.append(result)
+
+            returncode = result["returncode"]
+
+        return {"returncode": returncode, "steps": results}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self) -> None:
+        server = self.server
+
+        if not server.peerAllowed(self.request):
+            server.logger.warning("Rejected connection from unauthorised peer")
+            return
+
+        server.connectionOpened()
+        try:
+            for line in self.rfile:
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    response = {"ok": False, "returncode": 1, "error": "Malformed request"}
+                else:
+                    if request.get("op") == "shutdown":
+                        response = {"ok": True, "returncode": 0}
+                        threading.Thread(target=server.shutdown, daemon=True).start()
+                    else:
+                        response = server.operations.handle(request)
+
+                self.wfile.write(json.dumps(response).encode() + b'\n')
+                self.wfile.flush()
+        finally:
+            server.connectionClosed()
+
+
+class HelperServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Unix socket server that only accepts connections from the owning user (and root).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path: str, operations: PrivilegedOperations, owner: int, idle_timeout=0):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.operations = operations
+        self.owner = owner
+        self.idle_timeout = idle_timeout
+
+        self._connections = 0
+        self._last_activity = time.monotonic()
+        self._activity_lock = threading.Lock()
+
+        if os.path.exists(path):
+            os.remove(path)
+
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+
+        if os.geteuid() == 0 and owner != 0:
+            os.chown(path, owner, -1)
+
+    def peerAllowed(self, sock) -> bool:
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        _, uid, _ = struct.unpack('3i', creds)
+        return uid in (self.owner, 0, os.geteuid())
+
+    def connectionOpened(self) -> None:
+        with self._activity_lock:
+            self._connections += 1
+
+    def connectionClosed(self) -> None:
+        with self._activity_lock:
+            self._connections -= 1
+            self._last_activity = time.monotonic()
+
+    def idleWatch(self) -> None:
+        """
+        Shut the server down once no client has been connected for idle_timeout seconds.
+        """
+
+        while True:
+            time.sleep(min(self.idle_timeout, 5))
+            with self._activity_lock:
+                idle = not self._connections and time.monotonic() - self._last_activity > self.idle_timeout
+            if idle:
+                self.logger.info("Idle timeout reached, shutting down")
+                self.shutdown()
+                return
+
+
+def serve(socket_path: str, owner: int, root=None, undervolt_file=UNDERVOLT_FILE, idle_timeout=0) -> None:
+
+    operations = PrivilegedOperations(root, undervolt_file)
+    server = HelperServer(socket_path, operations, owner, idle_timeout)
+
+    if idle_timeout:
+        threading.Thread(target=server.idleWatch, daemon=True).start()
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        try:
+            os.remove(socket_path)
+        except FileNotFoundError:
+            pass
+
+
+#####################
+# Unprivileged side #
+#####################
+
+class HelperClient:
+    """
+    Client used by the GUI and CLI to talk to the helper. The helper is spawned on first use. When the client
+    already runs as root the operations are performed in-process.
+    """
+
+    SPAWN_TIMEOUT = 120
+
+    def __init__(self, root=None, undervolt_file=UNDERVOLT_FILE):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.root = root if root is not None else os.environ.get(ROOT_ENV)
+        self.undervolt_file = undervolt_file
+        self.socket_path = socketPath(self.root)
+
+        self._sock = None
+        self._stream = None
+        self._process = None
+        self._lock = threading.Lock()
+        self._local = None
+
+        if os.geteuid() == 0 and not self.root:
+            self._local = PrivilegedOperations(undervolt_file=undervolt_file)
+
+    def request(self, op: str, **params) -> dict:
+        """
+        Send a request to the helper and return its response.
+        """
+
+        with tracing.span(f"helper.{op}") as span:
+            response = self._request(dict(params, op=op))
+
+            # Stages timed by the helper process
+            tracing.addTimings(response.get("timings"), "helper.")
+            span.set(returncode=response.get("returncode"))
+
+        return response
+
+    def _request(self, request: dict) -> dict:
+
+        if self._local is not None:
+            return self._local.handle(request)
+
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    self._ensureConnected()
+                    self._stream.write(json.dumps(request).encode() + b'\n')
+                    self._stream.flush()
+                    line = self._stream.readline()
+                    if not line:
+                        raise ConnectionError("Helper closed the connection")
+                    return json.loads(line)
+
+                except HelperError as err:
+                    return {"ok": False, "returncode": 126, "error": str(err)}
+
+                except OSError as err:
+                    self.logger.warning(f"Lost connection to helper: {err}")
+                    self.close()
+
+        return {"ok": False, "returncode": 1, "error": "Unable to reach the privileged helper"}
+
+    def systemPath(self, path: str) -> str:
+        """
+        Return where the helper sees the given system path (differs from the path in stand-in mode).
+        """
+
+        if self.root:
+            return os.path.join(self.root, path.lstrip('/'))
+        return path
+
+    def close(self) -> None:
+
+        if self._stream is not None:
+            self._stream.close()
+        if self._sock is not None:
+            self._sock.close()
+
+        self._sock = None
+        self._stream = None
+
+    def _connect(self) -> bool:
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            return False
+
+        self._sock = sock
+        self._stream = sock.makefile('rwb')
+        return True
+
+    def _ensureConnected(self) -> None:
+
+        if self._sock is not None or self._connect():
+            return
+
+        with tracing.span("helper.spawn"):
+            self._spawnAndConnect()
+
+    def _spawnAndConnect(self) -> None:
+
+        # With pkexec this includes the time spent in the polkit prompt
+        self._spawn()
+
+        deadline = time.monotonic() + self.SPAWN_TIMEOUT
+        while time.monotonic() < deadline:
+            if self._connect():
+                return
+
+            # pkexec exits early when authentication is dismissed or fails
+            if self._process.poll() is not None:
+                raise HelperError(f"Helper could not be started (exit code {self._process.returncode})")
+
+            time.sleep(0.05)
+
+        raise HelperError("Timed out waiting for the helper to start")
+
+    def running(self) -> bool:
+        """
+        Return whether requests can be answered without starting the helper.
+        """
+
+        with self._lock:
+            return self._local is not None or self._sock is not None or self._connect()
+
+    def _command(self, *arguments) -> tuple:
+        """
+        Return the command line and environment starting the helper with the given arguments.
+        """
+
+        package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        helper = [
+            sys.executable, "-m", "linux_undervolt.helper",
+            "--owner", str(os.getuid()),
+            "--socket", self.socket_path,
+            "--undervolt-file", self.undervolt_file,
+            *arguments
+        ]
+
+        if self.root:
+            return helper + ["--root", self.root], dict(os.environ, PYTHONPATH=package_parent)
+        return ["pkexec", "env", f"PYTHONPATH={package_parent}"] + helper, None
+
+    def _spawn(self) -> None:
+
+        command, env = self._command()
+
+        self.logger.info("Starting privileged helper")
+        self._process = subprocess.Popen(command, env=env, stdin=subprocess.DEVNULL)
+
+    def runOnce(self, steps: list) -> dict:
+        """
+        Run a batch through a helper started only for it (one pkexec invocation, the steps are passed on stdin)
+        instead of the resident helper.
+        """
+
+        command, env = self._command("--batch")
+        run = subprocess.run(command, env=env, input=json.dumps(steps), stdout=subprocess.PIPE,
+                             universal_newlines=True)
+
+        try:
+            return json.loads(run.stdout)
+        except ValueError:
+            return {"ok": False, "returncode": run.returncode or 1, "error": "The helper could not be started"}
+
+
+class Transaction:
+    """
+    Collects helper operations and carries them out in a single batch request. Every method adds a step and returns
+    the transaction, so steps can be chained:
+
+        Transaction().apply(settings, engine).startup(1).installWatcher(HOME).run()
+    """
+
+    def __init__(self):
+        self.steps = []
+
+    def add(self, op: str, **params) -> 'Transaction':
+        self.steps.append(dict(params, op=op))
+        return self
+
+    def apply(self, settings: dict, engine='intel-undervolt', persist=True) -> 'Transaction':
+        return self.add("apply", settings=settings, engine=engine, persist=persist)
+
+    def startup(self, value: int) -> 'Transaction':
+        return self.add("startup", value=value)
+
+    def installWatcher(self, home: str, exporter_path=None) -> 'Transaction':
+        return self.add("install_watcher", home=home, exporter_path=exporter_path)
+
+    def removeWatcher(self) -> 'Transaction':
+        return self.add("remove_watcher")
+
+    def run(self, client: 'HelperClient' = None, once=False) -> dict:
+        """
+        Carry out the steps. With once, a helper that is not running yet is only started for this batch.
+        """
+
+        client = client or getClient()
+        if once and not client.running():
+            return client.runOnce(self.steps)
+        return client.request("batch", steps=self.steps)
+
+
+_clients = {}
+
+def getClient(undervolt_file=UNDERVOLT_FILE) -> HelperClient:
+    """
+    Return the client shared by the whole process, so that a single helper (and polkit prompt) serves the session.
+    """
+
+    if undervolt_file not in _clients:
+        _clients[undervolt_file] = HelperClient(undervolt_file=undervolt_file)
+    return _clients[undervolt_file]
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description="Privileged helper for linux-undervolt")
+    parser.add_argument("--owner", type=int, default=os.getuid(), help="uid allowed to connect to the helper")
+    parser.add_argument("--socket", help="path of the Unix socket")
+    parser.add_argument("--root", help="run unprivileged against this directory (stand-in mode)")
+    parser.add_argument("--undervolt-file", default=UNDERVOLT_FILE)
+    parser.add_argument("--idle-timeout", type=float, default=900,
+                        help="exit after this many seconds without clients (0 to run forever)")
+    parser.add_argument("--batch", action="store_true",
+                        help="run the batch of steps read from stdin (JSON list) and exit instead of serving")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.root:
+        os.makedirs(args.root, exist_ok=True)
+
+    if args.batch:
+        try:
+            steps = json.load(sys.stdin)
+        except ValueError:
+            steps = None
+
+        result = PrivilegedOperations(args.root, args.undervolt_file).handle({"op": "batch", "steps": steps})
+        print(json.dumps(result))
+        sys.exit(result["returncode"])
+
+    socket_path = args.socket or socketPath(args.root)
+    serve(socket_path, args.owner, args.root, args.undervolt_file, args.idle_timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+"""
+Content-addressed config history.
+
+Every save and apply of the config records a version in CONFIG_DIR/history:
+
+    objects/ab/cdef...   blobs named by the SHA-256 of their content, written once and never changed
+    versions             one fixed-width record per version: time, kind (save, apply, restore) and manifest hash
+
+A version points to a manifest blob holding the general settings (the SETTINGS, GOVERNOR and APPLICATIONS sections)
+and the hash of a profile list, which holds the id, name and blob hash of every profile in display order; a profile
+blob holds the settings of one profile. Blobs are canonical JSON, so identical settings always hash the same and are
+stored once, however often they are saved. A record is found by version with a single pread at version * record size.
+Only profiles changed since the previous version are serialized and hashed when recording, the others keep their blob
+from the previous version, and a save that changes no profile (e.g. switching the active profile) reuses the previous
+profile list as a whole.
+
+Blobs are synced, together with their directory, before the version using them is appended, and the versions file is
+synced after every append, so a crash never leaves a version pointing to missing blobs.
+
+Diffs compare the blob hashes of two manifests first and only read the profiles that differ. A version is restored by
+importing its settings and profiles like an imported config file, and applied in the same step.
+"""
+import hashlib
+import json
+import logging
+import os
+import struct
+import time
+
+from typing import List, Optional
+
+from . import userfiles
+from .constants import CONFIG_DIR
+
+HISTORY_DIR = os.path.join(CONFIG_DIR, "history")
+VERSIONS_FILE = "versions"
+
+# time, kind, manifest hash (raw SHA-256), padding
+RECORD = struct.Struct("<dB32s7x")
+
+KINDS = ('save', 'apply', 'restore')
+
+
+def _encode(value) -> bytes:
+    return json.dumps(value, sort_keys=True, separators=(',', ':')).encode()
+
+
+def _syncDirectory(directory: str) -> None:
+    """
+    Make the entries created or renamed in a directory durable.
+    """
+
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class HistoryStore:
+    """
+    Stores the versions and blobs of a history directory.
+
+    Arguments:
+    directory - History directory, CONFIG_DIR/history by default
+    """
+
+    def __init__(self, directory=HISTORY_DIR):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.directory = directory
+
+        # Manifests and profile lists never change, keep the ones read or written
+        self._blobs = {}
+
+    @property
+    def versions_file(self) -> str:
+        return os.path.join(self.directory, VERSIONS_FILE)
+
+    def _makedirs(self, path: str) -> None:
+        """
+        Create a directory below the history directory. Directories created by the (root) watcher service are given
+        to the user through userfiles, so the user's processes can add to them. The parent is synced, so the new
+        directory survives a crash.
+        """
+
+        if os.path.isdir(path):
+            return
+
+        self._makedirs(os.path.dirname(path))
+        userfiles.makedirs(path)
+        _syncDirectory(os.path.dirname(path))
+
+    #########
+    # Blobs #
+    #########
+
+    def _blobPath(self, digest: str) -> str:
+        return os.path.join(self.directory, "objects", digest[:2], digest[2:])
+
+    def put(self, value, keep=False) -> str:
+        """
+        Store a JSON value and return its hash. A blob that is already stored is not written again. With keep, the
+        value is also kept in memory; it must not be changed afterwards.
+        """
+
+        data = _encode(value)
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blobPath(digest)
+
+        if not os.path.exists(path):
+            directory = os.path.dirname(path)
+            self._makedirs(directory)
+
+            # Synced and renamed into place, so a blob is never seen half written and is on disk before a version
+            # record points to it
+            userfiles.replaceFile(path, data, sync=True)
+
+        if keep:
+            self._blobs[digest] = value
+        return digest
+
+    def get(self, digest: str):
+
+        with open(self._blobPath(digest), 'rb') as blob_file:
+            return json.loads(blob_file.read())
+
+    def _cached(self, digest: str):
+
+        value = self._blobs.get(digest)
+        if value is None:
+            value = self._blobs[digest] = self.get(digest)
+        return value
+
+    def manifest(self, digest: str) -> dict:
+        """
+        Return {"settings", "profiles": [[id, name, blob hash], ...]} of a manifest.
+        """
+
+        manifest = self._cached(digest)
+        return {"settings": manifest['settings'], "profiles": self._cached(manifest['profiles'])}
+
+    ############
+    # Versions #
+    ############
+
+    def __len__(self) -> int:
+
+        try:
+            return os.stat(self.versions_file).st_size // RECORD.size
+        except FileNotFoundError:
+            return 0
+
+    def entry(self, version: int) -> dict:
+        """
+        Return {"version", "time", "kind", "hash"} of a version. Negative versions count from the latest one.
+        """
+
+        if version < 0:
+            version += len(self)
+
+        try:
+            fd = os.open(self.versions_file, os.O_RDONLY)
+        except FileNotFoundError:
+            raise KeyError(f"Unknown version: {version}") from None
+
+        try:
+            data = os.pread(fd, RECORD.size, version * RECORD.size) if version >= 0 else b''
+        finally:
+            os.close(fd)
+
+        if len(data) < RECORD.size:
+            raise KeyError(f"Unknown version: {version}")
+
+        timestamp, kind, digest = RECORD.unpack(data)
+        return {"version": version, "time": timestamp, "kind": KINDS[kind], "hash": digest.hex()}
+
+    def entries(self, count: Optional[int] = None) -> List[dict]:
+        """
+        Return the latest `count` versions (all if None), oldest first.
+        """
+
+        total = len(self)
+        start = 0 if count is None else max(0, total - count)
+        return [self.entry(version) for version in range(start, total)]
+
+    def _append(self, kind: str, digest: str) -> int:
+
+        self._makedirs(self.directory)
+
+        fd = userfiles.openFile(self.versions_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            # A single write of a whole record, so versions appended by several processes never interleave
+            os.write(fd, RECORD.pack(time.time(), KINDS.index(kind), bytes.fromhex(digest)))
+            version = os.lseek(fd, 0, os.SEEK_CUR) // RECORD.size - 1
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        if not version:
+            _syncDirectory(self.directory)
+        return version
+
+    def record(self, config, kind='save') -> int:
+        """
+        Record the state of a config and return its version. Called before the config writes its changes, so the
+        profiles it has not written yet are the ones changed since the previous version.
+        """
+
+        profiles = config.profiles
+
+        previous_list = None
+        previous = []
+        if len(self):
+            try:
+                previous_list = self._cached(self.entry(-1)['hash'])['profiles']
+                previous = self._cached(previous_list)
+            except (OSError, ValueError, KeyError):
+                # A missing or damaged version only means every profile is hashed again
+                previous_list = None
+
+        # Without unwritten changes the profiles on disk are the ones of the previous version
+        if previous_list is not None and not profiles.dirty:
+            profile_list = previous_list
+        else:
+            changed = profiles.changed
+            blobs = {profile_id: blob for profile_id, _, blob in previous}
+            entries = []
+            for profile_id, name in profiles.names().items():
+                blob = blobs.get(profile_id) if profile_id not in changed else None
+                if blob is None:
+                    blob = self.put(profiles.get(profile_id))
+                entries.append([profile_id, name, blob])
+            profile_list = self.put(entries, keep=True)
+
+        digest = self.put({"settings": config.sections(), "profiles": profile_list}, keep=True)
+        return self._append(kind, digest)
+
+    ###########
+    # Reading #
+    ###########
+
+    def snapshot(self, version: int) -> dict:
+        """
+        Return the state of a version: {"settings": {section: values}, "profiles": {id: {"name", "settings"}}}.
+        """
+
+        manifest = self.manifest(self.entry(version)['hash'])
+        return {
+            "settings": manifest['settings'],
+            "profiles": {
+                profile_id: {"name": name, "settings": self.get(blob)} for profile_id, name, blob in manifest['profiles']
+            }
+        }
+
+    def diff(self, old: int, new: int, profile: Optional[str] = None) -> dict:
+        """
+        Return the differences between two versions:
+
+            {"settings": {"section.key": [old, new]},
+             "profiles": {id: {"name": [old, new], "added" or "removed": True, "settings": {key: [old, new]}}}}
+
+        Values missing from a side are None. With `profile` only that profile id is compared.
+        """
+
+        old_hash = self.entry(old)['hash']
+        new_hash = self.entry(new)['hash']
+        old_manifest = self.manifest(old_hash)
+        new_manifest = self.manifest(new_hash)
+
+        differences = {"settings": {}, "profiles": {}}
+        if old_hash == new_hash:
+            return differences
+
+        if profile is None:
+            sections = set(old_manifest['settings']) | set(new_manifest['settings'])
+            for section in sorted(sections):
+                old_values = old_manifest['settings'].get(section, {})
+                new_values = new_manifest['settings'].get(section, {})
+                for key in sorted(set(old_values) | set(new_values)):
+                    if old_values.get(key) != new_values.get(key):
+                        differences['settings'][f"{section}.{key}"] = [old_values.get(key), new_values.get(key)]
+
+        # Versions sharing their profile list have the same profiles
+        if self._cached(old_hash)['profiles'] == self._cached(new_hash)['profiles']:
+            return differences
+
+        old_profiles = {profile_id: (name, blob) for profile_id, name, blob in old_manifest['profiles']}
+        new_profiles = {profile_id: (name, blob) for profile_id, name, blob in new_manifest['profiles']}
+
+        ids = [profile] if profile is not None else list(dict.fromkeys(list(old_profiles) + list(new_profiles)))
+        for profile_id in ids:
+            old_name, old_blob = old_profiles.get(profile_id, (None, None))
+            new_name, new_blob = new_profiles.get(profile_id, (None, None))
+            if (old_name, old_blob) == (new_name, new_blob):
+                continue
+
+            change = {}
+            if old_blob is None:
+                change['added'] = True
+            elif new_blob is None:
+                change['removed'] = True
+            if old_name != new_name:
+                change['name'] = [old_name, new_name]
+
+            # Only profiles whose content differs are read
+            if old_blob != new_blob:
+                old_settings = self.get(old_blob) if old_blob else {}
+                new_settings = self.get(new_blob) if new_blob else {}
+                change['settings'] = {
+                    key: [old_settings.get(key), new_settings.get(key)]
+                    for key in sorted(set(old_settings) | set(new_settings))
+                    if old_settings.get(key) != new_settings.get(key)
+                }
+
+            differences['profiles'][profile_id] = change
+
+        return differences
+
+    #############
+    # Restoring #
+    #############
+
+    def restore(self, version: int, apply=True):
+        """
+        Make a version the current config, replacing the settings and every profile, and apply its active profile.
+        Returns the restored Config and the apply result (None without apply).
+        """
+
+        import configparser
+        import io
+        from .config import Config
+
+        snapshot = self.snapshot(version)
+
+        parser = configparser.ConfigParser()
+        parser.read_dict(snapshot['settings'])
+        parser.read_dict({
+            profile_id: dict(profile['settings'], name=profile['name'])
+            for profile_id, profile in snapshot['profiles'].items()
+        })
+
+        # Imported the same way as an exported config file
+        self._makedirs(self.directory)
+        import_file = os.path.join(self.directory, ".restore.conf")
+        restore_file = io.StringIO()
+        parser.write(restore_file)
+        userfiles.replaceFile(import_file, restore_file.getvalue().encode())
+
+        try:
+            restored = Config(import_file)
+        finally:
+            os.remove(import_file)
+
+        restored.saveChanges()
+        restored.flush(kind='restore')
+
+        self.logger.info(f"Restored version {version}")
+        return restored, restored.applyChanges() if apply else None
+
+
+_stores = {}
+
+def getStore(directory=HISTORY_DIR) -> HistoryStore:
+    """
+    Return the store shared by the whole process, so manifests are read once.
+    """
+
+    if directory not in _stores:
+        _stores[directory] = HistoryStore(directory)
+    return _stores[directory]
+
+
+def record(config, kind='save') -> Optional[int]:
+    """
+    Record a version of the config. Failing to record never fails the save or apply it is recorded for.
+    """
+
+    try:
+        return getStore().record(config, kind)
+    except OSError as err:
+        logging.getLogger(__name__).warning(f"Recording the config history failed: {err}")
+        return None
@@ -0,0 +1,214 @@
+"""
+Parsing and storage of live measurement data.
+
+MeasureParser turns the text stream of `intel-undervolt measure` into typed frames of samples, and SampleStore keeps
+a fixed number of those frames in array-backed ring buffers (one column per metric) that can be queried for
+statistics over a time window.
+"""
+import math
+import re
+import time
+
+from array import array
+from typing import Dict, List, Optional
+
+# Escape sequences used by `measure` to redraw the screen. A clear/home sequence starts a new frame.
+_FRAME_START = re.compile(r'\x1b\[(?:H|2J|1;1H)')
+_ESCAPE = re.compile(r'\x1b\[[0-9;?]*[A-Za-z]')
+
+_LINE = re.compile(r'^\s*(?P<label>[^:]+?)\s*:\s*(?P<value>-?\d+(?:\.\d+)?)\s*(?P<unit>W|°C|C|MHz|GHz|%)')
+
+_UNIT_KIND = {
+    'W': 'power',
+    '°C': 'temp',
+    'C': 'temp',
+    'MHz': 'freq',
+    'GHz': 'freq',
+    '%': 'load'
+}
+
+
+def metricName(kind: str, label: str) -> str:
+    """
+    Build the metric name used by the store, e.g. ('power', 'Package 0') -> 'power.package_0'.
+    """
+
+    label = re.sub(r'\s+', '_', label.strip().lower())
+    return f"{kind}.{label}"
+
+
+class MeasureParser:
+    """
+    Streaming parser for `intel-undervolt measure` output. Text can be fed in arbitrary chunks; complete frames are
+    returned as dictionaries of metric name to value (watts, °C or MHz).
+    """
+
+    def __init__(self):
+        self._partial = ''
+        self._frame = {}
+
+    def feed(self, text: str) -> List[Dict[str, float]]:
+        """
+        Parse a chunk of output and return the frames completed by it.
+        """
+
+        text = self._partial + text
+        *lines, self._partial = text.split('\n')
+
+        return self.feedLines(lines)
+
+    def feedLines(self, lines: List[str]) -> List[Dict[str, float]]:
+        """
+        Parse a batch of complete lines.
+        """
+
+        frames = []
+        for line in lines:
+            frames.extend(self.feedLine(line))
+        return frames
+
+    def feedLine(self, line: str) -> List[Dict[str, float]]:
+        """
+        Parse a single complete line of output.
+        """
+
+        frames = []
+
+        if _FRAME_START.search(line):
+            frames.extend(self.flush())
+
+        match = _LINE.match(_ESCAPE.sub('', line))
+        if match is None:
+            return frames
+
+        unit = match['unit']
+        value = float(match['value'])
+        if unit == 'GHz':
+            value *= 1000
+
+        metric = metricName(_UNIT_KIND[unit], match['label'])
+
+        # Without escape sequences (e.g. piped output) a repeated metric marks the start of the next frame
+        if metric in self._frame:
+            frames.extend(self.flush())
+
+        self._frame[metric] = value
+        return frames
+
+    def flush(self) -> List[Dict[str, float]]:
+        """
+        Return the frame currently being parsed, if any.
+        """
+
+        if not self._frame:
+            return []
+
+        frame, self._frame = self._frame, {}
+        return [frame]
+
+
+class SampleStore:
+    """
+    Fixed size ring buffer of timestamped samples. Every metric is stored in its own array('d') column; metrics that
+    were not part of a sample are stored as NaN.
+    """
+
+    def __init__(self, capacity=3600):
+        self.capacity = capacity
+        self._times = array('d', [math.nan]) * capacity
+        self._columns = {}
+        self._head = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def metrics(self) -> List[str]:
+        return list(self._columns)
+
+    def append(self, values: Dict[str, float], timestamp: Optional[float] = None) -> None:
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        index = self._head
+        self._times[index] = timestamp
+
+        for metric, column in self._columns.items():
+            column[index] = values.get(metric, math.nan)
+
+        for metric in values.keys() - self._columns.keys():
+            column = array('d', [math.nan]) * self.capacity
+            column[index] = values[metric]
+            self._columns[metric] = column
+
+        self._head = (index + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def extend(self, frames: List[Dict[str, float]], timestamp: Optional[float] = None) -> None:
+        for frame in frames:
+            self.append(frame, timestamp)
+
+    def _indices(self, seconds: Optional[float], now: Optional[float]):
+        """
+        Yield the buffer indices of the samples in the window, newest first.
+        """
+
+        if now is None:
+            now = time.time()
+        cutoff = -math.inf if seconds is None else now - seconds
+
+        for offset in range(1, self._count + 1):
+            index = (self._head - offset) % self.capacity
+            if self._times[index] < cutoff:
+                break
+            yield index
+
+    def window(self, metric: str, seconds: Optional[float] = None, now: Optional[float] = None) -> List[float]:
+        """
+        Return the values of a metric in the last `seconds` (all stored values if None), oldest first.
+        """
+
+        column = self._columns.get(metric)
+        if column is None:
+            return []
+
+        values = [column[index] for index in self._indices(seconds, now)]
+        values.reverse()
+        return [value for value in values if not math.isnan(value)]
+
+    def latest(self, metric: str) -> Optional[float]:
+
+        column = self._columns.get(metric)
+        if column is None or not self._count:
+            return None
+
+        value = column[(self._head - 1) % self.capacity]
+        return None if math.isnan(value) else value
+
+    def min(self, metric: str, seconds: Optional[float] = None) -> Optional[float]:
+        values = self.window(metric, seconds)
+        return min(values) if values else None
+
+    def max(self, metric: str, seconds: Optional[float] = None) -> Optional[float]:
+        values = self.window(metric, seconds)
+        return max(values) if values else None
+
+    def average(self, metric: str, seconds: Optional[float] = None) -> Optional[float]:
+        values = self.window(metric, seconds)
+        return math.fsum(values) / len(values) if values else None
+
+    def percentile(self, metric: str, percent: float, seconds: Optional[float] = None) -> Optional[float]:
+        """
+        Return the given percentile (0-100) of a metric, interpolating linearly between samples.
+        """
+
+        values = sorted(self.window(metric, seconds))
+        if not values:
+            return None
+
+        position = (len(values) - 1) * percent / 100
+        lower = math.floor(position)
+        upper = math.ceil(position)
+        return values[lower] + (values[upper] - values[lower]) * (position - lower)
@@ -0,0 +1,255 @@
+"""
+Native voltage offset engine.
+
+Writes the voltage plane offsets straight to MSR 0x150 (the OC mailbox) through /dev/cpu/*/msr, using the same
+encoding as intel-undervolt. File descriptors are opened once and kept for the lifetime of the engine, so an apply
+costs one pwrite/pwrite/pread triple per plane instead of a process start.
+"""
+import glob
+import logging
+import os
+import re
+import struct
+
+from .constants import PLANES
+
+MSR_PATH = "/dev/cpu/{cpu}/msr"
+SYSFS_CPU = "/sys/devices/system/cpu"
+MAILBOX = 0x150
+RAPL_POWER_UNIT = 0x606
+PKG_POWER_LIMIT = 0x610
+TEMPERATURE_TARGET = 0x1A2
+
+_VALUE = struct.Struct('<Q')
+
+
+class MsrError(Exception):
+    """
+    Raised when the MSR device is unavailable or an offset could not be verified.
+    """
+
+
+########################
+# Mailbox value coding #
+########################
+
+def encodeOffset(millivolts: float) -> int:
+    """
+    Encode an offset in mV into the 11 bit signed fixed point format used by the mailbox (1/1024 V steps).
+    """
+
+    steps = int(round(millivolts * 1.024))
+    return 0xFFE00000 & ((steps & 0xFFF) << 21)
+
+
+def decodeOffset(value: int) -> float:
+    """
+    Decode the offset in mV contained in a mailbox response.
+    """
+
+    steps = (value >> 21) & 0x7FF
+    if steps & 0x400:
+        steps -= 0x800
+    return steps / 1.024
+
+
+def packRequest(plane: int, offset=None) -> int:
+    """
+    Build a mailbox request for the given plane. Without an offset the request is a read.
+    """
+
+    write = offset is not None
+    return (1 << 63) | (plane << 40) | (1 << 36) | (write << 32) | (offset or 0)
+
+
+def decodePowerLimit(value: int, power_unit: float, time_unit: float) -> tuple:
+    """
+    Decode one half (PL1 in bits 0-23, PL2 in bits 32-55) of MSR_PKG_POWER_LIMIT into (watts, seconds, enabled).
+    """
+
+    watts = (value & 0x7FFF) * power_unit
+    enabled = bool(value & (1 << 15))
+
+    # The window is 2^Y * (1 + Z/4) time units, with Y in bits 17-21 and Z in bits 22-23
+    exponent = (value >> 17) & 0x1F
+    fraction = (value >> 22) & 0x3
+    seconds = (1 << exponent) * (1 + fraction / 4) * time_unit
+
+    return watts, seconds, enabled
+
+
+###########
+# Devices #
+###########
+
+class MsrDevice:
+    """
+    A single open MSR device file.
+    """
+
+    flags = os.O_RDWR
+
+    def __init__(self, path: str):
+        self.path = path
+        try:
+            self.fd = os.open(path, self.flags, 0o600)
+        except OSError as err:
+            raise MsrError(f"Unable to open {path}: {err}") from err
+
+    def read(self, register: int) -> int:
+        return _VALUE.unpack(os.pread(self.fd, 8, register))[0]
+
+    def write(self, register: int, value: int) -> None:
+        os.pwrite(self.fd, _VALUE.pack(value), register)
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class FakeMsrDevice(MsrDevice):
+    """
+    MSR device backed by a regular file, emulating the mailbox: the offset of each plane is stored after the mailbox
+    register and read requests are answered in the mailbox register like the hardware does.
+    """
+
+    flags = os.O_RDWR | os.O_CREAT
+
+    def read(self, register: int) -> int:
+        # Registers that were never written read as 0
+        return _VALUE.unpack(os.pread(self.fd, 8, register).ljust(8, b'\0'))[0]
+
+    def write(self, register: int, value: int) -> None:
+
+        if register == MAILBOX:
+            plane = (value >> 40) & 0x7
+
+            if value & (1 << 32):
+                super().write(MAILBOX + 8 * (plane + 1), value & 0xFFE00000)
+            else:
+                stored = _VALUE.unpack(os.pread(self.fd, 8, MAILBOX + 8 * (plane + 1)).ljust(8, b'\0'))[0]
+                super().write(MAILBOX, (value & ~0xFFFFFFFF) | stored)
+            return
+
+        super().write(register, value)
+
+
+##########
+# Engine #
+##########
+
+class MsrEngine:
+    """
+    Applies voltage offsets through the MSR interface.
+
+    Arguments:
+    msr_path   - Template for the MSR device of a cpu, formatted with the cpu number
+    sysfs_root - Root used to look up the cpu topology (one device is kept per physical package)
+    device     - Class used to open the devices. FakeMsrDevice can be used together with a regular file
+    """
+
+    def __init__(self, msr_path=MSR_PATH, sysfs_root='/', device=MsrDevice):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.msr_path = msr_path
+        self.sysfs_root = sysfs_root
+        self.device = device
+        self._devices = None
+
+    def _packageCpus(self) -> list:
+        """
+        Return the first cpu of every physical package. Falls back to cpu 0 when the topology is unavailable.
+        """
+
+        packages = {}
+        cpu_dir = os.path.join(self.sysfs_root, SYSFS_CPU.lstrip('/'))
+        for path in glob.glob(os.path.join(cpu_dir, 'cpu[0-9]*')):
+            cpu = int(re.search(r'(\d+)$', path).group(1))
+            try:
+                with open(os.path.join(path, 'topology', 'physical_package_id')) as package_file:
+                    package = int(package_file.read())
+            except (OSError, ValueError):
+                continue
+            packages[package] = min(cpu, packages.get(package, cpu))
+
+        return sorted(packages.values()) or [0]
+
+    def open(self) -> None:
+
+        if self._devices is None:
+            self._devices = [self.device(self.msr_path.format(cpu=cpu)) for cpu in self._packageCpus()]
+
+    def close(self) -> None:
+
+        for device in self._devices or []:
+            device.close()
+        self._devices = None
+
+    def read(self) -> dict:
+        """
+        Return the current offset of every plane in mV.
+        """
+
+        self.open()
+        device = self._devices[0]
+
+        offsets = {}
+        for index, plane in enumerate(PLANES):
+            device.write(MAILBOX, packRequest(index))
+            offsets[plane] = decodeOffset(device.read(MAILBOX))
+
+        return offsets
+
+    def readLimits(self) -> dict:
+        """
+        Return the enabled package power limits and the thermal offset, in the layout of the profile settings.
+        """
+
+        self.open()
+        device = self._devices[0]
+
+        units = device.read(RAPL_POWER_UNIT)
+        power_unit = 1 / (1 << (units & 0xF))
+        time_unit = 1 / (1 << ((units >> 16) & 0xF))
+
+        limits = {}
+        power_limit = device.read(PKG_POWER_LIMIT)
+        for key, value in (('pl1', power_limit & 0xFFFFFF), ('pl2', (power_limit >> 32) & 0xFFFFFF)):
+            watts, seconds, enabled = decodePowerLimit(value, power_unit, time_unit)
+            if enabled and watts:
+                limits[key] = watts
+                limits[f"{key}_window"] = seconds
+
+        target = device.read(TEMPERATURE_TARGET)
+        limits['tjoffset'] = -((target >> 24) & 0x3F)
+
+        return limits
+
+    def apply(self, settings: dict) -> dict:
+        """
+        Write the offset of every plane present in settings and read it back to confirm it was accepted.
+        Returns the offsets read back in mV.
+        """
+
+        self.open()
+
+        applied = {}
+        for device in self._devices:
+            for index, plane in enumerate(PLANES):
+                if plane not in settings:
+                    continue
+
+                encoded = encodeOffset(float(settings[plane]))
+                device.write(MAILBOX, packRequest(index, encoded))
+
+                device.write(MAILBOX, packRequest(index))
+                readback = device.read(MAILBOX) & 0xFFE00000
+                if readback != encoded:
+                    raise MsrError(
+                        f"Offset for {plane} not accepted by {device.path}: "
+                        f"wrote {decodeOffset(encoded):.2f} mV, read {decodeOffset(readback):.2f} mV"
+                    )
+
+                applied[plane] = decodeOffset(readback)
+
+        return applied
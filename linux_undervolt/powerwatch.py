@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Resident power source watcher.
+
+Listens for power_supply uevents on the kernel netlink socket (or polls /sys/class/power_supply/*/online when the
+socket is unavailable) and switches to the profile mapped to AC or battery power in-process. Run as a systemd service
+installed by backend.createPowerWatcher, it replaces the udev rule -> systemctl -> python chain used before. The
+service also hosts the profile governor (see governor.py), the per-application switching (see appwatch.py), the
+telemetry recorder (see telemetry.py), the applied state verification (see readback.py) and the metrics exporter
+(see exporter.py). The power source switch, the governor and the application switching request their profiles from
+a shared arbiter (see arbiter.py), which decides which of them is in effect.
+"""
+import glob
+import logging
+import os
+import select
+import socket
+import threading
+import time
+
+POWER_SUPPLY_DIR = "sys/class/power_supply"
+
+# Netlink protocol and multicast group of kernel uevents
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_GROUP = 1
+
+
+class PowerWatcher:
+    """
+    Calls on_change(online) whenever the AC adapter state changes and stays stable for `settle` seconds.
+
+    Arguments:
+    on_change     - Callback receiving True when running on AC power and False when running on battery
+    sysfs_root    - Root of the sysfs tree, can be pointed at a fixture tree to simulate plug and unplug events
+    settle        - Time (seconds) a new state has to persist before it is reported
+    poll_interval - Interval (seconds) used to poll sysfs when no uevent arrives
+    use_netlink   - Listen for uevents. Only used with the real sysfs root
+    """
+
+    def __init__(self, on_change, sysfs_root='/', settle=0.25, poll_interval=5.0, use_netlink=True):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.on_change = on_change
+        self.sysfs_root = sysfs_root
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.use_netlink = use_netlink and sysfs_root == '/'
+
+        self._stop = threading.Event()
+        self._candidate = None
+        self._since = None
+        self._reported = None
+
+    def online(self):
+        """
+        Return True if any mains/USB supply is online, False if none is and None when there is no such supply.
+        """
+
+        states = []
+        for path in glob.glob(os.path.join(self.sysfs_root, POWER_SUPPLY_DIR, '*')):
+            try:
+                with open(os.path.join(path, 'type')) as type_file:
+                    supply_type = type_file.read().strip()
+                if supply_type == 'Battery':
+                    continue
+                with open(os.path.join(path, 'online')) as online_file:
+                    states.append(online_file.read().strip() == '1')
+            except OSError:
+                continue
+
+        if not states:
+            return None
+        return any(states)
+
+    def check(self, now=None) -> bool:
+        """
+        Read the current state and report it once it has been stable for the settle time. Returns True when
+        on_change was called.
+        """
+
+        if now is None:
+            now = time.monotonic()
+
+        state = self.online()
+        if state != self._candidate:
+            self._candidate = state
+            self._since = now
+
+        if state is None or state == self._reported or now - self._since < self.settle:
+            return False
+
+        self._reported = state
+        self.logger.info(f"Power source changed to {'AC' if state else 'battery'}")
+        self.on_change(state)
+        return True
+
+    def _openNetlink(self):
+
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            sock.bind((0, UEVENT_GROUP))
+            return sock
+        except (OSError, AttributeError) as err:
+            self.logger.warning(f"Unable to listen for uevents, polling instead: {err}")
+            return None
+
+    def run(self) -> None:
+        """
+        Watch until stop() is called. The current state is reported once on start.
+        """
+
+        sock = self._openNetlink() if self.use_netlink else None
+
+        try:
+            while not self._stop.is_set():
+                self.check()
+
+                # Wake up early while a new state is settling
+                timeout = self.poll_interval
+                if self._candidate is not None and self._candidate != self._reported:
+                    timeout = max(0.0, self._since + self.settle - time.monotonic())
+
+                if sock is None:
+                    self._stop.wait(timeout)
+                    continue
+
+                # Any uevent wakes the loop up, the state itself is always read from sysfs
+                readable, _, _ = select.select([sock], [], [], timeout)
+                if readable:
+                    sock.recv(8192)
+        finally:
+            if sock is not None:
+                sock.close()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def applyMappedProfile(online: bool) -> None:
+    """
+    Request the profile mapped to the given power source in the user's config from the arbiter, which applies it
+    unless the governor or a mapped application takes precedence.
+    """
+
+    from . import tracing
+    from .arbiter import getArbiter
+    from .config import Config
+
+    config = Config()
+    profile = None
+    if config.getBool('battery_switch'):
+        profile = config.getSettings('ac_profile' if online else 'battery_profile') or None
+
+    with tracing.span("power_switch", online=online, profile=profile):
+        getArbiter().request('power', profile)
+
+
+def main() -> None:
+
+    from . import governor, appwatch, exporter, readback, telemetry
+
+    logging.basicConfig(level=logging.INFO)
+
+    # The load/temperature governor, the application watcher, the telemetry recorder, the applied state verification
+    # and the metrics exporter share the service. All but the application watcher return immediately when disabled, the
+    # application watcher idles while no applications are mapped.
+    threading.Thread(target=governor.main, name="governor", daemon=True).start()
+    threading.Thread(target=appwatch.main, name="appwatch", daemon=True).start()
+    threading.Thread(target=telemetry.main, name="telemetry", daemon=True).start()
+    threading.Thread(target=readback.main, name="readback", daemon=True).start()
+    threading.Thread(target=exporter.main, name="exporter", daemon=True).start()
+
+    PowerWatcher(applyMappedProfile).run()
+
+
+if __name__ == "__main__":
+    main()
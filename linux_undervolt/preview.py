@@ -0,0 +1,211 @@
+"""
+Live preview of slider changes.
+
+While the preview is on, every slider movement restarts a short idle timer and only the offsets in place when it runs
+out are applied, so dragging a slider applies once instead of once per step. The applies run on the GUI's background
+worker under a single key, so a preview waiting behind a slow one is replaced by the newer one rather than queued.
+The offsets are applied without the profile's limits and with persist off, which the helper carries out through the
+MSR engine (a few MSR writes) without touching the undervolt file. With the intel-undervolt engine the limits are
+kept, since the file the engine applies from is rewritten on every apply; the helper puts the previous file back right
+after applying, so a previewed offset is never applied on boot.
+
+The offsets in effect when the preview starts are read back first, and stopping the preview (cancel) applies them
+again right away, dropping any preview that has not been applied yet. Nothing in this module imports GTK.
+"""
+import logging
+
+from typing import Callable, Dict, Optional
+
+from .constants import PLANES
+from .undervolt_conf import LIMITS
+
+# Idle time (ms) after the last slider movement before the offsets are applied
+DEFAULT_DELAY = 300
+
+
+class LivePreview:
+    """
+    Applies the offsets of the sliders without saving them.
+
+    Arguments:
+    config     - Config of the window, giving the undervolt file, the engine and the active profile
+    worker     - BackgroundWorker the applies run on
+    schedule   - Function calling a callback once after a delay (ms) and returning a source id, e.g. GLib.timeout_add
+    unschedule - Function removing a scheduled source, e.g. GLib.source_remove
+    on_applied - Called on the worker's dispatch with (settings, ok) after every preview and revert
+    delay      - Idle time (ms) before the latest offsets are applied
+    """
+
+    def __init__(self, config, worker, schedule: Callable, unschedule: Callable, on_applied=None,
+                 delay=DEFAULT_DELAY, sysfs_root='/'):
+        from .rapl import RaplSampler
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.config = config
+        self.worker = worker
+        self.schedule = schedule
+        self.unschedule = unschedule
+        self.on_applied = on_applied
+        self.delay = delay
+
+        self.active = False
+        self.base = None
+        self.applied = None
+        self._wanted = None
+        self._source = None
+
+        self.rapl = RaplSampler(sysfs_root)
+        if self.rapl.available:
+            self.rapl.sample()
+
+    @property
+    def engine(self) -> str:
+        return self.config.getSettings().get('engine', 'intel-undervolt')
+
+    def _request(self, offsets: Dict[str, int]) -> dict:
+        """
+        Return the settings of an apply request for the given offsets.
+        """
+
+        settings = {plane: int(offsets.get(plane, 0)) for plane in PLANES}
+
+        # Without limits the MSR engine can apply the offsets by itself
+        if self.engine != 'msr':
+            profile = self.config.getProfileSettings()
+            settings.update({key: profile[key] for key in LIMITS if profile.get(key)})
+
+        return settings
+
+    def _apply(self, job, offsets: Dict[str, int]) -> Optional[dict]:
+
+        from . import helper
+
+        if job.cancelled:
+            return None
+
+        settings = self._request(offsets)
+        response = helper.getClient(self.config.undervolt_file).request(
+            "apply", settings=settings, engine=self.engine, persist=False
+        )
+        if response['ok']:
+            self.applied = {plane: settings[plane] for plane in PLANES}
+        else:
+            self.logger.warning(f"Previewing {settings} failed: {response.get('error', response.get('output'))}")
+        return {"settings": settings, "ok": response['ok']}
+
+    def __done(self, job, result, error) -> None:
+
+        if result is not None and self.on_applied is not None:
+            self.on_applied(result['settings'], result['ok'] and error is None)
+
+    @property
+    def target(self) -> Dict[str, int]:
+        """
+        The offsets that will be in effect once the pending preview (if any) is applied.
+        """
+
+        return self._wanted or self.applied or {}
+
+    #########
+    # State #
+    #########
+
+    def start(self) -> None:
+        """
+        Turn the preview on. The offsets in effect are read on the worker, before any preview is applied.
+        """
+
+        from . import readback
+
+        if self.active:
+            return
+        self.active = True
+
+        def read(job):
+            state = readback.getCache(self.config).get()
+            if state is not None and state['offsets']:
+                offsets = state['offsets']
+            else:
+                # Nothing could be read back, the saved profile is the best guess of what is in effect
+                offsets = self.config.getProfileSettings()
+
+            # Set on the worker thread, so a revert submitted afterwards always sees it
+            self.base = self.applied = {plane: round(float(offsets.get(plane, 0))) for plane in PLANES}
+
+        self.worker.submit("preview.base", read)
+
+    def change(self, offsets: Dict[str, int]) -> None:
+        """
+        Note new slider values. They are applied once the sliders have been idle for the delay.
+        """
+
+        if not self.active:
+            return
+
+        self._wanted = dict(offsets)
+        if self._source is not None:
+            self.unschedule(self._source)
+        self._source = self.schedule(self.delay, self.__flush)
+
+    def __flush(self) -> bool:
+
+        self._source = None
+        wanted = self._wanted
+        if wanted is not None and wanted != self.applied:
+            self.worker.submit("preview", lambda job: self._apply(job, wanted), self.__done)
+        return False
+
+    def stop(self, revert=True, on_reverted: Optional[Callable] = None) -> None:
+        """
+        Turn the preview off. With revert, a preview that has not been applied yet is dropped and the offsets in
+        effect before the preview are applied again. on_reverted is called without arguments once that is done, on
+        the worker's dispatch, e.g. to quit the program after the revert.
+        """
+
+        active = self.active
+        self.active = False
+
+        if self._source is not None:
+            self.unschedule(self._source)
+            self._source = None
+        self._wanted = None
+
+        if not active or not revert:
+            if on_reverted is not None:
+                on_reverted()
+            return
+
+        def apply(job):
+            # The base is read by the job submitted on start, which has run before this one
+            if self.base is None or self.base == self.applied:
+                return None
+            return self._apply(job, self.base)
+
+        def done(job, result, error):
+            self.__done(job, result, error)
+            if on_reverted is not None:
+                on_reverted()
+
+        # Replaces a preview waiting on the worker
+        self.worker.submit("preview", apply, done)
+
+    def rebase(self, offsets: Dict[str, int]) -> None:
+        """
+        Make the given offsets the ones reverted to, e.g. after the profile was applied for real.
+        """
+
+        self.base = self.applied = {plane: int(offsets.get(plane, 0)) for plane in PLANES}
+
+    #########
+    # Power #
+    #########
+
+    def power(self) -> Dict[str, float]:
+        """
+        Return the power (W) of every RAPL domain since the previous call, empty when RAPL can not be read.
+        """
+
+        return self.rapl.sample() if self.rapl.available else {}
+
+    def close(self) -> None:
+        self.rapl.close()
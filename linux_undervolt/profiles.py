@@ -0,0 +1,264 @@
+"""
+Indexed profile store.
+
+Profiles are kept in CONFIG_DIR/profiles: one small INI file per profile (<id>.conf) and index.json, which maps the
+profile ids to their names in display order. Only the index is read when the store is opened; a profile file is read
+the first time the profile is used. Startup and apply time therefore do not depend on the number of profiles, and a
+profile is found by id or by name with a dictionary lookup.
+
+Profile ids are integers (stored as strings, like the section names of older config files) and are never reused, so
+settings and services referring to an id keep referring to the same profile.
+"""
+import configparser
+import io
+import json
+import os
+
+from typing import Dict, Iterable, List, Optional
+
+from .constants import CONFIG_DIR
+
+PROFILES_DIR = os.path.join(CONFIG_DIR, "profiles")
+INDEX_FILE = "index.json"
+SECTION = "PROFILE"
+
+
+class ProfileStore:
+
+    def __init__(self, directory=PROFILES_DIR):
+        self.directory = directory
+
+        self._names = {}
+        self._ids = {}
+        self._next_id = 0
+        self._cache = {}
+
+        self._changed = set()
+        self._removed = set()
+        self._index_changed = False
+
+        self._loadIndex()
+
+    @property
+    def index_file(self) -> str:
+        return os.path.join(self.directory, INDEX_FILE)
+
+    def _profileFile(self, profile_id: str) -> str:
+        return os.path.join(self.directory, f"{profile_id}.conf")
+
+    def _loadIndex(self) -> None:
+
+        try:
+            with open(self.index_file) as index_file:
+                index = json.load(index_file)
+        except FileNotFoundError:
+            return
+
+        self._names = dict(index['profiles'])
+        self._ids = {name: profile_id for profile_id, name in self._names.items()}
+        self._next_id = index['next_id']
+
+    def _loadProfile(self, profile_id: str) -> dict:
+
+        settings = self._cache.get(profile_id)
+        if settings is None:
+            parser = configparser.ConfigParser()
+            parser.read(self._profileFile(profile_id))
+            settings = self._cache[profile_id] = dict(parser[SECTION]) if parser.has_section(SECTION) else {}
+            settings.pop('name', None)
+        return settings
+
+    ##########
+    # Lookup #
+    ##########
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, key) -> bool:
+        return self.resolve(key) is not None
+
+    def ids(self) -> List[str]:
+        return list(self._names)
+
+    def names(self) -> Dict[str, str]:
+        """
+        Return {id: name} of every profile, in display order.
+        """
+
+        return dict(self._names)
+
+    def resolve(self, key) -> Optional[str]:
+        """
+        Return the id of the profile with the given id or name, None if there is no such profile.
+        """
+
+        key = str(key)
+        if key in self._names:
+            return key
+        return self._ids.get(key)
+
+    def _require(self, key) -> str:
+
+        profile_id = self.resolve(key)
+        if profile_id is None:
+            raise KeyError(f"Unknown profile: {key}")
+        return profile_id
+
+    def name(self, key) -> str:
+        return self._names[self._require(key)]
+
+    def get(self, key) -> dict:
+        """
+        Return a copy of the settings of a profile.
+        """
+
+        return dict(self._loadProfile(self._require(key)))
+
+    ###########
+    # Changes #
+    ###########
+
+    def _uniqueName(self, name: str, profile_id: str) -> str:
+
+        if name in self._ids and self._ids[name] != profile_id:
+            return f"{name} ({profile_id})"
+        return name
+
+    def put(self, profile_id: str, name: str, settings: dict) -> str:
+        """
+        Store a profile under a given id, replacing the profile with that id if there is one.
+        """
+
+        profile_id = str(profile_id)
+        old_name = self._names.get(profile_id)
+        if old_name is not None:
+            del self._ids[old_name]
+
+        name = self._uniqueName(name, profile_id)
+        self._names[profile_id] = name
+        self._ids[name] = profile_id
+        self._cache[profile_id] = {key: str(value) for key, value in settings.items()}
+
+        if profile_id.isdigit():
+            self._next_id = max(self._next_id, int(profile_id) + 1)
+
+        self._changed.add(profile_id)
+        self._removed.discard(profile_id)
+        self._index_changed = True
+        return profile_id
+
+    def create(self, name: str, settings: dict) -> str:
+        """
+        Add a profile and return its id.
+        """
+
+        if name in self._ids:
+            raise ValueError(f"A profile named {name!r} already exists")
+        return self.put(str(self._next_id), name, settings)
+
+    def update(self, key, settings: dict) -> str:
+        """
+        Replace the settings of a profile. A profile that does not exist yet is created, under the given id if it is
+        a number and with the given name otherwise.
+        """
+
+        profile_id = self.resolve(key)
+        if profile_id is None:
+            if str(key).isdigit():
+                return self.put(str(key), f"Profile {key}", settings)
+            return self.create(str(key), settings)
+
+        self._cache[profile_id] = {name: str(value) for name, value in settings.items()}
+        self._changed.add(profile_id)
+        return profile_id
+
+    def rename(self, key, name: str) -> None:
+
+        profile_id = self._require(key)
+        if name in self._ids and self._ids[name] != profile_id:
+            raise ValueError(f"A profile named {name!r} already exists")
+
+        # The name is stored in the profile file too, so it has to be loaded before it is rewritten
+        self._loadProfile(profile_id)
+
+        del self._ids[self._names[profile_id]]
+        self._names[profile_id] = name
+        self._ids[name] = profile_id
+
+        self._changed.add(profile_id)
+        self._index_changed = True
+
+    def delete(self, key) -> None:
+
+        profile_id = self._require(key)
+        del self._ids[self._names.pop(profile_id)]
+        self._cache.pop(profile_id, None)
+
+        self._changed.discard(profile_id)
+        self._removed.add(profile_id)
+        self._index_changed = True
+
+    def replace(self, profiles: Iterable[tuple]) -> None:
+        """
+        Replace every profile with the given (id, name, settings) tuples.
+        """
+
+        for profile_id in self.ids():
+            self.delete(profile_id)
+        for profile_id, name, settings in profiles:
+            self.put(profile_id, name, settings)
+
+    @property
+    def changed(self) -> frozenset:
+        """
+        The ids of the profiles changed since the last flush.
+        """
+
+        return frozenset(self._changed)
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._changed or self._removed or self._index_changed)
+
+    def flush(self) -> None:
+        """
+        Write the changed profiles and the index.
+        """
+
+        from .config import atomicWrite
+
+        if not self.dirty:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        for profile_id in self._changed:
+            parser = configparser.ConfigParser()
+            parser[SECTION] = dict(self._cache[profile_id], name=self._names[profile_id])
+
+            profile_file = io.StringIO()
+            parser.write(profile_file)
+            atomicWrite(self._profileFile(profile_id), profile_file.getvalue())
+
+        for profile_id in self._removed:
+            try:
+                os.remove(self._profileFile(profile_id))
+            except FileNotFoundError:
+                pass
+
+        if self._index_changed:
+            index = {"next_id": self._next_id, "profiles": self._names}
+            atomicWrite(self.index_file, json.dumps(index, indent=2))
+
+        self._changed.clear()
+        self._removed.clear()
+        self._index_changed = False
+
+    def sections(self) -> Dict[str, dict]:
+        """
+        Return every profile as {id: settings including the name}, the layout of the profile sections of an exported
+        config file.
+        """
+
+        return {profile_id: dict(self._loadProfile(profile_id), name=name) for profile_id, name in self._names.items()}
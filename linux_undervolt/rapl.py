@@ -0,0 +1,136 @@
+"""
+In-process RAPL power sampler.
+
+Reads the energy counters exposed by the powercap framework (/sys/class/powercap/intel-rapl*) and turns them into
+watts per domain. The counter files are opened once and re-read with os.pread, so a sample is one syscall per domain.
+"""
+import glob
+import logging
+import os
+import time
+
+POWERCAP_DIR = "sys/class/powercap"
+
+
+class RaplDomain:
+    """
+    A single RAPL zone (package, core, uncore, dram, psys...).
+    """
+
+    __slots__ = ("key", "path", "fd", "max_range", "last_energy", "last_time")
+
+    def __init__(self, key: str, path: str):
+        self.key = key
+        self.path = path
+
+        with open(os.path.join(path, "max_energy_range_uj")) as range_file:
+            self.max_range = int(range_file.read())
+
+        self.fd = os.open(os.path.join(path, "energy_uj"), os.O_RDONLY)
+        self.last_energy = None
+        self.last_time = None
+
+    def read(self) -> int:
+        return int(os.pread(self.fd, 32, 0))
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class RaplSampler:
+    """
+    Samples the power draw of every readable RAPL domain.
+
+    Arguments:
+    sysfs_root - Root of the sysfs tree, can be pointed at a fixture tree for testing
+    interval   - Suggested sampling interval in seconds, used by callers that poll the sampler
+    """
+
+    def __init__(self, sysfs_root='/', interval=1.0):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.sysfs_root = sysfs_root
+        self.interval = interval
+        self.domains = self._findDomains()
+
+    def _findDomains(self) -> list:
+        """
+        Open the energy counter of every RAPL zone. Zones that can not be read (energy_uj is root only on
+        many kernels) are skipped.
+        """
+
+        base = os.path.join(self.sysfs_root, POWERCAP_DIR)
+        domains = []
+
+        for path in sorted(glob.glob(os.path.join(base, "intel-rapl:*"))):
+            zone = os.path.basename(path)
+
+            try:
+                with open(os.path.join(path, "name")) as name_file:
+                    name = name_file.read().strip()
+            except OSError:
+                continue
+
+            # Sub-zones (intel-rapl:0:0) are named after their parent package, e.g. package-0/core
+            parts = zone.split(':')
+            if len(parts) > 2:
+                parent = os.path.join(base, ':'.join(parts[:2]), "name")
+                try:
+                    with open(parent) as parent_file:
+                        name = f"{parent_file.read().strip()}/{name}"
+                except OSError:
+                    pass
+
+            try:
+                domains.append(RaplDomain(name, path))
+            except (OSError, ValueError) as err:
+                self.logger.debug(f"Skipping RAPL zone {zone}: {err}")
+
+        return domains
+
+    @property
+    def available(self) -> bool:
+        return bool(self.domains)
+
+    def energy(self) -> dict:
+        """
+        Return the raw energy counter of every domain in joules.
+        """
+
+        return {domain.key: domain.read() / 1e6 for domain in self.domains}
+
+    def sample(self) -> dict:
+        """
+        Return the average power of every domain in watts since the previous call. Domains sampled for the first
+        time are omitted since there is no previous reading to compare to.
+        """
+
+        now = time.monotonic()
+        watts = {}
+
+        for domain in self.domains:
+            try:
+                energy = domain.read()
+            except (OSError, ValueError):
+                continue
+
+            if domain.last_energy is not None and now > domain.last_time:
+                delta = energy - domain.last_energy
+
+                # The counter wraps around at max_energy_range_uj
+                if delta < 0:
+                    delta += domain.max_range + 1
+
+                watts[domain.key] = delta / 1e6 / (now - domain.last_time)
+
+            domain.last_energy = energy
+            domain.last_time = now
+
+        return watts
+
+    def close(self) -> None:
+
+        for domain in self.domains:
+            domain.close()
+        self.domains = []
@@ -0,0 +1,286 @@
+"""
+Readback of the applied undervolt.
+
+The offsets and power limits in effect are read through the privileged helper ("read" operation: the MSR engine, or
+`intel-undervolt read`) and cached, so the GUI and the power watcher can compare them with the saved profile without
+asking the helper every time. The cached state is read again when it is older than the TTL, after the system resumed
+from suspend and after a microcode reload, since both reset the MSRs. Detecting those only costs a clock read and a
+small sysfs read: a suspend shows up as a jump between the boot time clock (which keeps counting while suspended) and
+the monotonic clock (which does not).
+
+The power watcher service uses the cache to apply the active profile again when a resume or microcode reload reset
+the MSRs. A state that merely differs from the profile is left alone, since it may be a temporary apply of another
+process (an autotune candidate, an efficiency run or a live preview).
+"""
+import logging
+import os
+import re
+import threading
+import time
+
+from typing import Callable, Dict, Optional, Tuple
+
+from .constants import PLANES
+
+MICROCODE_FILE = "/sys/devices/system/cpu/cpu0/microcode/version"
+
+# Seconds after which the applied state is read again
+DEFAULT_TTL = 300
+
+# Difference (s) between the boot time and monotonic clocks that counts as a suspend
+SUSPEND_THRESHOLD = 1.0
+
+# Differences below these are rounding of the hardware encoding (1/1024 V steps, 1/8 W power units)
+OFFSET_TOLERANCE = 1.0
+POWER_TOLERANCE = 0.5
+WINDOW_TOLERANCE = 0.1      # relative
+
+_OFFSET_LINE = re.compile(r"^.*\((\d)\):\s*(-?[\d.]+)\s*mV", re.MULTILINE)
+_POWER_LINE = re.compile(r"^(Short|Long) term package power:\s*([\d.]+)\s*W,\s*([\d.]+)\s*s,\s*(\w+)",
+                         re.MULTILINE | re.IGNORECASE)
+_TJOFFSET_LINE = re.compile(r"^.*(?:tjoffset|temperature offset)\D*?(-?\d+)", re.MULTILINE | re.IGNORECASE)
+
+
+def parseRead(output: str) -> Tuple[Dict[str, float], dict]:
+    """
+    Parse the output of `intel-undervolt read` into the offsets and the limits in effect.
+    """
+
+    offsets = {}
+    for index, value in _OFFSET_LINE.findall(output):
+        if int(index) < len(PLANES):
+            offsets[PLANES[int(index)]] = float(value)
+
+    limits = {}
+    for term, watts, seconds, state in _POWER_LINE.findall(output):
+        if state.lower() != 'enabled':
+            continue
+        key = 'pl2' if term.lower() == 'short' else 'pl1'
+        limits[key] = float(watts)
+        limits[f"{key}_window"] = float(seconds)
+
+    match = _TJOFFSET_LINE.search(output)
+    if match:
+        limits['tjoffset'] = int(match.group(1))
+
+    return offsets, limits
+
+
+def difference(state: dict, settings: dict) -> Dict[str, dict]:
+    """
+    Return {setting: {"applied": value, "saved": value}} for every setting of the profile that differs from the
+    applied state. Limits that are not set in the profile, and the HWP hint (which can not be read back), are not
+    compared.
+    """
+
+    from .undervolt_conf import parseLimits
+
+    differences = {}
+
+    for plane in PLANES:
+        applied = state['offsets'].get(plane)
+        saved = float(settings.get(plane, 0))
+        if applied is not None and abs(applied - saved) > OFFSET_TOLERANCE:
+            differences[plane] = {"applied": applied, "saved": saved}
+
+    for key, saved in parseLimits(settings).items():
+        if key == 'hwphint':
+            continue
+
+        applied = state['limits'].get(key)
+        if applied is None:
+            same = False
+        elif key.endswith('_window'):
+            same = abs(applied - saved) <= WINDOW_TOLERANCE * saved
+        elif key == 'tjoffset':
+            same = applied == saved
+        else:
+            same = abs(applied - saved) <= POWER_TOLERANCE
+
+        if not same:
+            differences[key] = {"applied": applied, "saved": saved}
+
+    return differences
+
+
+class ReadbackCache:
+    """
+    Caches the applied state.
+
+    Arguments:
+    read       - Callable returning the helper response of a "read" request
+    ttl        - Seconds after which the state is read again
+    sysfs_root - Root of the sysfs tree holding the microcode version
+    """
+
+    def __init__(self, read: Callable[[], dict], ttl=DEFAULT_TTL, sysfs_root='/'):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.read = read
+        self.ttl = ttl
+        self.microcode_file = os.path.join(sysfs_root, MICROCODE_FILE.lstrip('/'))
+
+        self._lock = threading.Lock()
+        self._state = None
+        self._read_at = None
+        self._suspended = None
+        self._microcode = None
+
+        # Number of reads caused by a resume or microcode reload
+        self.resets = 0
+
+    @staticmethod
+    def _suspendedTime() -> float:
+        """
+        Return the total time the system spent suspended since boot.
+        """
+
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - time.monotonic()
+
+    def _microcodeVersion(self) -> Optional[str]:
+
+        try:
+            with open(self.microcode_file) as version_file:
+                return version_file.read().strip()
+        except OSError:
+            return None
+
+    def stale(self) -> bool:
+        """
+        Return whether the cached state has to be read again.
+        """
+
+        if self._state is None or time.monotonic() - self._read_at > self.ttl:
+            return True
+
+        reset = self._reset()
+        if reset is not None:
+            self.logger.info(f"{reset}, reading the applied state again")
+            return True
+
+        return False
+
+    def _reset(self) -> Optional[str]:
+        """
+        Return why the MSRs may have been reset since the state was read or invalidated, None if they were not.
+        """
+
+        if self._suspended is None:
+            return None
+        if self._suspendedTime() - self._suspended > SUSPEND_THRESHOLD:
+            return "Resumed from suspend"
+        if self._microcodeVersion() != self._microcode:
+            return "Microcode changed"
+        return None
+
+    def get(self, force=False) -> Optional[dict]:
+        """
+        Return the applied state {"offsets", "limits", "source", "time"}, None when it could not be read.
+        """
+
+        with self._lock:
+            if not force and not self.stale():
+                return self._state
+
+            reset = self._reset()
+            response = self.read()
+            if not response.get('ok'):
+                self.logger.warning(f"Reading the applied state failed: {response.get('error', response.get('output'))}")
+                return None
+
+            self._state = {
+                "offsets": response['offsets'],
+                "limits": response['limits'],
+                "source": response.get('source'),
+                "time": time.time()
+            }
+            self._read_at = time.monotonic()
+            self._suspended = self._suspendedTime()
+            self._microcode = self._microcodeVersion()
+            if reset is not None:
+                self.resets += 1
+
+            return self._state
+
+    def invalidate(self) -> None:
+        """
+        Drop the cached state, e.g. after an apply. The MSRs were just written, so resets are counted from now on.
+        """
+
+        with self._lock:
+            self._state = None
+            if self._suspended is not None:
+                self._suspended = self._suspendedTime()
+                self._microcode = self._microcodeVersion()
+
+
+_caches = {}
+
+def getCache(config) -> ReadbackCache:
+    """
+    Return the cache shared by the whole process for the undervolt file and engine of the given config.
+    """
+
+    from . import helper
+
+    engine = config.getSettings().get('engine', 'intel-undervolt')
+    key = (config.undervolt_file, engine)
+
+    if key not in _caches:
+        client = helper.getClient(config.undervolt_file)
+        _caches[key] = ReadbackCache(lambda: client.request("read", engine=engine))
+    return _caches[key]
+
+
+def invalidateAll() -> None:
+    """
+    Drop every cached state, e.g. after applying a profile.
+    """
+
+    for cache in _caches.values():
+        cache.invalidate()
+
+
+def isEnabled(config) -> bool:
+    return config.getBool('verify', False)
+
+
+def verify(cache: ReadbackCache, config, apply) -> Dict[str, dict]:
+    """
+    Compare the applied state with the active profile and apply the profile again if they differ after a resume or
+    microcode reload reset the MSRs. Returns the differences found.
+    """
+
+    resets = cache.resets
+    state = cache.get()
+    if state is None:
+        return {}
+
+    differences = difference(state, config.getProfileSettings())
+    if differences and cache.resets != resets:
+        logging.getLogger(__name__).info(f"Applied state reset, applying the profile again: {differences}")
+        apply()
+    return differences
+
+
+def main(interval=10.0, stop=None) -> None:
+    """
+    Check every `interval` seconds whether a resume or microcode reload reset the active profile, if enabled. Started
+    by the power watcher service. The checks are answered from the cache except after the TTL, a resume or a
+    microcode reload.
+    """
+
+    from .config import Config
+
+    config = Config()
+    if not isEnabled(config):
+        return
+
+    stop = stop or threading.Event()
+    while not stop.wait(interval):
+        config = Config()
+        verify(getCache(config), config, config.applyChanges)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
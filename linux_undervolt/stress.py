@@ -0,0 +1,173 @@
+"""
+Built-in stress workload used to check undervolt stability.
+
+Every core runs deterministic work units mixing vectorised floating point math (NumPy when installed, plain Python
+otherwise), integer hashing and a cache thrashing pass over a buffer larger than the last level cache. The result of
+every unit is compared to a reference computed beforehand; a mismatch or a crashed worker means the current offsets
+are not stable.
+"""
+import hashlib
+import logging
+import math
+import os
+import time
+import zlib
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+#################
+# Work units    #
+#################
+
+def _integerWork(seed: int, rounds=20000) -> str:
+
+    digest = seed.to_bytes(32, 'little')
+    value = seed | 1
+    for _ in range(rounds):
+        digest = hashlib.sha256(digest).digest()
+        value = (value * 6364136223846793005 + 1442695040888963407) & 0xFFFFFFFFFFFFFFFF
+    return f"{digest.hex()}:{value:x}"
+
+
+def _floatWork(seed: int, size=192) -> str:
+
+    if numpy is not None:
+        matrix = numpy.random.default_rng(seed).random((size, size))
+        for _ in range(6):
+            matrix = matrix @ matrix
+            matrix /= numpy.linalg.norm(matrix)
+        return hashlib.sha256(matrix.tobytes()).hexdigest()
+
+    total = 0.0
+    for index in range(size * 400):
+        x = (seed + index) * 1e-3
+        total += math.sin(x) * math.sqrt(x + 1.0) / (1.0 + math.exp(-x % 10))
+    return repr(total)
+
+
+def _cacheWork(seed: int, megabytes=48) -> str:
+
+    size = megabytes << 20
+    buffer = bytearray(size)
+
+    # Touch the buffer with a stride that defeats the prefetcher, then checksum all of it
+    stride = 4096 + 64
+    value = seed & 0xFF
+    for offset in range(0, size, stride):
+        buffer[offset] = value
+        value = (value * 31 + 7) & 0xFF
+
+    return f"{zlib.crc32(buffer):08x}"
+
+
+def workUnit(seed: int) -> tuple:
+    """
+    Run one deterministic unit of every kind of work.
+    """
+
+    return _integerWork(seed), _floatWork(seed), _cacheWork(seed)
+
+
+#################
+# Workload      #
+#################
+
+class StressResult:
+
+    __slots__ = ("stable", "units", "errors", "seconds")
+
+    def __init__(self, stable: bool, units: int, errors: list, seconds: float):
+        self.stable = stable
+        self.units = units
+        self.errors = errors
+        self.seconds = seconds
+
+    def __repr__(self) -> str:
+        return f"StressResult(stable={self.stable}, units={self.units}, errors={len(self.errors)})"
+
+
+class StressWorkload:
+    """
+    Multi-process stress load.
+
+    Arguments:
+    duration  - Seconds the workload runs for
+    processes - Number of worker processes (defaults to one per cpu)
+    """
+
+    def __init__(self, duration=60.0, processes=None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.duration = duration
+        self.processes = processes or os.cpu_count() or 1
+        self._reference = None
+
+    @property
+    def seeds(self) -> list:
+        return list(range(self.processes))
+
+    def reference(self) -> dict:
+        """
+        Compute (once) the expected output of every work unit. Should be called while running at known stable
+        settings.
+        """
+
+        if self._reference is None:
+            with ProcessPoolExecutor(self.processes) as pool:
+                self._reference = dict(zip(self.seeds, pool.map(workUnit, self.seeds)))
+        return self._reference
+
+    def run(self) -> StressResult:
+        """
+        Run the workload on every core for the configured duration and verify every result.
+        """
+
+        reference = self.reference()
+        errors = []
+        units = 0
+        start = time.monotonic()
+
+        try:
+            with ProcessPoolExecutor(self.processes) as pool:
+                while time.monotonic() - start < self.duration:
+                    for seed, result in zip(self.seeds, pool.map(workUnit, self.seeds)):
+                        units += 1
+                        if result != reference[seed]:
+                            errors.append(f"Unit {seed} returned a wrong result")
+                    if errors:
+                        break
+        except BrokenProcessPool:
+            errors.append("A worker process crashed")
+
+        seconds = time.monotonic() - start
+        return StressResult(not errors, units, errors, seconds)
+
+    def runFixed(self, rounds: int) -> StressResult:
+        """
+        Run a fixed amount of work, `rounds` work units per worker, and verify every result. Used to compare the
+        throughput and energy of profiles, where every run has to do the same work.
+        """
+
+        reference = self.reference()
+        errors = []
+        units = 0
+        start = time.monotonic()
+
+        try:
+            with ProcessPoolExecutor(self.processes) as pool:
+                seeds = self.seeds * rounds
+                for seed, result in zip(seeds, pool.map(workUnit, seeds)):
+                    units += 1
+                    if result != reference[seed]:
+                        errors.append(f"Unit {seed} returned a wrong result")
+        except BrokenProcessPool:
+            errors.append("A worker process crashed")
+
+        seconds = time.monotonic() - start
+        return StressResult(not errors, units, errors, seconds)
@@ -0,0 +1,557 @@
+"""
+On-disk telemetry.
+
+TelemetryRecorder appends timestamped samples (power per RAPL domain, package temperature, average frequency and the
+active profile) to segment files under CONFIG_DIR/telemetry. A segment is a fixed-width binary columnar file:
+
+    header   magic, version, number of columns, capacity (rows), row count, creation time
+    names    one 32 byte, NUL padded name per column; column 0 is the timestamp
+    columns  `capacity` little endian float64 values per column, starting at the first page boundary
+
+The file is allocated at its full (sparse) size when created, so a sample is written in place with one pwrite per
+column followed by the new row count. A new segment is started when the current one is full (size) or older than
+max_age, and segments older than the retention period are deleted.
+
+TelemetryReader memory-maps the segments and answers range queries with zero-copy slices of the columns (NumPy arrays
+when NumPy is installed, memoryviews otherwise) and downsampled aggregates, without reading whole files.
+"""
+import bisect
+import fnmatch
+import glob
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+from . import userfiles
+from .constants import CONFIG_DIR
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+TELEMETRY_DIR = os.path.join(CONFIG_DIR, "telemetry")
+
+MAGIC = b"LUTELEM\0"
+VERSION = 1
+HEADER = struct.Struct("<8sHHIQd")
+COUNT_OFFSET = 16
+NAME_SIZE = 32
+PAGE_SIZE = mmap.PAGESIZE
+
+TIME_COLUMN = "time"
+
+
+###########
+# Segment #
+###########
+
+class Segment:
+    """
+    A single segment file. Opened for writing by the recorder and memory-mapped by the reader.
+    """
+
+    def __init__(self, path: str, columns: List[str], capacity: int, count: int, created: float):
+        self.path = path
+        self.columns = columns
+        self.index = {name: position for position, name in enumerate(columns)}
+        self.capacity = capacity
+        self.count = count
+        self.created = created
+
+        self.data_offset = _align(HEADER.size + NAME_SIZE * len(columns))
+        self._fd = None
+        self._map = None
+
+    @classmethod
+    def create(cls, path: str, columns: List[str], capacity: int, created: float) -> 'Segment':
+
+        columns = [TIME_COLUMN] + [name for name in columns if name != TIME_COLUMN]
+        segment = cls(path, columns, capacity, 0, created)
+
+        header = HEADER.pack(MAGIC, VERSION, len(columns), capacity, 0, created)
+        names = b''.join(name.encode()[:NAME_SIZE].ljust(NAME_SIZE, b'\0') for name in columns)
+
+        fd = userfiles.openFile(path, os.O_RDWR | os.O_CREAT | os.O_EXCL)
+        os.pwrite(fd, header + names, 0)
+        os.ftruncate(fd, segment.data_offset + 8 * capacity * len(columns))
+        segment._fd = fd
+        return segment
+
+    @classmethod
+    def open(cls, path: str, writable=False) -> 'Segment':
+
+        fd = os.open(path, os.O_RDWR if writable else os.O_RDONLY)
+        try:
+            magic, version, ncolumns, capacity, count, created = HEADER.unpack(os.pread(fd, HEADER.size, 0))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a telemetry segment")
+
+            names = os.pread(fd, NAME_SIZE * ncolumns, HEADER.size)
+            columns = [names[i:i + NAME_SIZE].rstrip(b'\0').decode() for i in range(0, len(names), NAME_SIZE)]
+        except Exception:
+            os.close(fd)
+            raise
+
+        segment = cls(path, columns, capacity, count, created)
+        segment._fd = fd
+        return segment
+
+    def _columnOffset(self, position: int) -> int:
+        return self.data_offset + 8 * self.capacity * position
+
+    # Writing
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.capacity
+
+    def append(self, timestamp: float, values: Dict[str, float]) -> None:
+
+        row = self.count
+        for position, name in enumerate(self.columns):
+            value = timestamp if position == 0 else values.get(name, math.nan)
+            os.pwrite(self._fd, struct.pack("<d", value), self._columnOffset(position) + 8 * row)
+
+        # The row only becomes visible to readers once the count is updated
+        self.count = row + 1
+        os.pwrite(self._fd, struct.pack("<Q", self.count), COUNT_OFFSET)
+
+    # Reading
+
+    def refresh(self) -> int:
+        """
+        Re-read the row count written by the recorder.
+        """
+
+        if self._map is not None:
+            self.count = struct.unpack_from("<Q", self._map, COUNT_OFFSET)[0]
+        else:
+            self.count = struct.unpack("<Q", os.pread(self._fd, 8, COUNT_OFFSET))[0]
+        return self.count
+
+    def column(self, name: str) -> Optional[memoryview]:
+        """
+        Return the stored rows of a column as a memoryview of doubles backed by the memory map, None if the segment
+        has no such column.
+        """
+
+        position = self.index.get(name)
+        if position is None:
+            return None
+
+        if self._map is None:
+            self._map = mmap.mmap(self._fd, 0, prot=mmap.PROT_READ)
+        self.refresh()
+
+        start = self._columnOffset(position)
+        return memoryview(self._map)[start:start + 8 * self.count].cast('d')
+
+    def range(self, start: float, end: float) -> tuple:
+        """
+        Return the (first, last + 1) row indices with timestamps in [start, end].
+        """
+
+        times = self.column(TIME_COLUMN)
+        return bisect.bisect_left(times, start), bisect.bisect_right(times, end)
+
+    def close(self) -> None:
+
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # Slices handed out by a query still reference the map, it is released with them
+                pass
+            self._map = None
+
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def _align(offset: int) -> int:
+    return -(-offset // PAGE_SIZE) * PAGE_SIZE
+
+
+def _segmentPath(directory: str, created: float) -> str:
+    return os.path.join(directory, f"segment-{int(created * 1000):015d}.lut")
+
+
+def _segmentPaths(directory: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(directory, "segment-*.lut")))
+
+
+############
+# Recorder #
+############
+
+class TelemetryRecorder:
+    """
+    Appends samples to the segment files in `directory`.
+
+    Arguments:
+    directory - Directory holding the segments
+    max_bytes - Size of a segment file, a new segment is started when it is full
+    max_age   - Seconds after which a new segment is started
+    retention - Seconds after which a segment is deleted (None keeps every segment)
+    """
+
+    def __init__(self, directory=TELEMETRY_DIR, max_bytes=8 << 20, max_age=86400.0, retention=30 * 86400.0):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.retention = retention
+        self.segment = None
+
+        userfiles.makedirs(directory)
+
+    def _rotate(self, columns: Iterable[str], now: float) -> None:
+
+        if self.segment is not None:
+            self.segment.close()
+
+        columns = sorted(columns)
+        header = _align(HEADER.size + NAME_SIZE * (len(columns) + 1))
+        capacity = max(1, (self.max_bytes - header) // (8 * (len(columns) + 1)))
+
+        path = _segmentPath(self.directory, now)
+        while os.path.exists(path):
+            now += 0.001
+            path = _segmentPath(self.directory, now)
+
+        self.segment = Segment.create(path, columns, capacity, now)
+        self.logger.debug(f"Started telemetry segment {path}")
+        self.expire(now)
+
+    def expire(self, now: Optional[float] = None) -> None:
+        """
+        Delete the segments whose newest possible sample is older than the retention period.
+        """
+
+        if self.retention is None:
+            return
+        if now is None:
+            now = time.time()
+
+        dir_fd = userfiles.openDirectory(self.directory)
+        try:
+            names = sorted(name for name in os.listdir(dir_fd) if fnmatch.fnmatch(name, "segment-*.lut"))
+            for name, next_name in zip(names, names[1:]):
+                # A segment ends where the next one starts
+                if _segmentCreated(next_name) < now - self.retention:
+                    os.remove(name, dir_fd=dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def append(self, values: Dict[str, float], timestamp: Optional[float] = None) -> None:
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        segment = self.segment
+        if (segment is None or segment.full or timestamp - segment.created >= self.max_age
+                or not values.keys() <= segment.index.keys()):
+            self._rotate(values.keys(), timestamp)
+
+        self.segment.append(timestamp, values)
+
+    def close(self) -> None:
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+
+def _segmentCreated(path: str) -> float:
+    return int(os.path.basename(path)[len("segment-"):-len(".lut")]) / 1000
+
+
+##########
+# Reader #
+##########
+
+class TelemetryReader:
+    """
+    Range queries over the segments in `directory`. Returned slices reference the memory maps and stay valid while
+    they are referenced, even after close().
+    """
+
+    def __init__(self, directory=TELEMETRY_DIR):
+        self.directory = directory
+        self._segments = {}
+
+    def segments(self, start=-math.inf, end=math.inf) -> List[Segment]:
+        """
+        Return the segments that may hold samples in [start, end], oldest first.
+        """
+
+        paths = _segmentPaths(self.directory)
+        segments = []
+
+        # Forget segments deleted by the recorder
+        for path in self._segments.keys() - set(paths):
+            self._segments.pop(path).close()
+
+        for path, next_path in zip(paths, paths[1:] + [None]):
+            if _segmentCreated(path) > end:
+                break
+            if next_path is not None and _segmentCreated(next_path) < start:
+                continue
+
+            segment = self._segments.get(path)
+            if segment is None:
+                try:
+                    segment = self._segments[path] = Segment.open(path)
+                except (OSError, ValueError, struct.error):
+                    continue
+            segments.append(segment)
+
+        return segments
+
+    def metrics(self) -> List[str]:
+        names = set()
+        for segment in self.segments():
+            names.update(segment.columns[1:])
+        return sorted(names)
+
+    def query(self, metric: str, start=-math.inf, end=math.inf) -> tuple:
+        """
+        Return (timestamps, values) of a metric in [start, end]. The result is a view of the file when the range lies in
+        a single segment and a copy otherwise.
+        """
+
+        times, values = [], []
+        for segment in self.segments(start, end):
+            column = segment.column(metric)
+            if column is None:
+                continue
+
+            first, last = segment.range(start, end)
+            if first < last:
+                times.append(segment.column(TIME_COLUMN)[first:last])
+                values.append(column[first:last])
+
+        return _concatenate(times), _concatenate(values)
+
+    def aggregate(self, metric: str, start: float, end: float, step: float) -> List[dict]:
+        """
+        Downsample a metric into buckets of `step` seconds. Returns one {time, min, mean, max, count} dictionary per
+        bucket holding samples, NaN values are skipped.
+        """
+
+        times, values = self.query(metric, start, end)
+        if not len(times):
+            return []
+
+        if numpy is not None:
+            times = numpy.asarray(times)
+            values = numpy.asarray(values)
+            valid = ~numpy.isnan(values)
+            times, values = times[valid], values[valid]
+            if not len(times):
+                return []
+
+            buckets = ((times - start) // step).astype(numpy.int64)
+            edges = numpy.flatnonzero(numpy.diff(buckets)) + 1
+            starts = numpy.concatenate(([0], edges))
+            counts = numpy.diff(numpy.concatenate((starts, [len(values)])))
+
+            return [
+                {"time": start + bucket * step, "min": minimum, "mean": total / count, "max": maximum,
+                 "count": int(count)}
+                for bucket, minimum, total, maximum, count in zip(
+                    buckets[starts].tolist(),
+                    numpy.minimum.reduceat(values, starts).tolist(),
+                    numpy.add.reduceat(values, starts).tolist(),
+                    numpy.maximum.reduceat(values, starts).tolist(),
+                    counts.tolist()
+                )
+            ]
+
+        result = []
+        bucket = None
+        for timestamp, value in zip(times, values):
+            if math.isnan(value):
+                continue
+
+            index = int((timestamp - start) // step)
+            if bucket is None or index != bucket["index"]:
+                bucket = {"index": index, "time": start + index * step, "min": value, "sum": 0.0, "max": value,
+                          "count": 0}
+                result.append(bucket)
+
+            bucket["min"] = min(bucket["min"], value)
+            bucket["max"] = max(bucket["max"], value)
+            bucket["sum"] += value
+            bucket["count"] += 1
+
+        return [
+            {"time": bucket["time"], "min": bucket["min"], "mean": bucket["sum"] / bucket["count"],
+             "max": bucket["max"], "count": bucket["count"]}
+            for bucket in result
+        ]
+
+    def close(self) -> None:
+        for segment in self._segments.values():
+            segment.close()
+        self._segments = {}
+
+
+def _concatenate(parts: list):
+
+    if numpy is not None:
+        if len(parts) == 1:
+            return numpy.frombuffer(parts[0], dtype=numpy.float64)
+        return numpy.concatenate([numpy.frombuffer(part, dtype=numpy.float64) for part in parts]) if parts \
+            else numpy.empty(0)
+
+    if len(parts) == 1:
+        return parts[0]
+
+    result = array('d')
+    for part in parts:
+        result.extend(part)
+    return result
+
+
+###########
+# Sampler #
+###########
+
+class FrequencySensor:
+    """
+    Average current frequency (MHz) of all cpus, from cpufreq.
+    """
+
+    def __init__(self, sysfs_root='/'):
+        paths = glob.glob(os.path.join(sysfs_root, "sys/devices/system/cpu/cpu[0-9]*/cpufreq/scaling_cur_freq"))
+        self._fds = [os.open(path, os.O_RDONLY) for path in paths]
+
+    def read(self) -> Optional[float]:
+
+        values = []
+        for fd in self._fds:
+            try:
+                values.append(int(os.pread(fd, 32, 0)) / 1000)
+            except (OSError, ValueError):
+                continue
+        return sum(values) / len(values) if values else None
+
+    def close(self) -> None:
+        for fd in self._fds:
+            os.close(fd)
+        self._fds = []
+
+
+class TelemetrySampler:
+    """
+    Collects a telemetry sample: power per RAPL domain, package temperature, average frequency and active profile.
+    """
+
+    def __init__(self, sysfs_root='/', config_file=None):
+        from .governor import TemperatureSensor
+        from .measure import metricName
+        from .rapl import RaplSampler
+
+        self._metricName = metricName
+        self.rapl = RaplSampler(sysfs_root)
+        self.temperature = TemperatureSensor(sysfs_root)
+        self.frequency = FrequencySensor(sysfs_root)
+
+        self.config_file = config_file
+        self._config_mtime = None
+        self._profile = math.nan
+
+        if self.rapl.available:
+            self.rapl.sample()
+
+    def profile(self) -> float:
+        """
+        Return the active profile id, re-reading the config file only when it changed.
+        """
+
+        from .config import Config
+        from .constants import CONFIG_FILE
+
+        config_file = self.config_file or CONFIG_FILE
+        try:
+            mtime = os.stat(config_file).st_mtime_ns
+        except FileNotFoundError:
+            return math.nan
+
+        if mtime != self._config_mtime:
+            self._config_mtime = mtime
+            try:
+                self._profile = float(Config(config_file).getSettings('profile'))
+            except (KeyError, ValueError):
+                self._profile = math.nan
+        return self._profile
+
+    def sample(self) -> Dict[str, float]:
+
+        values = {'profile': self.profile()}
+        if self.rapl.available:
+            values.update({self._metricName('power', key): watts for key, watts in self.rapl.sample().items()})
+
+        temperature = self.temperature.read()
+        if temperature is not None:
+            values['temp.package'] = temperature
+
+        frequency = self.frequency.read()
+        if frequency is not None:
+            values['freq.average'] = frequency
+
+        return values
+
+    def close(self) -> None:
+        self.rapl.close()
+        self.temperature.close()
+        self.frequency.close()
+
+
+def record(recorder: TelemetryRecorder, sampler: TelemetrySampler, interval=1.0,
+           stop: threading.Event = None) -> None:
+    """
+    Append a sample every `interval` seconds until `stop` is set.
+    """
+
+    stop = stop or threading.Event()
+    while not stop.wait(interval):
+        recorder.append(sampler.sample())
+
+
+def isEnabled(config) -> bool:
+    return config.getBool('telemetry', False)
+
+
+def main() -> None:
+    """
+    Record the telemetry of the user's config, if enabled. Started by the power watcher service.
+    """
+
+    from .config import Config
+
+    config = Config()
+    if not isEnabled(config):
+        return
+
+    recorder = TelemetryRecorder()
+    sampler = TelemetrySampler()
+    try:
+        record(recorder, sampler, float(config.getSettings().get('telemetry_interval', 1.0)))
+    finally:
+        sampler.close()
+        recorder.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
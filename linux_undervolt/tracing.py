@@ -0,0 +1,237 @@
+"""
+Timing spans for the slow paths (applying a profile, privileged helper calls, GUI startup, power source switches).
+
+Tracing is off unless the LINUX_UNDERVOLT_TRACE environment variable or the `trace` setting is set (or --trace is
+passed to the CLI). While it is off, span() returns a shared no-op context manager and traced functions are called
+directly, so the instrumentation costs one flag check.
+
+While it is on, the spans of an operation (a span that is not nested in another span of the same thread) are written
+when the operation ends:
+
+    CONFIG_DIR/trace.json   Chrome trace events (open with chrome://tracing or https://ui.perfetto.dev). The file is
+                            a JSON array that is appended to and never closed, which the trace viewers accept.
+    CONFIG_DIR/timing.log   One line per operation with its duration and the duration of its direct children.
+"""
+import functools
+import json
+import os
+import threading
+import time
+
+from typing import Dict, Optional
+
+from . import userfiles
+from .constants import CONFIG_DIR
+
+TRACE_ENV = "LINUX_UNDERVOLT_TRACE"
+TRACE_FILE = os.path.join(CONFIG_DIR, "trace.json")
+TIMING_LOG = os.path.join(CONFIG_DIR, "timing.log")
+
+_enabled = bool(os.environ.get(TRACE_ENV))
+_local = threading.local()
+_write_lock = threading.Lock()
+
+# Converts perf_counter readings to wall clock time, so the events of different processes line up
+_CLOCK_OFFSET = time.time() - time.perf_counter()
+
+
+class _NoSpan:
+    """
+    Span used while tracing is off.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+    def set(self, **_) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Span:
+
+    __slots__ = ("name", "args", "start", "end", "children", "parent")
+
+    def __init__(self, name: str, args: dict):
+        self.name = name
+        self.args = args
+        self.children = []
+        self.parent = None
+        self.start = self.end = None
+
+    def set(self, **args) -> None:
+        """
+        Attach values to the span, shown in the trace viewer.
+        """
+
+        self.args.update(args)
+
+    def __enter__(self) -> 'Span':
+
+        stack = _stack()
+        if stack:
+            self.parent = stack[-1]
+            self.parent.children.append(self)
+        stack.append(self)
+
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, error_type, *_) -> bool:
+
+        self.end = time.perf_counter()
+        if error_type is not None:
+            self.args['error'] = error_type.__name__
+
+        _stack().pop()
+        if self.parent is None:
+            _write(self)
+        return False
+
+    @property
+    def seconds(self) -> float:
+        return self.end - self.start
+
+
+def _stack() -> list:
+
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable(state=True) -> None:
+    global _enabled
+    _enabled = state
+
+
+def configure(config) -> None:
+    """
+    Turn tracing on when the `trace` setting of the config is set.
+    """
+
+    if config.getBool('trace', False):
+        enable()
+
+
+def span(name: str, **args):
+    """
+    Return a context manager timing the enclosed block.
+    """
+
+    if not _enabled:
+        return _NO_SPAN
+    return Span(name, args)
+
+
+def traced(name: Optional[str] = None):
+    """
+    Decorator timing every call of a function.
+    """
+
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with Span(span_name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def addTimings(timings: Dict[str, float], prefix='') -> None:
+    """
+    Add spans measured elsewhere (e.g. by the helper process), given as {name: seconds} in the order they ran, to the
+    current span. They are placed back to back, ending now.
+    """
+
+    stack = _stack()
+    if not _enabled or not stack or not timings:
+        return
+
+    parent = stack[-1]
+    start = time.perf_counter() - sum(timings.values())
+    for name, seconds in timings.items():
+        child = Span(f"{prefix}{name}", {})
+        child.start, child.end = start, start + seconds
+        child.parent = parent
+        parent.children.append(child)
+        start += seconds
+
+
+##########
+# Output #
+##########
+
+def _events(span: Span, pid: int, tid: int):
+
+    yield {
+        "name": span.name,
+        "cat": span.name.split('.')[0],
+        "ph": "X",
+        "ts": (span.start + _CLOCK_OFFSET) * 1e6,
+        "dur": span.seconds * 1e6,
+        "pid": pid,
+        "tid": tid,
+        "args": span.args
+    }
+    for child in span.children:
+        yield from _events(child, pid, tid)
+
+
+def timingLine(span: Span) -> str:
+    """
+    Return the timing log line of an operation.
+    """
+
+    children = ' '.join(f"{child.name}={child.seconds * 1000:.2f}ms" for child in span.children)
+    args = ' '.join(f"{key}={value}" for key, value in span.args.items())
+    line = f"{time.strftime('%Y-%m-%dT%H:%M:%S')} {span.name} {span.seconds * 1000:.2f}ms"
+    return ' '.join(part for part in (line, children, args) if part)
+
+
+def _append(path: str, text: str, header='') -> None:
+    """
+    Append to a file with a single write, so concurrent writers (the GUI and the service) do not interleave lines.
+    The (root) watcher service never follows a symlink in place of the file, see userfiles.
+    """
+
+    fd = userfiles.openFile(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+    try:
+        if not os.fstat(fd).st_size:
+            text = header + text
+
+        os.write(fd, text.encode())
+    finally:
+        os.close(fd)
+
+
+def _write(span: Span, trace_file=None, timing_log=None) -> None:
+
+    events = ''.join(
+        json.dumps(event) + ',\n' for event in _events(span, os.getpid(), threading.get_native_id())
+    )
+
+    try:
+        with _write_lock:
+            userfiles.makedirs(CONFIG_DIR)
+            _append(trace_file or TRACE_FILE, events, header='[\n')
+            _append(timing_log or TIMING_LOG, timingLine(span) + '\n')
+    except OSError:
+        # Tracing never breaks the traced operation
+        pass
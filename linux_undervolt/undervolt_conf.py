@@ -0,0 +1,430 @@
+"""
+Round-trip model of intel-undervolt.conf.
+
+The file is parsed into lines that keep their original text. Directives are indexed by kind and key (e.g.
+('undervolt', 0) or ('power', 'package')), and rendering only rewrites the value tokens of directives whose value
+actually changes, so spacing, quoting and comments are preserved and an unchanged profile renders to the exact same
+bytes.
+
+Besides the plane offsets a profile can hold the package power limits, the thermal throttling offset and a hardware
+P-state hint. They are rendered into these lines:
+
+    power package 45/0.002 35/28 # linux-undervolt      (pl2/pl2_window pl1/pl1_window)
+    tjoffset -20 # linux-undervolt
+    hwphint switch load:single:0.90 performance balance_performance # linux-undervolt
+
+The trailing comment marks the lines written for a profile. Switching to a profile that does not set a limit removes
+its marked line, so the limits of the previous profile do not outlive it. Lines written by hand are never removed:
+while a profile sets the same limit they are commented out with a "#linux-undervolt: " prefix, and they are restored
+once a profile without that limit is written. A limit set neither by the profile nor by hand is left alone by
+intel-undervolt, so it keeps the value last applied until the next boot.
+"""
+import os
+import re
+import threading
+
+from typing import Dict, List, Optional, Tuple
+
+from .constants import PLANES
+
+# Plane names as written by intel-undervolt in its default config
+PLANE_LABELS = {
+    'cpu': 'CPU',
+    'gpu': 'GPU',
+    'cpu_cache': 'CPU Cache',
+    'sys_agent': 'System Agent',
+    'analog_io': 'Analog I/O'
+}
+
+# Profile settings written to the power, tjoffset and hwphint lines
+LIMITS = ('pl1', 'pl1_window', 'pl2', 'pl2_window', 'tjoffset', 'hwphint')
+
+# (kind, key) of the lines holding the limits
+LIMIT_LINES = (('power', 'package'), ('tjoffset', None), ('hwphint', None))
+
+# Trailing comment of the limit lines written for a profile
+MARKER = "# linux-undervolt"
+
+# Prefix of the limit lines written by hand, set aside while a profile sets the same limit
+DISABLED = "#linux-undervolt: "
+
+# Allowed ranges of the limits
+POWER_RANGE = (1, 500)          # W
+WINDOW_RANGE = (0.001, 128)     # s
+TJOFFSET_RANGE = (-63, 0)       # °C below TjMax
+
+HWP_MODES = ('switch', 'force')
+HWP_HINTS = ('default', 'performance', 'balance_performance', 'balance_power', 'power')
+_HWP_ALGORITHM = re.compile(
+    r"load:(single|multi):(0(\.\d+)?|1(\.0+)?)"
+    r"|power(:[a-z]+:(gt|lt):\d+(\.\d+)?(:(and|or))?)+"
+)
+
+_TOKEN = re.compile(r"'[^']*'|\"[^\"]*\"|#.*|[^\s#]+")
+
+
+class Directive:
+    """
+    A single non-comment line of the file. Tokens are kept with their position in the line so a token can be
+    replaced without touching the rest of the line.
+    """
+
+    __slots__ = ("text", "tokens", "spans")
+
+    def __init__(self, text: str):
+        self.text = text
+
+        body = text.rstrip('\r\n')
+        self.tokens = []
+        self.spans = []
+        for match in _TOKEN.finditer(body):
+            # Everything after an unquoted # is a trailing comment
+            if match.group().startswith('#'):
+                break
+            self.tokens.append(match.group())
+            self.spans.append(match.span())
+
+    @property
+    def kind(self) -> str:
+        return self.tokens[0]
+
+    @property
+    def key(self):
+        """
+        Key identifying the directive among directives of the same kind: the plane index for undervolt lines, the
+        domain for power lines and None for everything else.
+        """
+
+        if self.kind == 'undervolt' and len(self.tokens) > 1 and self.tokens[1].isdigit():
+            return int(self.tokens[1])
+        if self.kind == 'power' and len(self.tokens) > 1:
+            return self.tokens[1]
+        return None
+
+    @property
+    def written(self) -> bool:
+        """
+        Whether the line was written for a profile, i.e. ends with the marker comment.
+        """
+
+        return self.text.rstrip('\r\n').endswith(MARKER)
+
+    @property
+    def label(self) -> Optional[str]:
+        """
+        The unquoted plane name of an undervolt line.
+        """
+
+        if self.kind == 'undervolt' and len(self.tokens) > 2:
+            return self.tokens[2].strip('\'"')
+        return None
+
+    def replaced(self, index: int, value: str) -> str:
+        """
+        Return the line text with the token at index replaced by value.
+        """
+
+        start, end = self.spans[index]
+        return f"{self.text[:start]}{value}{self.text[end:]}"
+
+    def replacedFrom(self, index: int, values: List[str]) -> str:
+        """
+        Return the line text with every token from index on replaced by the given values.
+        """
+
+        if index >= len(self.tokens):
+            body = self.text.rstrip('\r\n')
+            return f"{body} {' '.join(values)}{self.text[len(body):]}"
+
+        start, end = self.spans[index][0], self.spans[-1][1]
+        return f"{self.text[:start]}{' '.join(values)}{self.text[end:]}"
+
+
+##########
+# Limits #
+##########
+
+def _number(settings: dict, key: str, limits: tuple, cast=float):
+
+    value = settings[key]
+    try:
+        value = cast(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid value for {key}: {value!r}")
+
+    if not limits[0] <= value <= limits[1]:
+        raise ValueError(f"{key} out of range ({limits[0]} to {limits[1]}): {value}")
+    return value
+
+
+def parseLimits(settings: dict) -> dict:
+    """
+    Return the validated limits found in the profile settings. Missing and empty values are left out.
+    Raises ValueError for values that are malformed or out of range.
+    """
+
+    settings = {key: settings[key] for key in LIMITS if str(settings.get(key, '')).strip()}
+    limits = {}
+
+    for key in ('pl1', 'pl2'):
+        if key in settings:
+            limits[key] = _number(settings, key, POWER_RANGE)
+        if f"{key}_window" in settings:
+            if key not in settings:
+                raise ValueError(f"{key}_window requires {key}")
+            limits[f"{key}_window"] = _number(settings, f"{key}_window", WINDOW_RANGE)
+
+    if ('pl1' in limits) != ('pl2' in limits):
+        raise ValueError("pl1 and pl2 have to be set together")
+    if 'pl1' in limits and limits['pl2'] < limits['pl1']:
+        raise ValueError(f"pl2 ({limits['pl2']:g} W) is lower than pl1 ({limits['pl1']:g} W)")
+
+    if 'tjoffset' in settings:
+        limits['tjoffset'] = _number(settings, 'tjoffset', TJOFFSET_RANGE, int)
+
+    if 'hwphint' in settings:
+        tokens = str(settings['hwphint']).split()
+        if (len(tokens) != 4 or tokens[0] not in HWP_MODES or not _HWP_ALGORITHM.fullmatch(tokens[1])
+                or tokens[2] not in HWP_HINTS or tokens[3] not in HWP_HINTS):
+            raise ValueError(
+                f"Invalid hwphint: {settings['hwphint']!r}. Expected: MODE ALGORITHM LOAD_HINT NORMAL_HINT with "
+                f"MODE one of {', '.join(HWP_MODES)} and the hints one of {', '.join(HWP_HINTS)}"
+            )
+        limits['hwphint'] = ' '.join(tokens)
+
+    return limits
+
+
+def _powerValue(limits: dict, key: str) -> str:
+
+    window = limits.get(f"{key}_window")
+    return f"{limits[key]:g}" if window is None else f"{limits[key]:g}/{window:g}"
+
+
+def limitDirectives(limits: dict) -> Dict[tuple, Tuple[int, List[str]]]:
+    """
+    Return the lines for the given (validated) limits as {(kind, key): (index of the first value token, values)}.
+    """
+
+    directives = {}
+    if 'pl1' in limits:
+        # intel-undervolt takes the short term (PL2) limit first
+        directives[('power', 'package')] = (2, [_powerValue(limits, 'pl2'), _powerValue(limits, 'pl1')])
+    if 'tjoffset' in limits:
+        directives[('tjoffset', None)] = (1, [str(limits['tjoffset'])])
+    if 'hwphint' in limits:
+        directives[('hwphint', None)] = (1, limits['hwphint'].split())
+    return directives
+
+
+def _sameValues(tokens: List[str], values: List[str]) -> bool:
+    """
+    Compare value tokens, numbers by their value so e.g. 35.0/28 equals 35/28.
+    """
+
+    if len(tokens) != len(values):
+        return False
+
+    for token, value in zip(tokens, values):
+        token_parts = re.split('[/:]', token.strip('\'"'))
+        value_parts = re.split('[/:]', value)
+        if len(token_parts) != len(value_parts):
+            return False
+        for token_part, value_part in zip(token_parts, value_parts):
+            try:
+                if float(token_part) != float(value_part):
+                    return False
+            except ValueError:
+                if token_part != value_part:
+                    return False
+    return True
+
+
+class UndervoltConf:
+    """
+    Parsed intel-undervolt.conf.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.lines = []
+        self.index = {}
+
+        # Line numbers of the limit lines written by hand that are set aside, by (kind, key)
+        self.disabled = {}
+
+        for number, line in enumerate(text.splitlines(keepends=True)):
+            stripped = line.strip()
+
+            if line.startswith(DISABLED):
+                directive = Directive(line[len(DISABLED):])
+                if directive.tokens:
+                    self.disabled.setdefault((directive.kind, directive.key), []).append(number)
+
+            if not stripped or stripped.startswith('#'):
+                self.lines.append(line)
+                continue
+
+            directive = Directive(line)
+            self.lines.append(directive)
+            self.index.setdefault((directive.kind, directive.key), []).append(number)
+
+    @classmethod
+    def fromFile(cls, path: str) -> 'UndervoltConf':
+        with open(path) as stream:
+            return cls(stream.read())
+
+    def find(self, kind: str, key=None) -> List[Directive]:
+        """
+        Return every directive of the given kind and key.
+        """
+
+        return [self.lines[number] for number in self.index.get((kind, key), [])]
+
+    def undervolt(self) -> Dict[str, float]:
+        """
+        Return the offsets currently written in the file, keyed by plane name.
+        """
+
+        offsets = {}
+        for index, plane in enumerate(PLANES):
+            for directive in self.find('undervolt', index):
+                try:
+                    offsets[plane] = float(directive.tokens[-1])
+                except ValueError:
+                    pass
+        return offsets
+
+    def limits(self) -> dict:
+        """
+        Return the limits currently written in the file, in the layout of the profile settings.
+        """
+
+        limits = {}
+
+        for directive in self.find('power', 'package'):
+            for key, token in zip(('pl2', 'pl1'), directive.tokens[2:4]):
+                power, _, window = token.split(':')[0].partition('/')
+                try:
+                    limits[key] = float(power)
+                    if window:
+                        limits[f"{key}_window"] = float(window)
+                except ValueError:
+                    pass
+
+        for directive in self.find('tjoffset'):
+            try:
+                limits['tjoffset'] = int(directive.tokens[1])
+            except (IndexError, ValueError):
+                pass
+
+        for directive in self.find('hwphint'):
+            limits['hwphint'] = ' '.join(directive.tokens[1:])
+
+        return limits
+
+    def changes(self, settings: dict) -> Tuple[Dict[int, str], List[str]]:
+        """
+        Work out the edits needed to write the given offsets and limits. Returns the replaced lines keyed by line
+        number and the lines to append for planes and limits missing from the file. Removed lines are replaced by an
+        empty string.
+        """
+
+        replaced = {}
+        appended = []
+
+        for index, plane in enumerate(PLANES):
+            if plane not in settings:
+                continue
+
+            value = int(settings[plane])
+            numbers = self.index.get(('undervolt', index), [])
+
+            if not numbers:
+                appended.append(f"undervolt {index} '{PLANE_LABELS[plane]}' {value}\n")
+                continue
+
+            for number in numbers:
+                directive = self.lines[number]
+                try:
+                    unchanged = float(directive.tokens[-1]) == value
+                except ValueError:
+                    unchanged = False
+
+                if not unchanged:
+                    replaced[number] = directive.replaced(len(directive.tokens) - 1, str(value))
+
+        directives = limitDirectives(parseLimits(settings))
+
+        for line in LIMIT_LINES:
+            numbers = self.index.get(line, [])
+            written = [number for number in numbers if self.lines[number].written]
+            by_hand = [number for number in numbers if not self.lines[number].written]
+
+            if line not in directives:
+                # The limits of the previous profile must not outlive it, the ones written by hand apply again
+                replaced.update((number, '') for number in written)
+                replaced.update((number, self.lines[number][len(DISABLED):]) for number in self.disabled.get(line, []))
+                continue
+
+            replaced.update((number, DISABLED + self.lines[number].text) for number in by_hand)
+
+            kind, key = line
+            start, values = directives[line]
+            if not written:
+                appended.append(' '.join([kind] + ([key] if key else []) + values + [MARKER]) + '\n')
+                continue
+
+            # intel-undervolt accepts several hwphint rules, a profile holds a single one
+            replaced.update((number, '') for number in written[1:])
+
+            directive = self.lines[written[0]]
+            if not _sameValues(directive.tokens[start:], values):
+                replaced[written[0]] = directive.replacedFrom(start, values)
+
+        return replaced, appended
+
+    def render(self, settings: dict) -> str:
+        """
+        Return the file contents with the given offsets and limits. Only the changed lines are rebuilt, every other
+        line is emitted exactly as it was read.
+        """
+
+        replaced, appended = self.changes(settings)
+        if not replaced and not appended:
+            return self.text
+
+        lines = [
+            replaced.get(number, line if isinstance(line, str) else line.text)
+            for number, line in enumerate(self.lines)
+        ]
+
+        text = ''.join(lines)
+        if appended and text and not text.endswith('\n'):
+            text += '\n'
+
+        return text + ''.join(appended)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+def load(path: str) -> UndervoltConf:
+    """
+    Return the parsed file, re-parsing only when its modification time, size or inode changed.
+    """
+
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+    conf = UndervoltConf.fromFile(path)
+
+    with _cache_lock:
+        _cache[path] = (key, conf)
+
+    return conf
@@ -0,0 +1,193 @@
+"""
+Files of the user written by the (root) power watcher service.
+
+The service runs as root but keeps the telemetry segments, traces, history and exporter files in the user's config
+directory. Opened by name, a symlink the user places on the way (e.g. ~/.config/linux-undervolt/telemetry pointing to
+/etc) would be followed with root's rights, and chown()ing the result by name would hand root's files to the user.
+
+Below HOME, when running as root, the functions here:
+
+    - open the directories from HOME down one at a time, relative to their parent and without following symlinks,
+      and only accept directories owned by the user (or root)
+    - never follow a symlink as the last component, and only open existing files that are regular, owned by the user
+      and have a single link
+    - create files exclusively and give those they created to the user through the descriptor
+
+Outside of the service (or outside HOME) they are the plain os calls.
+"""
+import errno
+import os
+import secrets
+import stat
+
+from typing import List, Optional, Tuple
+
+from .constants import HOME
+
+DIRECTORY_FLAGS = os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC
+
+
+def _components(path: str) -> Optional[List[str]]:
+    """
+    Return the components of `path` below HOME, None when the path does not need to be guarded.
+    """
+
+    if os.geteuid() != 0:
+        return None
+
+    home = os.path.abspath(HOME)
+    path = os.path.abspath(path)
+    if os.path.commonpath((home, path)) != home:
+        return None
+
+    relative = os.path.relpath(path, home)
+    return [] if relative == os.curdir else relative.split(os.sep)
+
+
+def _owner() -> Tuple[int, int]:
+    stat_result = os.stat(HOME)
+    return stat_result.st_uid, stat_result.st_gid
+
+
+def _openDirectory(path: str, create: bool) -> Tuple[int, Optional[Tuple[int, int]]]:
+    """
+    Return a descriptor of the directory and the (uid, gid) its files are given to, None when not guarded.
+    """
+
+    parts = _components(path)
+    if parts is None:
+        if create:
+            os.makedirs(path, exist_ok=True)
+        return os.open(path, DIRECTORY_FLAGS), None
+
+    owner = _owner()
+    fd = os.open(HOME, DIRECTORY_FLAGS)
+    try:
+        for part in parts:
+            try:
+                child = os.open(part, DIRECTORY_FLAGS | os.O_NOFOLLOW, dir_fd=fd)
+                created = False
+            except FileNotFoundError:
+                if not create:
+                    raise
+                try:
+                    os.mkdir(part, 0o755, dir_fd=fd)
+                    created = True
+                except FileExistsError:
+                    created = False
+                child = os.open(part, DIRECTORY_FLAGS | os.O_NOFOLLOW, dir_fd=fd)
+
+            os.close(fd)
+            fd = child
+
+            stat_result = os.fstat(fd)
+            if created and stat_result.st_uid != owner[0]:
+                os.fchown(fd, *owner)
+            elif stat_result.st_uid not in (owner[0], 0):
+                raise PermissionError(errno.EPERM, "Directory not owned by the user", os.path.join(HOME, *parts))
+    except BaseException:
+        os.close(fd)
+        raise
+
+    return fd, owner
+
+
+def _openAt(dir_fd: int, name: str, flags: int, mode: int, owner: Optional[Tuple[int, int]], path: str) -> int:
+
+    if owner is None:
+        return os.open(name, flags | os.O_CLOEXEC, mode, dir_fd=dir_fd)
+
+    flags |= os.O_NOFOLLOW | os.O_CLOEXEC
+
+    if flags & os.O_CREAT:
+        try:
+            fd = os.open(name, flags | os.O_EXCL, mode, dir_fd=dir_fd)
+        except FileExistsError:
+            if flags & os.O_EXCL:
+                raise
+        else:
+            try:
+                os.fchown(fd, *owner)
+            except BaseException:
+                os.close(fd)
+                raise
+            return fd
+
+    # Non-blocking, so a FIFO in place of the file cannot hang the service
+    fd = os.open(name, (flags & ~(os.O_CREAT | os.O_TRUNC)) | os.O_NONBLOCK, dir_fd=dir_fd)
+    try:
+        stat_result = os.fstat(fd)
+        if (not stat.S_ISREG(stat_result.st_mode) or stat_result.st_uid != owner[0]
+                or stat_result.st_nlink != 1):
+            raise PermissionError(errno.EPERM, "Not a regular file owned by the user", path)
+
+        os.set_blocking(fd, True)
+        if flags & os.O_TRUNC:
+            os.ftruncate(fd, 0)
+    except BaseException:
+        os.close(fd)
+        raise
+
+    return fd
+
+
+def makedirs(path: str) -> None:
+    """
+    os.makedirs(path, exist_ok=True), giving the directories created to the user.
+    """
+
+    os.close(_openDirectory(path, create=True)[0])
+
+
+def openDirectory(path: str) -> int:
+    """
+    Return a descriptor of an existing directory, for listing and removing its files with dir_fd.
+    """
+
+    return _openDirectory(path, create=False)[0]
+
+
+def openFile(path: str, flags: int, mode=0o644) -> int:
+    """
+    os.open(path, flags, mode) for a file in an existing directory.
+    """
+
+    directory, name = os.path.split(os.path.abspath(path))
+    dir_fd, owner = _openDirectory(directory, create=False)
+    try:
+        return _openAt(dir_fd, name, flags, mode, owner, path)
+    finally:
+        os.close(dir_fd)
+
+
+def replaceFile(path: str, data: bytes, mode=0o644, sync=False) -> None:
+    """
+    Atomically replace the contents of a file in an existing directory through a temporary file with a random name.
+    With `sync` the data and the rename are flushed to disk before returning.
+    """
+
+    directory, name = os.path.split(os.path.abspath(path))
+    dir_fd, owner = _openDirectory(directory, create=False)
+    try:
+        temp_name = f".{name}.{secrets.token_hex(4)}.tmp"
+        fd = _openAt(dir_fd, temp_name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode, owner, path)
+        try:
+            try:
+                os.write(fd, data)
+                os.fchmod(fd, mode)
+                if sync:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+            os.replace(temp_name, name, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+        except BaseException:
+            try:
+                os.remove(temp_name, dir_fd=dir_fd)
+            except OSError:
+                pass
+            raise
+
+        if sync:
+            os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
@@ -0,0 +1,152 @@
+"""
+Background execution of blocking operations for the GUI.
+
+Applying a profile or installing the power watcher waits for the privileged helper (and, on the first call of a
+session, for the polkit password prompt). BackgroundWorker runs those operations on a worker thread and hands progress
+and results back through `dispatch`, which is GLib.idle_add in the GUI, so every callback runs in the GTK main loop.
+Nothing in this module imports GTK.
+"""
+import collections
+import logging
+import threading
+
+from typing import Callable, Optional
+
+
+class Job:
+    """
+    A unit of work. `function` receives the job itself, so it can report progress and stop early when cancelled.
+    """
+
+    __slots__ = ("key", "function", "on_done", "on_progress", "cancelled", "_dispatch")
+
+    def __init__(self, key: str, function: Callable, on_done=None, on_progress=None, dispatch=None):
+        self.key = key
+        self.function = function
+        self.on_done = on_done
+        self.on_progress = on_progress
+        self.cancelled = False
+        self._dispatch = dispatch
+
+    def progress(self, fraction: float, text: str) -> None:
+        """
+        Report progress (0-1) from the job function.
+        """
+
+        if self.on_progress is not None and not self.cancelled:
+            self._dispatch(self.on_progress, self, fraction, text)
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class BackgroundWorker:
+    """
+    Runs jobs one at a time on a single worker thread, in submission order.
+
+    Jobs are coalesced by key: submitting a job while a job with the same key is still waiting replaces the waiting
+    job, so repeated requests (e.g. clicking Apply several times) only carry out the latest one. When done,
+    on_done(job, result, error) is dispatched; it is not called for cancelled jobs.
+
+    Arguments:
+    dispatch - Function used to run callbacks, e.g. GLib.idle_add. Called as dispatch(callback, *args) and has to
+               return a false value. Defaults to calling the callback on the worker thread.
+    """
+
+    def __init__(self, dispatch=None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._dispatch = dispatch or _callNow
+
+        self._pending = collections.OrderedDict()
+        self._running = None
+        self._condition = threading.Condition()
+        self._stopped = False
+
+        self._thread = threading.Thread(target=self._run, name="background-worker", daemon=True)
+        self._thread.start()
+
+    def submit(self, key: str, function: Callable, on_done=None, on_progress=None) -> Job:
+
+        job = Job(key, function, on_done, on_progress, self._dispatch)
+
+        with self._condition:
+            replaced = self._pending.pop(key, None)
+            if replaced is not None:
+                replaced.cancel()
+                self.logger.debug(f"Replaced pending {key} job")
+
+            self._pending[key] = job
+            self._condition.notify()
+
+        return job
+
+    def cancel(self, key: Optional[str] = None, running=True) -> bool:
+        """
+        Cancel the waiting jobs with the given key (all jobs if None) and, unless running is false, the running one. A
+        running job is asked to stop; its result is discarded either way. Returns whether a job was cancelled.
+        """
+
+        cancelled = False
+        with self._condition:
+            for pending_key in list(self._pending):
+                if key is None or pending_key == key:
+                    self._pending.pop(pending_key).cancel()
+                    cancelled = True
+
+            if running and self._running is not None and (key is None or self._running.key == key):
+                self._running.cancel()
+                cancelled = True
+
+        return cancelled
+
+    def waiting(self, key: str) -> bool:
+        """
+        Whether a job with the given key is waiting to run.
+        """
+
+        with self._condition:
+            return key in self._pending
+
+    def busy(self, key: Optional[str] = None) -> bool:
+
+        with self._condition:
+            if key is None:
+                return bool(self._pending) or self._running is not None
+            return key in self._pending or (self._running is not None and self._running.key == key)
+
+    def shutdown(self) -> None:
+
+        self.cancel()
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def _run(self) -> None:
+
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+
+                _, job = self._pending.popitem(last=False)
+                self._running = job
+
+            result = error = None
+            try:
+                result = job.function(job)
+            except Exception as err:
+                self.logger.exception(f"The {job.key} job failed")
+                error = err
+
+            with self._condition:
+                self._running = None
+
+            if job.on_done is not None and not job.cancelled:
+                self._dispatch(job.on_done, job, result, error)
+
+
+def _callNow(callback, *args) -> bool:
+    callback(*args)
+    return False
@@ -20,11 +20,10 @@ setup(
     include_package_data=True,
     entry_points={
         'gui_scripts': ["linux-undervolt = linux_undervolt.__main__:main"],
-        'console_scripts': ["linux-undervolt = linux_undervolt.config:cli"]
+        'console_scripts': ["linux-undervolt-cli = linux_undervolt.cli:main"]
     },
     data_files=[
-        ('share/applications/', ['theonemaster-linux_undervolt.desktop']),
-        ('/opt/linux-undervolt', ['linux_undervolt/config.py'])
+        ('share/applications/', ['theonemaster-linux_undervolt.desktop'])
     ],
     classifiers=[
         "License :: OSI Approved :: GPLv2 License"
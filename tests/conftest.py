@@ -0,0 +1,28 @@
+import os
+
+import pytest
+
+from linux_undervolt import userfiles
+
+# Uid and gid of the user owning the home directory in the tests run as root
+USER = 4242
+
+
+@pytest.fixture
+def user_home(tmp_path, monkeypatch):
+    """
+    A home directory owned by an unprivileged user, with the config directory in place. Only meaningful as root,
+    where the files below it are written the way the power watcher service writes them.
+    """
+
+    if os.geteuid() != 0:
+        pytest.skip("needs root")
+
+    home = tmp_path / "home"
+    config_dir = home / ".config" / "linux-undervolt"
+    config_dir.mkdir(parents=True)
+    for path in (home, home / ".config", config_dir):
+        os.chown(path, USER, USER)
+
+    monkeypatch.setattr(userfiles, "HOME", str(home))
+    return config_dir
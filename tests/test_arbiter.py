@@ -0,0 +1,91 @@
+import pytest
+
+from linux_undervolt.arbiter import ProfileArbiter
+
+
+class Profiles:
+    """
+    The active profile of a config and the applies made by the arbiter.
+    """
+
+    def __init__(self, active='0'):
+        self.active = active
+        self.applied = []
+
+    def apply(self, profile):
+        self.active = profile
+        self.applied.append(profile)
+
+
+@pytest.fixture
+def profiles():
+    return Profiles()
+
+
+@pytest.fixture
+def arbiter(profiles):
+    return ProfileArbiter(profiles.apply, lambda: profiles.active)
+
+
+def test_precedence(profiles, arbiter):
+
+    arbiter.request('power', '1')
+    arbiter.request('governor', '2')
+    arbiter.request('app', '3')
+
+    # A lower source changing its request does not override a higher one
+    arbiter.request('power', '4')
+
+    assert profiles.applied == ['1', '2', '3']
+    assert arbiter.winner() == '3'
+
+
+def test_withdrawing_hands_over_to_the_next_source(profiles, arbiter):
+
+    arbiter.request('power', '1')
+    arbiter.request('app', '3')
+    arbiter.request('app', None)
+
+    assert profiles.applied == ['1', '3', '1']
+
+
+def test_base_profile_is_restored(profiles, arbiter):
+
+    arbiter.request('governor', '2')
+    arbiter.request('governor', None)
+
+    assert profiles.applied == ['2', '0']
+
+
+def test_user_selection_becomes_the_base(profiles, arbiter):
+
+    arbiter.request('governor', '2')
+
+    # Selected in the GUI while the governor's profile was in effect
+    profiles.active = '5'
+    arbiter.request('governor', None)
+
+    assert arbiter.base == '5'
+    assert profiles.applied == ['2']
+
+
+def test_same_winner_is_not_applied_again(profiles, arbiter):
+
+    arbiter.request('power', '0')
+    arbiter.request('governor', '0')
+
+    assert profiles.applied == []
+
+
+def test_unknown_profile_withdraws_the_request(profiles):
+
+    arbiter = ProfileArbiter(profiles.apply, lambda: profiles.active, lambda profile: {'Battery': '1'}.get(profile))
+
+    arbiter.request('power', 'Battery')
+    arbiter.request('governor', 'Missing')
+
+    assert profiles.applied == ['1']
+    assert 'governor' not in arbiter.requests
+
+    with pytest.raises(ValueError):
+        arbiter.request('cron', '1')
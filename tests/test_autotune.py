@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+from linux_undervolt.autotune import AutoTuner, SimulatedBackend, SimulatedCrash
+
+
+class InterruptedBackend(SimulatedBackend):
+    """
+    Stopped by the user (Ctrl+C) during the stress test of the given test number.
+    """
+
+    def __init__(self, thresholds, interrupt_at: int):
+        super().__init__(thresholds)
+        self.interrupt_at = interrupt_at
+        self.applied = []
+
+    def apply(self, settings):
+        super().apply(settings)
+        self.applied.append(dict(settings))
+
+    def stress(self) -> bool:
+        if self.tests + 1 == self.interrupt_at:
+            raise KeyboardInterrupt
+        return super().stress()
+
+
+@pytest.mark.parametrize("mode", ["binary", "step"])
+def test_finds_the_threshold(tmp_path, mode):
+
+    backend = SimulatedBackend({'cpu': -72, 'gpu': -40})
+    tuner = AutoTuner(backend, ['cpu', 'gpu'], str(tmp_path / "autotune.json"), mode=mode)
+
+    result = tuner.run()
+
+    assert result['cpu'] == -70 and result['gpu'] == -40
+    assert result['cpu_cache'] == 0
+    assert backend.settings == result
+
+
+def test_margin_backs_off(tmp_path):
+
+    tuner = AutoTuner(SimulatedBackend({'cpu': -50}), ['cpu'], str(tmp_path / "autotune.json"))
+
+    assert tuner.run(margin=10)['cpu'] == -40
+
+
+def test_resumes_after_a_crash(tmp_path):
+
+    state_file = str(tmp_path / "autotune.json")
+
+    with pytest.raises(SimulatedCrash):
+        AutoTuner(SimulatedBackend({'cpu': -50}, crash=True), ['cpu'], state_file).run()
+
+    with open(state_file) as state:
+        crashed = json.load(state)['testing']
+    assert crashed['plane'] == 'cpu'
+
+    # The offset being tested when the machine went down is never tried again
+    backend = SimulatedBackend({'cpu': -50}, crash=True)
+    tuner = AutoTuner(backend, ['cpu'], state_file)
+    assert tuner.state['planes']['cpu']['unstable'] == crashed['offset']
+
+    while True:
+        try:
+            result = tuner.run()
+            break
+        except SimulatedCrash:
+            tuner = AutoTuner(backend, ['cpu'], state_file)
+
+    assert result['cpu'] == -50
+
+
+def test_interrupt_applies_the_stable_offsets(tmp_path):
+
+    state_file = str(tmp_path / "autotune.json")
+    backend = InterruptedBackend({'cpu': -50}, interrupt_at=3)
+    tuner = AutoTuner(backend, ['cpu'], state_file)
+
+    with pytest.raises(KeyboardInterrupt):
+        tuner.run()
+
+    stable = tuner.state['settings']
+    assert backend.applied[-1] == stable
+    assert tuner.state['testing'] is None
+
+    # The interrupted offset was not marked unstable, the next run continues the search
+    assert AutoTuner(SimulatedBackend({'cpu': -50}), ['cpu'], state_file).run()['cpu'] == -50
@@ -0,0 +1,139 @@
+import os
+
+import pytest
+
+from linux_undervolt import exporter
+
+from conftest import USER
+
+
+def write(path, text: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+@pytest.fixture
+def sysfs(tmp_path):
+    """
+    One package with a single core, a coretemp device and a RAPL package zone.
+    """
+
+    root = tmp_path / "sysfs"
+    cpu = root / "sys/devices/system/cpu/cpu0"
+    write(cpu / "topology/physical_package_id", "0\n")
+    write(cpu / "topology/core_id", "0\n")
+    write(cpu / "cpufreq/scaling_cur_freq", "2400000\n")
+    write(cpu / "thermal_throttle/core_throttle_count", "3\n")
+    write(cpu / "thermal_throttle/package_throttle_count", "5\n")
+
+    hwmon = root / "sys/class/hwmon/hwmon0"
+    write(hwmon / "name", "coretemp\n")
+    write(hwmon / "temp1_label", "Package id 0\n")
+    write(hwmon / "temp1_input", "61000\n")
+
+    rapl = root / "sys/class/powercap/intel-rapl:0"
+    write(rapl / "name", "package-0\n")
+    write(rapl / "energy_uj", "1000000\n")
+    write(rapl / "max_energy_range_uj", "262143328850\n")
+    return root
+
+
+def test_collect_exports_sensors_and_apply_stats(sysfs, tmp_path):
+
+    stats_file = str(tmp_path / "apply-stats.json")
+    exporter.recordApply(0.5, True, stats_file)
+    exporter.recordApply(0.25, False, stats_file)
+
+    instance = exporter.Exporter(str(tmp_path / "out.prom"), sysfs_root=str(sysfs),
+                                 config_file=str(tmp_path / "missing.conf"), stats_file=stats_file)
+    lines = instance.collect().splitlines()
+    instance.close()
+
+    assert 'linux_undervolt_package_temperature_celsius{package="0"} 61' in lines
+    assert 'linux_undervolt_core_throttle_total{package="0",core="0"} 3' in lines
+    assert 'linux_undervolt_package_throttle_total{package="0"} 5' in lines
+    assert 'linux_undervolt_rapl_power_watts{domain="package-0"} 0' in lines
+    assert 'linux_undervolt_apply_total 2' in lines
+    assert 'linux_undervolt_apply_failures_total 1' in lines
+    assert 'linux_undervolt_apply_duration_seconds 0.25' in lines
+    assert '# TYPE linux_undervolt_apply_total counter' in lines
+
+    # Without a config there is no active profile
+    assert not any(line.startswith('linux_undervolt_active_profile') for line in lines)
+
+
+def test_labels_are_escaped():
+
+    metrics = exporter.MetricsText()
+    metrics.family("active_profile", "gauge", "Id of the active profile.", [({"name": 'a "b"\\c'}, 1)])
+    metrics.family("empty", "gauge", "Left out.", [({}, None)])
+
+    assert metrics.text().splitlines()[-1] == 'linux_undervolt_active_profile{name="a \\"b\\"\\\\c"} 1'
+    assert 'empty' not in metrics.text()
+
+
+def test_write_replaces_the_file(sysfs, tmp_path):
+
+    path = tmp_path / "textfile" / "linux-undervolt.prom"
+    instance = exporter.Exporter(str(path), sysfs_root=str(sysfs), stats_file=str(tmp_path / "stats.json"))
+    instance.write()
+    instance.write()
+    instance.close()
+
+    assert os.listdir(path.parent) == ["linux-undervolt.prom"]
+    assert 'linux_undervolt_apply_total 0\n' in path.read_text()
+
+
+def test_root_takes_the_path_from_the_service(monkeypatch):
+
+    class Config:
+        def getSettings(self):
+            return {'exporter_path': '/etc/shadow'}
+
+    monkeypatch.setattr(os, "geteuid", lambda: 0)
+    monkeypatch.delenv(exporter.EXPORTER_PATH_VARIABLE, raising=False)
+    assert exporter.settings(Config())['path'] == exporter.EXPORT_FILE
+
+    monkeypatch.setenv(exporter.EXPORTER_PATH_VARIABLE, '/var/lib/node_exporter/linux-undervolt.prom')
+    assert exporter.settings(Config())['path'] == '/var/lib/node_exporter/linux-undervolt.prom'
+
+
+def test_root_gives_new_files_to_the_user(user_home, sysfs):
+
+    stats_file = user_home / "apply-stats.json"
+    exporter.recordApply(0.5, True, str(stats_file))
+
+    path = user_home / "linux-undervolt.prom"
+    instance = exporter.Exporter(str(path), sysfs_root=str(sysfs), stats_file=str(stats_file))
+    instance.write()
+    instance.close()
+
+    assert os.stat(stats_file).st_uid == USER
+    assert os.stat(path).st_uid == USER
+
+
+def test_root_does_not_follow_symlinked_stats(user_home, tmp_path):
+
+    target = tmp_path / "shadow"
+    target.write_text("root:x:0:0\n")
+    (user_home / "apply-stats.json").symlink_to(target)
+
+    exporter.recordApply(0.5, True, str(user_home / "apply-stats.json"))
+
+    assert target.read_text() == "root:x:0:0\n"
+    assert os.stat(target).st_uid == 0
+
+
+def test_root_does_not_write_through_symlinked_directory(user_home, sysfs, tmp_path):
+
+    target = tmp_path / "etc"
+    target.mkdir()
+    (user_home / "export").symlink_to(target)
+
+    instance = exporter.Exporter(str(user_home / "export" / "linux-undervolt.prom"), sysfs_root=str(sysfs),
+                                 stats_file=str(tmp_path / "stats.json"))
+    with pytest.raises(OSError):
+        instance.write()
+    instance.close()
+
+    assert not os.listdir(target)
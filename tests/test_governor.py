@@ -0,0 +1,116 @@
+import pytest
+
+from linux_undervolt.governor import Governor, LoadSensor, Rule, TemperatureSensor, parseRules, replay
+
+RULES = """
+# hot first
+temp > 90 -> 1
+load > 60 and temp < 85 -> 3
+"""
+
+
+def governor(default=None, min_dwell=0.0, **kwargs) -> Governor:
+    return Governor(parseRules(RULES), default, min_dwell=min_dwell,
+                    hysteresis={'load': 10, 'temp': 5, 'power': 3}, **kwargs)
+
+
+def test_rules_are_parsed():
+
+    rules = parseRules(RULES)
+
+    assert [rule.profile for rule in rules] == ['1', '3']
+    assert rules[1].clauses == [('load', '>', 60.0), ('temp', '<', 85.0)]
+
+
+@pytest.mark.parametrize("text", ["temp > 90", "temp >> 90 -> 1", "fan > 1 -> 2", "-> 1"])
+def test_invalid_rules_are_refused(text):
+
+    with pytest.raises(ValueError):
+        Rule.parse(text)
+
+
+def test_first_matching_rule_wins():
+
+    assert governor().select({'load': 80, 'temp': 95}) == (0, '1')
+    assert governor().select({'load': 80, 'temp': 70}) == (1, '3')
+
+
+def test_missing_metric_never_matches():
+
+    assert governor().select({'load': 80}) == (None, None)
+
+
+def test_no_match_withdraws_without_default():
+
+    switches = []
+    instance = governor(on_switch=switches.append)
+
+    instance.update({'load': 80, 'temp': 70}, 0)
+    instance.update({'load': 10, 'temp': 50}, 1)
+
+    assert switches == ['3', None]
+
+
+def test_no_match_selects_the_default_profile():
+
+    assert governor(default='2').select({'load': 10, 'temp': 50}) == (None, '2')
+
+
+def test_hysteresis_keeps_the_rule_in_effect():
+
+    instance = governor()
+    assert instance.update({'load': 80, 'temp': 70}, 0)
+
+    # 55% is below the threshold, but within the hysteresis of the rule in effect
+    assert not instance.update({'load': 55, 'temp': 70}, 1)
+    assert instance.profile == '3'
+
+    assert instance.update({'load': 45, 'temp': 70}, 2)
+    assert instance.profile is None
+
+
+def test_min_dwell_delays_switches():
+
+    instance = governor(min_dwell=30.0)
+    instance.update({'load': 80, 'temp': 70}, 0)
+
+    assert not instance.update({'load': 10, 'temp': 95}, 10)
+    assert instance.update({'load': 10, 'temp': 95}, 30)
+    assert instance.profile == '1'
+
+
+def test_replay_reports_switches():
+
+    samples = [
+        {'time': 0, 'load': 80, 'temp': 70},
+        {'time': 2, 'load': 85, 'temp': 72},
+        {'time': 4, 'load': 30, 'temp': 93},
+        {'time': 6, 'load': 10, 'temp': 50},
+    ]
+
+    assert replay(governor(), samples) == [(0, '3'), (4, '1'), (6, None)]
+
+
+def test_sensors_read_fixture_trees(tmp_path):
+
+    stat = tmp_path / "proc" / "stat"
+    stat.parent.mkdir()
+    stat.write_text("cpu  100 0 100 800 0 0 0 0 0 0\n")
+
+    hwmon = tmp_path / "sys/class/hwmon/hwmon0"
+    hwmon.mkdir(parents=True)
+    (hwmon / "name").write_text("coretemp\n")
+    (hwmon / "temp1_label").write_text("Package id 0\n")
+    (hwmon / "temp1_input").write_text("64000\n")
+    (hwmon / "temp2_label").write_text("Core 0\n")
+    (hwmon / "temp2_input").write_text("70000\n")
+
+    load = LoadSensor(str(tmp_path))
+    assert load.read() is None
+    stat.write_text("cpu  250 0 150 900 0 0 0 0 0 0\n")
+    assert load.read() == pytest.approx(66.666, abs=0.01)
+    load.close()
+
+    temperature = TemperatureSensor(str(tmp_path))
+    assert temperature.read() == 64.0
+    temperature.close()
@@ -0,0 +1,150 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from linux_undervolt.history import HistoryStore
+from linux_undervolt.profiles import ProfileStore
+
+from conftest import USER
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Config:
+    """
+    The parts of config.Config the history records: the general sections and the profiles.
+    """
+
+    def __init__(self, directory):
+        self.settings = {'SETTINGS': {'profile': '0'}}
+        self.profiles = ProfileStore(str(directory))
+
+    def sections(self) -> dict:
+        return json.loads(json.dumps(self.settings))
+
+    def save(self, store: HistoryStore) -> int:
+        version = store.record(self)
+        self.profiles.flush()
+        return version
+
+
+@pytest.fixture
+def config(tmp_path):
+    return Config(tmp_path / "profiles")
+
+
+def test_versions_are_numbered(tmp_path, config):
+
+    store = HistoryStore(str(tmp_path / "history"))
+    config.profiles.create("Battery", {'cpu': '-50'})
+
+    assert [config.save(store) for _ in range(3)] == [0, 1, 2]
+    assert [entry['kind'] for entry in store.entries(2)] == ['save', 'save']
+    assert store.entry(-1)['hash'] == store.entry(0)['hash']
+
+
+def test_identical_states_share_blobs(tmp_path, config):
+
+    store = HistoryStore(str(tmp_path / "history"))
+    config.profiles.create("Battery", {'cpu': '-50'})
+    config.save(store)
+    objects = sorted(os.walk(tmp_path / "history" / "objects"))
+
+    config.settings['SETTINGS']['profile'] = '1'
+    config.save(store)
+    config.settings['SETTINGS']['profile'] = '0'
+    config.save(store)
+
+    # Only the manifest of the second state was added
+    assert sum(len(files) for *_, files in os.walk(tmp_path / "history" / "objects")) == \
+        sum(len(files) for *_, files in objects) + 1
+    assert store.entry(0)['hash'] == store.entry(2)['hash']
+
+
+def test_diff_reports_settings_and_profiles(tmp_path, config):
+
+    store = HistoryStore(str(tmp_path / "history"))
+    battery = config.profiles.create("Battery", {'cpu': '-50', 'gpu': '-20'})
+    old = config.save(store)
+
+    config.settings['SETTINGS']['profile'] = '1'
+    config.profiles.update(battery, {'cpu': '-60'})
+    config.profiles.rename(battery, "Travel")
+    added = config.profiles.create("Gaming", {'cpu': '-30'})
+    new = config.save(store)
+
+    differences = store.diff(old, new)
+
+    assert differences['settings'] == {'SETTINGS.profile': ['0', '1']}
+    assert differences['profiles'][battery]['name'] == ["Battery", "Travel"]
+    assert differences['profiles'][battery]['settings']['cpu'] == ['-50', '-60']
+    assert differences['profiles'][added]['added']
+    assert store.diff(old, new, profile=added) == {"settings": {}, "profiles": {added: differences['profiles'][added]}}
+    assert store.diff(new, new) == {"settings": {}, "profiles": {}}
+
+
+def test_snapshot_survives_a_new_store(tmp_path, config):
+
+    store = HistoryStore(str(tmp_path / "history"))
+    battery = config.profiles.create("Battery", {'cpu': '-50'})
+    config.save(store)
+
+    snapshot = HistoryStore(str(tmp_path / "history")).snapshot(0)
+
+    assert snapshot['settings'] == {'SETTINGS': {'profile': '0'}}
+    assert snapshot['profiles'][battery] == {"name": "Battery", "settings": {'cpu': '-50'}}
+
+
+RESTORE = """
+from linux_undervolt import config, history
+
+conf = config.Config.create_config()
+profile = conf.createProfile("Battery", {'cpu': '-50'})
+conf.flush()
+saved = len(history.getStore()) - 1
+conf.changeProfileSettings({'cpu': '-90'}, profile)
+conf.flush()
+
+restored, _ = history.getStore().restore(saved, apply=False)
+print(config.Config().getProfileSettings(profile)['cpu'], history.getStore().entry(-1)['kind'])
+"""
+
+
+def test_restore_replaces_the_config(tmp_path):
+
+    run = subprocess.run([sys.executable, "-c", RESTORE], cwd=ROOT, env=dict(os.environ, HOME=str(tmp_path)),
+                         stdout=subprocess.PIPE, check=True, text=True)
+
+    cpu, kind = run.stdout.split()
+    assert cpu == '-50'
+    assert kind == 'restore'
+
+
+def test_root_gives_new_directories_to_the_user(user_home, config):
+
+    store = HistoryStore(str(user_home / "history"))
+    config.profiles.create("Battery", {'cpu': '-50'})
+    config.save(store)
+
+    for directory, _, files in os.walk(user_home / "history"):
+        assert os.stat(directory).st_uid == USER
+        assert all(os.stat(os.path.join(directory, name)).st_uid == USER for name in files)
+
+
+def test_root_does_not_follow_symlinked_directories(user_home, config, tmp_path):
+
+    target = tmp_path / "etc"
+    target.mkdir()
+    (user_home / "history").mkdir()
+    os.chown(user_home / "history", USER, USER)
+    (user_home / "history" / "objects").symlink_to(target)
+
+    config.profiles.create("Battery", {'cpu': '-50'})
+    with pytest.raises(OSError):
+        config.save(HistoryStore(str(user_home / "history")))
+
+    assert os.stat(target).st_uid == 0
+    assert not os.listdir(target)
@@ -0,0 +1,102 @@
+import pytest
+
+from linux_undervolt import msr
+from linux_undervolt.msr import FakeMsrDevice, MsrEngine, decodeOffset, decodePowerLimit, encodeOffset, packRequest
+
+
+@pytest.mark.parametrize("millivolts, encoded", [
+    (0, 0x00000000),
+    (-100, 0xF3400000),
+    (-50, 0xF9A00000),
+    (-125, 0xF0000000),
+    (25, 0x03400000),
+])
+def test_offsets_encode_like_intel_undervolt(millivolts, encoded):
+
+    assert encodeOffset(millivolts) == encoded
+
+
+@pytest.mark.parametrize("millivolts", [0, -1, -50, -99.6, -150, -500, 30])
+def test_offsets_round_trip_to_a_step(millivolts):
+
+    assert decodeOffset(encodeOffset(millivolts)) == pytest.approx(millivolts, abs=1 / 1.024 / 2)
+
+
+def test_requests():
+
+    # Write of -100 mV to the cpu plane and read of the gpu plane, as sent by intel-undervolt
+    assert packRequest(0, encodeOffset(-100)) == 0x80000011F3400000
+    assert packRequest(1) == 0x8000011000000000
+
+
+def test_power_limit_decoding():
+
+    # 35 W in 1/8 W units, enabled, window 2^5 * (1 + 2/4) units of 1/1024 s
+    value = 280 | (1 << 15) | (5 << 17) | (2 << 22)
+
+    assert decodePowerLimit(value, 1 / 8, 1 / 1024) == (35.0, 48 / 1024, True)
+
+
+class IgnoringDevice(FakeMsrDevice):
+    """
+    Hardware that drops offset writes and keeps answering with the previous offset.
+    """
+
+    def write(self, register: int, value: int) -> None:
+        if register == msr.MAILBOX and value & (1 << 32):
+            return
+        super().write(register, value)
+
+
+@pytest.fixture
+def sysfs(tmp_path):
+    """
+    Two packages, cpus 0-1 and 2-3.
+    """
+
+    for cpu, package in ((0, 0), (1, 0), (2, 1), (3, 1)):
+        topology = tmp_path / f"sys/devices/system/cpu/cpu{cpu}/topology"
+        topology.mkdir(parents=True)
+        (topology / "physical_package_id").write_text(f"{package}\n")
+    return tmp_path
+
+
+@pytest.fixture
+def engine(sysfs):
+    engine = MsrEngine(str(sysfs / "msr{cpu}"), str(sysfs), FakeMsrDevice)
+    yield engine
+    engine.close()
+
+
+def test_engine_writes_every_package(engine, sysfs):
+
+    applied = engine.apply({'cpu': -50, 'cpu_cache': -50})
+
+    assert applied == {'cpu': pytest.approx(-50, abs=0.5), 'cpu_cache': pytest.approx(-50, abs=0.5)}
+    assert sorted(path.name for path in sysfs.glob("msr*")) == ["msr0", "msr2"]
+    assert engine.read()['cpu'] == pytest.approx(-50, abs=0.5)
+    assert engine.read()['gpu'] == 0
+
+
+def test_engine_refuses_an_offset_that_reads_back_differently(sysfs):
+
+    engine = MsrEngine(str(sysfs / "msr{cpu}"), str(sysfs), IgnoringDevice)
+
+    with pytest.raises(msr.MsrError):
+        engine.apply({'cpu': -50})
+    engine.close()
+
+
+def test_engine_reads_the_limits(engine):
+
+    engine.open()
+    device = engine._devices[0]
+    device.write(msr.RAPL_POWER_UNIT, 3 | (10 << 16))
+    device.write(msr.PKG_POWER_LIMIT, (280 | (1 << 15) | (5 << 17)) | ((360 | (1 << 15)) << 32))
+    device.write(msr.TEMPERATURE_TARGET, 20 << 24)
+
+    limits = engine.readLimits()
+
+    assert limits['pl1'] == 35.0 and limits['pl2'] == 45.0
+    assert limits['pl1_window'] == 32 / 1024
+    assert limits['tjoffset'] == -20
@@ -0,0 +1,113 @@
+import math
+import os
+
+import pytest
+
+from linux_undervolt.telemetry import TelemetryReader, TelemetryRecorder
+
+from conftest import USER
+
+
+def values(result) -> list:
+    return [float(value) for value in result]
+
+
+def test_samples_are_queried_by_range(tmp_path):
+
+    recorder = TelemetryRecorder(str(tmp_path), retention=None)
+    for second in range(10):
+        recorder.append({'package': float(second), 'temperature': 40.0 + second}, timestamp=1000.0 + second)
+    recorder.close()
+
+    reader = TelemetryReader(str(tmp_path))
+    times, power = reader.query('package', 1002.0, 1004.0)
+
+    assert values(times) == [1002.0, 1003.0, 1004.0]
+    assert values(power) == [2.0, 3.0, 4.0]
+    assert reader.metrics() == ['package', 'temperature']
+    reader.close()
+
+
+def test_full_segment_rotates(tmp_path):
+
+    # One page of header and room for about 20 rows of two columns
+    recorder = TelemetryRecorder(str(tmp_path), max_bytes=4096 + 20 * 16, retention=None)
+    for second in range(50):
+        recorder.append({'package': float(second)}, timestamp=1000.0 + second)
+    recorder.close()
+
+    assert len(os.listdir(tmp_path)) == 3
+
+    reader = TelemetryReader(str(tmp_path))
+    times, power = reader.query('package')
+    assert values(power) == [float(second) for second in range(50)]
+    reader.close()
+
+
+def test_new_column_rotates(tmp_path):
+
+    recorder = TelemetryRecorder(str(tmp_path), retention=None)
+    recorder.append({'package': 1.0}, timestamp=1000.0)
+    recorder.append({'package': 2.0, 'core': 3.0}, timestamp=1001.0)
+    recorder.close()
+
+    reader = TelemetryReader(str(tmp_path))
+    times, core = reader.query('core')
+
+    assert len(os.listdir(tmp_path)) == 2
+    assert values(times) == [1001.0]
+    assert values(core) == [3.0]
+    reader.close()
+
+
+def test_old_segments_expire(tmp_path):
+
+    recorder = TelemetryRecorder(str(tmp_path), max_age=10.0, retention=100.0)
+    for second in range(0, 300, 5):
+        recorder.append({'package': 1.0}, timestamp=1000.0 + second)
+    recorder.close()
+
+    reader = TelemetryReader(str(tmp_path))
+    times, _ = reader.query('package')
+
+    # Expired when the last segment was started (at 1290), keeping the one reaching into the retention period
+    assert values(times[:2]) == [1180.0, 1185.0]
+    reader.close()
+
+
+def test_aggregate_skips_missing_values(tmp_path):
+
+    recorder = TelemetryRecorder(str(tmp_path), retention=None)
+    for second in range(6):
+        recorder.append({'package': math.nan if second == 1 else float(second)}, timestamp=1000.0 + second)
+    recorder.close()
+
+    reader = TelemetryReader(str(tmp_path))
+    buckets = reader.aggregate('package', 1000.0, 1006.0, 3.0)
+
+    assert [(bucket['time'], bucket['mean'], bucket['count']) for bucket in buckets] == [(1000.0, 1.0, 2),
+                                                                                          (1003.0, 4.0, 3)]
+    reader.close()
+
+
+def test_root_gives_segments_to_the_user(user_home):
+
+    recorder = TelemetryRecorder(str(user_home / "telemetry"))
+    recorder.append({'package': 1.0})
+    recorder.close()
+
+    assert os.stat(user_home / "telemetry").st_uid == USER
+    assert [os.stat(path).st_uid for path in (user_home / "telemetry").iterdir()] == [USER]
+
+
+def test_root_does_not_follow_symlinked_directory(user_home, tmp_path):
+
+    target = tmp_path / "etc"
+    target.mkdir()
+    (user_home / "telemetry").symlink_to(target)
+
+    with pytest.raises(OSError):
+        TelemetryRecorder(str(user_home / "telemetry")).append({'package': 1.0})
+
+    assert os.stat(target).st_uid == 0
+    assert not os.listdir(target)
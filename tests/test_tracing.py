@@ -0,0 +1,58 @@
+import json
+import os
+
+import pytest
+
+from linux_undervolt import tracing
+
+from conftest import USER
+
+
+def operation(name='config.flush') -> tracing.Span:
+
+    with tracing.Span(name, {}) as span:
+        with tracing.Span('helper.apply', {}):
+            pass
+    return span
+
+
+@pytest.fixture
+def config_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "CONFIG_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_operations_are_appended(config_dir):
+
+    for _ in range(2):
+        tracing._write(operation(), str(config_dir / "trace.json"), str(config_dir / "timing.log"))
+
+    # The trace array is never closed, which the viewers accept
+    events = json.loads((config_dir / "trace.json").read_text().rstrip(',\n') + ']')
+    assert [event['name'] for event in events] == ['config.flush', 'helper.apply'] * 2
+
+    lines = (config_dir / "timing.log").read_text().splitlines()
+    assert len(lines) == 2 and ' config.flush ' in lines[0] and 'helper.apply=' in lines[0]
+
+
+def test_root_gives_new_files_to_the_user(user_home, monkeypatch):
+
+    monkeypatch.setattr(tracing, "CONFIG_DIR", str(user_home))
+    tracing._write(operation(), str(user_home / "trace.json"), str(user_home / "timing.log"))
+
+    assert os.stat(user_home / "trace.json").st_uid == USER
+    assert os.stat(user_home / "timing.log").st_uid == USER
+
+
+@pytest.mark.parametrize("link", [os.symlink, os.link])
+def test_root_does_not_write_linked_files(user_home, monkeypatch, tmp_path, link):
+
+    monkeypatch.setattr(tracing, "CONFIG_DIR", str(user_home))
+    target = tmp_path / "shadow"
+    target.write_text("root:x:0:0\n")
+    link(target, user_home / "timing.log")
+
+    tracing._write(operation(), str(user_home / "trace.json"), str(user_home / "timing.log"))
+
+    assert target.read_text() == "root:x:0:0\n"
+    assert os.stat(target).st_uid == 0
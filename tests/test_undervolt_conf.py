@@ -0,0 +1,106 @@
+from linux_undervolt.undervolt_conf import UndervoltConf
+
+CONF = """# Enable the undervolt
+enable yes
+
+undervolt 0 'CPU' 0
+undervolt 1 'GPU' 0
+undervolt 2 'CPU Cache' 0
+undervolt 3 'System Agent' 0
+undervolt 4 'Analog I/O' 0
+
+# Daemon Update Interval
+interval 5000
+"""
+
+LIMITED = {'cpu': -50, 'pl1': '35', 'pl2': '45', 'tjoffset': '-20', 'hwphint': 'switch load:single:0.90 performance power'}
+
+
+def switch(text: str, *profiles) -> str:
+    """
+    Render the profiles one after another, each onto the file the previous one left.
+    """
+
+    for settings in profiles:
+        text = UndervoltConf(text).render(settings)
+    return text
+
+
+def test_unchanged_profile_keeps_bytes():
+
+    assert UndervoltConf(CONF).render({'cpu': 0}) == CONF
+
+
+def test_limits_are_written():
+
+    conf = UndervoltConf(switch(CONF, LIMITED))
+
+    assert conf.undervolt()['cpu'] == -50
+    assert conf.limits() == {'pl2': 45, 'pl1': 35, 'tjoffset': -20, 'hwphint': 'switch load:single:0.90 performance power'}
+
+
+def test_switching_away_removes_limits():
+
+    text = switch(CONF, LIMITED, {'cpu': -10})
+    conf = UndervoltConf(text)
+
+    assert conf.undervolt()['cpu'] == -10
+    assert conf.limits() == {}
+    assert 'power package' not in text and 'tjoffset' not in text and 'hwphint' not in text
+    assert 'interval 5000' in text
+
+
+def test_switching_removes_only_unset_limits():
+
+    conf = UndervoltConf(switch(CONF, LIMITED, {'cpu': -30, 'tjoffset': '-10'}))
+
+    assert conf.limits() == {'tjoffset': -10}
+
+
+def test_switching_back_and_forth_is_stable():
+
+    once = switch(CONF, LIMITED, {'cpu': -10})
+    twice = switch(once, LIMITED, {'cpu': -10})
+
+    assert twice == once
+    assert switch(once, {'cpu': 0}) == CONF
+    assert switch(CONF, LIMITED) == switch(CONF, LIMITED, {'cpu': -10}, LIMITED)
+
+
+HAND_WRITTEN = CONF + "tjoffset -15\nhwphint force load:multi:0.5 performance power\nhwphint switch load:single:0.9 performance power\n"
+
+
+def test_written_limits_are_marked():
+
+    text = switch(CONF, LIMITED)
+
+    assert "tjoffset -20 # linux-undervolt\n" in text
+    assert switch(text, dict(LIMITED, tjoffset='-25')).count('# linux-undervolt') == 3
+
+
+def test_hand_written_limits_survive_profiles_without_limits():
+
+    assert switch(HAND_WRITTEN, {'cpu': -10}, {'cpu': 0}) == HAND_WRITTEN
+
+
+def test_hand_written_limits_are_set_aside_and_restored():
+
+    text = switch(HAND_WRITTEN, LIMITED)
+    conf = UndervoltConf(text)
+
+    assert conf.limits()['tjoffset'] == -20
+    assert conf.limits()['hwphint'] == LIMITED['hwphint']
+    assert "#linux-undervolt: tjoffset -15\n" in text
+
+    restored = switch(text, {'cpu': 0})
+    assert restored == HAND_WRITTEN
+    assert UndervoltConf(restored).limits()['tjoffset'] == -15
+
+
+def test_only_the_limits_of_the_profile_set_hand_written_lines_aside():
+
+    text = switch(HAND_WRITTEN, {'cpu': 0, 'tjoffset': '-30'})
+
+    assert "#linux-undervolt: tjoffset -15\n" in text
+    assert "hwphint force load:multi:0.5 performance power\n" in text
+    assert switch(text, {'cpu': 0}) == HAND_WRITTEN
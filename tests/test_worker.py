@@ -0,0 +1,52 @@
+import threading
+
+from linux_undervolt.worker import BackgroundWorker
+
+
+def test_only_the_latest_queued_job_runs():
+
+    worker = BackgroundWorker()
+    started = threading.Event()
+    release = threading.Event()
+    done = threading.Event()
+    ran = []
+
+    def job(value):
+        def function(job):
+            if value == 'first':
+                started.set()
+                release.wait(5)
+            ran.append(value)
+            return value
+        return function
+
+    worker.submit("apply", job('first'))
+    assert started.wait(5)
+    worker.submit("apply", job('second'))
+    worker.submit("apply", job('third'), lambda *_: done.set())
+
+    assert worker.waiting("apply")
+    release.set()
+    assert done.wait(5)
+
+    assert ran == ['first', 'third']
+    worker.shutdown()
+
+
+def test_cancelled_job_reports_nothing():
+
+    worker = BackgroundWorker()
+    started = threading.Event()
+    release = threading.Event()
+    results = []
+
+    worker.submit("apply", lambda job: started.set() or release.wait(5))
+    assert started.wait(5)
+    worker.submit("apply", lambda job: 'queued', lambda job, result, error: results.append(result))
+
+    assert worker.cancel("apply", running=False)
+    assert not worker.waiting("apply")
+    release.set()
+    worker.shutdown()
+
+    assert results == []
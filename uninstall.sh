@@ -1,4 +1,4 @@
 #!/bin/bash
 
-# Remove the Udev rule from the system if it was created. 
-python3 -c "from linux_undervolt import backend; backend.removeUdevRule()"
+# Remove the power watcher service (and the udev rule of older versions) from the system if it was created.
+python3 -c "from linux_undervolt import backend; backend.removePowerWatcher()"